@@ -0,0 +1,226 @@
+import os
+import time
+import gzip
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from Utility.config import startup_value
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Record/replay cassettes for Azure OpenAI calls
+# -------------------------------
+# With LLM_CASSETTE set, the chat and embedding clients in mylang4 send their
+# HTTP requests through a cassette transport. Requests are keyed by a hash of
+# method, path, query and canonical JSON body (the host and api key are left
+# out, so a cassette recorded against Azure replays against any endpoint).
+# Responses are stored with the latency they took and their token usage, one
+# gzip member per JSON line, appended as they arrive.
+#
+#   record  every call goes to the network and successful responses are saved
+#   replay  every call is answered from the cassette; a miss is a 404
+#   auto    replay hits, record misses
+#
+# Replays sleep the recorded latency times LLM_CASSETTE_LATENCY ('original',
+# 'zero' or a factor). Identical requests recorded more than once replay their
+# responses in recorded order, cycling. Cassettes are off unless LLM_CASSETTE
+# is set; record with one process per file, in the environment you replay in
+# (with and without tiktoken, embedding requests carry different bodies).
+
+CASSETTE_PATH = startup_value('LLM_CASSETTE')
+CASSETTE_MODE = startup_value('LLM_CASSETTE_MODE', 'replay')
+CASSETTE_LATENCY = startup_value('LLM_CASSETTE_LATENCY', 'original')
+MODES = ('record', 'replay', 'auto')
+
+
+def _latency_scale(value: str) -> float:
+    named = {'original': 1.0, 'zero': 0.0}
+    value = value.strip().lower()
+    return named[value] if value in named else float(value)
+
+
+def request_key(request: httpx.Request) -> str:
+    """sha256 of what determines the response: method, path, sorted query and canonical body"""
+    body = request.content
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode()
+    except ValueError:
+        pass
+    query = '&'.join(sorted(f"{key}={value}" for key, value in request.url.params.multi_items()))
+    digest = hashlib.sha256(f"{request.method} {request.url.path}?{query}\n".encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class Cassette:
+    """Recorded responses keyed by request hash, backed by an append-only gzip JSON-lines file"""
+
+    def __init__(self, path: str, mode: str = 'replay', latency_scale: float = 1.0):
+        if mode not in MODES:
+            raise ValueError(f"Cassette mode must be one of {MODES}, not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.stats = {'hits': 0, 'misses': 0, 'recorded': 0}
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry['key'], []).append(entry)
+        logger.info(f"Cassette {path} ({mode}): {sum(map(len, self._entries.values()))} responses for {len(self._entries)} requests")
+
+    def __len__(self) -> int:
+        return sum(map(len, self._entries.values()))
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """The next recorded response for `key`, cycling through repeats"""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.stats['misses'] += 1
+                return None
+            position = self._cursor.get(key, 0)
+            self._cursor[key] = position + 1
+            self.stats['hits'] += 1
+            return entries[position % len(entries)]
+
+    def record(self, key: str, request: httpx.Request, response: httpx.Response, latency: float) -> None:
+        try:
+            usage = response.json().get('usage')
+        except ValueError:
+            usage = None
+        entry = {
+            'key': key,
+            'method': request.method,
+            'path': request.url.path,
+            'status': response.status_code,
+            'content_type': response.headers.get('content-type', 'application/json'),
+            'body': response.text,
+            'latency': round(latency, 4),
+            'usage': usage,
+            'recorded_at': time.time(),
+        }
+        member = gzip.compress((json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8'))
+        with self._lock:
+            # One write of one complete gzip member, so a crash never leaves a torn record
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, member)
+            finally:
+                os.close(fd)
+            self._entries.setdefault(key, []).append(entry)
+            self.stats['recorded'] += 1
+
+    def delay(self, entry: Dict[str, Any]) -> float:
+        return entry['latency'] * self.latency_scale
+
+    @staticmethod
+    def response(entry: Dict[str, Any], request: httpx.Request) -> httpx.Response:
+        return httpx.Response(entry['status'], headers={'content-type': entry['content_type'], 'x-cassette': 'replay'},
+                              content=entry['body'].encode('utf-8'), request=request)
+
+    @staticmethod
+    def miss_response(key: str, request: httpx.Request) -> httpx.Response:
+        # An HTTP error rather than an exception: openai retries transport
+        # exceptions and would hide the message, but raises NotFoundError at once
+        message = f"No cassette response for {request.method} {request.url.path} (request hash {key[:12]})"
+        logger.error(message)
+        return httpx.Response(404, json={'error': {'code': 'CassetteMiss', 'message': message}}, request=request)
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """httpx transport that answers from, and records into, a Cassette"""
+
+    def __init__(self, cassette: Cassette, wrapped: httpx.BaseTransport = None):
+        self.cassette = cassette
+        self.wrapped = wrapped or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        key = request_key(request)
+        if self.cassette.mode != 'record':
+            entry = self.cassette.lookup(key)
+            if entry is not None:
+                time.sleep(self.cassette.delay(entry))
+                return self.cassette.response(entry, request)
+            if self.cassette.mode == 'replay':
+                return self.cassette.miss_response(key, request)
+        started = time.perf_counter()
+        response = self.wrapped.handle_request(request)
+        response.read()
+        if response.status_code < 400:
+            self.cassette.record(key, request, response, time.perf_counter() - started)
+        return response
+
+    def close(self) -> None:
+        self.wrapped.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    """CassetteTransport for the async clients behind ainvoke"""
+
+    def __init__(self, cassette: Cassette, wrapped: httpx.AsyncBaseTransport = None):
+        self.cassette = cassette
+        self.wrapped = wrapped or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = request_key(request)
+        if self.cassette.mode != 'record':
+            entry = self.cassette.lookup(key)
+            if entry is not None:
+                await asyncio.sleep(self.cassette.delay(entry))
+                return self.cassette.response(entry, request)
+            if self.cassette.mode == 'replay':
+                return self.cassette.miss_response(key, request)
+        started = time.perf_counter()
+        response = await self.wrapped.handle_async_request(request)
+        await response.aread()
+        if response.status_code < 400:
+            # The file append is small and rare enough to do on the loop
+            self.cassette.record(key, request, response, time.perf_counter() - started)
+        return response
+
+    async def aclose(self) -> None:
+        await self.wrapped.aclose()
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """The process-wide cassette from LLM_CASSETTE*, or None when cassettes are off"""
+    global _cassette
+    if not CASSETTE_PATH:
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE, _latency_scale(CASSETTE_LATENCY))
+    return _cassette
+
+
+def llm_client_kwargs(cassette: Optional[Cassette] = None) -> Dict[str, Any]:
+    """http_client/http_async_client arguments for the langchain_openai clients; {} when off"""
+    if cassette is None:
+        cassette = get_cassette()
+    if cassette is None:
+        return {}
+    # openai's own client defaults; plain httpx clients work with every openai 1.x
+    timeout = httpx.Timeout(600.0, connect=5.0)
+    limits = httpx.Limits(max_connections=1000, max_keepalive_connections=100)
+    return {
+        'http_client': httpx.Client(transport=CassetteTransport(cassette), timeout=timeout,
+                                    limits=limits, follow_redirects=True),
+        'http_async_client': httpx.AsyncClient(transport=AsyncCassetteTransport(cassette), timeout=timeout,
+                                               limits=limits, follow_redirects=True),
+    }
@@ -0,0 +1,208 @@
+import json
+import mmap
+import struct
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Native chunk store serialization
+# -------------------------------
+# Replaces the pickled LangChain docstore. The file is a small JSON table of
+# contents followed by 8-byte aligned sections:
+#   - ids / text / extra   length-prefixed UTF-8 (uint32 lengths + blob)
+#   - numeric columns      one little-endian array per key
+#   - categorical columns  uint16 codes into a shared string table
+# Arrays are read with np.frombuffer straight off the mmap, so opening a
+# store copies nothing; a chunk's text and metadata are decoded on access.
+
+CHUNKSTORE_MAGIC = b"QMCS"
+CHUNKSTORE_VERSION = 2
+_PREAMBLE = struct.Struct("<4sIQI")  # magic, version, record count, toc length
+
+# Metadata keys stored as typed columns; everything else goes to `extra`
+NUMERIC_COLUMNS = {
+    'word_count': '<i8',
+    'page': '<i8',
+    'start_index': '<i8',
+    'quality_score': '<f8',
+}
+CATEGORICAL_COLUMNS = ('content_type', 'subject', 'grade')
+
+_INT_MISSING = -1
+_CODE_MISSING = 0xFFFF
+
+
+def _fits_column(key: str, value: Any) -> bool:
+    """True if a metadata value can be stored in its typed column"""
+    if key in CATEGORICAL_COLUMNS:
+        return isinstance(value, str)
+    if key not in NUMERIC_COLUMNS or isinstance(value, bool):
+        return False
+    if NUMERIC_COLUMNS[key].endswith("f8"):
+        return isinstance(value, (int, float))
+    return isinstance(value, int) and value != _INT_MISSING
+
+
+def _encode_strings(values: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Encode strings as a uint32 length array plus a UTF-8 blob"""
+    encoded = [value.encode("utf-8") for value in values]
+    lengths = np.fromiter((len(b) for b in encoded), dtype="<u4", count=len(encoded))
+    blob = np.frombuffer(b"".join(encoded), dtype="u1")
+    return {"lengths": lengths, "blob": blob}
+
+
+def write_chunkstore(path: str, ids: Sequence[str], texts: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> None:
+    """Serialize chunk ids, text and metadata into a chunk store file"""
+    count = len(texts)
+    sections: Dict[str, np.ndarray] = {}
+
+    for name, values in (("ids", ids), ("text", texts)):
+        encoded = _encode_strings(values)
+        sections[f"{name}.lengths"] = encoded["lengths"]
+        sections[f"{name}.blob"] = encoded["blob"]
+
+    extras: List[Dict[str, Any]] = [{} for _ in range(count)]
+    for position, metadata in enumerate(metadatas):
+        for key, value in metadata.items():
+            if not _fits_column(key, value):
+                extras[position][key] = value
+
+    for key, dtype in NUMERIC_COLUMNS.items():
+        missing = np.nan if dtype.endswith("f8") else _INT_MISSING
+        column = np.full(count, missing, dtype=dtype)
+        for position, metadata in enumerate(metadatas):
+            value = metadata.get(key)
+            if _fits_column(key, value):
+                column[position] = value
+        sections[f"num.{key}"] = column
+
+    string_table: List[str] = []
+    string_codes: Dict[str, int] = {}
+    for key in CATEGORICAL_COLUMNS:
+        codes = np.full(count, _CODE_MISSING, dtype="<u2")
+        for position, metadata in enumerate(metadatas):
+            value = metadata.get(key)
+            if not _fits_column(key, value):
+                continue
+            if value not in string_codes:
+                if len(string_table) >= _CODE_MISSING:
+                    raise ValueError(f"Too many distinct values for categorical column '{key}'")
+                string_codes[value] = len(string_table)
+                string_table.append(value)
+            codes[position] = string_codes[value]
+        sections[f"cat.{key}"] = codes
+
+    encoded = _encode_strings(string_table)
+    sections["strings.lengths"] = encoded["lengths"]
+    sections["strings.blob"] = encoded["blob"]
+
+    encoded = _encode_strings([json.dumps(extra, ensure_ascii=False) if extra else "" for extra in extras])
+    sections["extra.lengths"] = encoded["lengths"]
+    sections["extra.blob"] = encoded["blob"]
+
+    # Lay out sections after the table of contents, each 8-byte aligned
+    toc: Dict[str, Dict[str, Any]] = {}
+    toc_bytes = b""
+    while True:  # repeat until the toc's own size stops shifting the offsets
+        offset = _PREAMBLE.size + len(toc_bytes)
+        for name, array in sections.items():
+            offset += -offset % 8
+            toc[name] = {"offset": offset, "dtype": array.dtype.str, "count": int(array.size)}
+            offset += array.nbytes
+        encoded_toc = json.dumps(toc, sort_keys=True).encode("utf-8")
+        settled = len(encoded_toc) == len(toc_bytes)
+        toc_bytes = encoded_toc
+        if settled:
+            break
+
+    with open(path, "wb") as f:
+        f.write(_PREAMBLE.pack(CHUNKSTORE_MAGIC, CHUNKSTORE_VERSION, count, len(toc_bytes)))
+        f.write(toc_bytes)
+        for name, array in sections.items():
+            f.write(b"\0" * (toc[name]["offset"] - f.tell()))
+            f.write(array.tobytes())
+
+
+class ChunkStore:
+    """Read-only, memory-mapped view over a chunk store file"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, toc_len = _PREAMBLE.unpack_from(self._mm, 0)
+        if magic != CHUNKSTORE_MAGIC or version != CHUNKSTORE_VERSION:
+            raise ValueError(f"Unsupported chunk store file: {path}")
+
+        self._count = count
+        self._toc = json.loads(self._mm[_PREAMBLE.size:_PREAMBLE.size + toc_len].decode("utf-8"))
+
+        self._string_offsets = {}
+        for name in ("ids", "text", "extra", "strings"):
+            lengths = self._array(f"{name}.lengths")
+            offsets = np.zeros(lengths.size + 1, dtype="<u8")
+            np.cumsum(lengths, out=offsets[1:])
+            self._string_offsets[name] = offsets
+
+        # The string table holds only distinct categorical values; decode it once
+        self.string_table = [self._string("strings", i) for i in range(self._array("strings.lengths").size)]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _array(self, name: str) -> np.ndarray:
+        entry = self._toc[name]
+        return np.frombuffer(self._mm, dtype=np.dtype(entry["dtype"]), count=entry["count"], offset=entry["offset"])
+
+    def _string(self, name: str, position: int) -> str:
+        base = self._toc[f"{name}.blob"]["offset"]
+        offsets = self._string_offsets[name]
+        return self._mm[base + int(offsets[position]):base + int(offsets[position + 1])].decode("utf-8")
+
+    def column(self, key: str) -> np.ndarray:
+        """Zero-copy array for a numeric column, or uint16 codes for a categorical one"""
+        if key in NUMERIC_COLUMNS:
+            return self._array(f"num.{key}")
+        if key in CATEGORICAL_COLUMNS:
+            return self._array(f"cat.{key}")
+        raise KeyError(f"'{key}' is not a columnar metadata key")
+
+    def code_for(self, value: str) -> Optional[int]:
+        """String table code for a categorical value, or None if absent"""
+        try:
+            return self.string_table.index(value)
+        except ValueError:
+            return None
+
+    def get_id(self, position: int) -> str:
+        return self._string("ids", position)
+
+    def get_text(self, position: int) -> str:
+        return self._string("text", position)
+
+    def get_metadata(self, position: int) -> Dict[str, Any]:
+        extra = self._string("extra", position)
+        metadata = json.loads(extra) if extra else {}
+
+        for key, dtype in NUMERIC_COLUMNS.items():
+            value = self._array(f"num.{key}")[position]
+            if dtype.endswith("f8"):
+                if not np.isnan(value):
+                    metadata[key] = float(value)
+            elif value != _INT_MISSING:
+                metadata[key] = int(value)
+
+        for key in CATEGORICAL_COLUMNS:
+            code = self._array(f"cat.{key}")[position]
+            if code != _CODE_MISSING:
+                metadata[key] = self.string_table[code]
+
+        return metadata
+
+    def get(self, position: int) -> Document:
+        return Document(page_content=self.get_text(position), metadata=self.get_metadata(position))
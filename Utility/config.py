@@ -0,0 +1,203 @@
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass, fields
+from typing import Callable, Dict, List, Mapping, Optional, Set
+
+from dotenv import dotenv_values
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Settings snapshot with .env hot reload
+# -------------------------------
+# Settings are read once from the environment overlaid with `.env` (the file
+# wins, as load_dotenv(override=True) did) into a frozen dataclass. A daemon
+# thread polls the file's mtime and swaps in a new snapshot when it changes;
+# the swap is a single reference assignment, so request code holding a
+# snapshot never sees a half-updated config and os.environ is never mutated.
+# Listeners are told which fields changed so dependent clients can rebuild.
+
+ENV_FILE = os.getenv('ENV_FILE', '.env')
+POLL_SECONDS = float(os.getenv('CONFIG_POLL_SECONDS', '2'))
+
+
+def _flag(value: Optional[str]) -> bool:
+    return (value or '').strip().lower() in ('1', 'true', 'yes')
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Immutable view of the configuration the request path reads"""
+
+    azure_openai_api_key: Optional[str] = None
+    azure_openai_endpoint: Optional[str] = None
+    azure_openai_api_version: str = '2024-02-15-preview'
+    azure_openai_chat_deployment: str = 'gpt-4.1'
+    aws_access_key_id: Optional[str] = None
+    aws_secret_access_key: Optional[str] = None
+    aws_region: str = 'us-east-1'
+    s3_bucket: Optional[str] = None
+    notes_bucket: Optional[str] = None
+    google_form_webhook_url: Optional[str] = None
+    n8n_webhook_url: Optional[str] = None
+    pack_small_topics: bool = False
+    pack_token_budget: int = 8000
+    verifier_context_mode: str = 'full'
+    chunking_mode: str = 'token'
+    extractive_summaries: bool = False
+    # Read once at start-up; changing them needs a worker restart
+    mongodb_uri: str = 'mongodb://localhost:27017'
+    db_name: str = 'question_paper_db'
+    request_collection: str = 'question_requests'
+    paper_collection: str = 'question_papers'
+    log_file: Optional[str] = None
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backup_count: int = 5
+    log_payload_sample_rate: float = 0.05
+    log_payload_max_chars: int = 2000
+
+    @classmethod
+    def from_mapping(cls, values: Mapping[str, Optional[str]]) -> "Settings":
+        get = lambda key, default=None: values.get(key) or default
+        return cls(
+            azure_openai_api_key=get('AZURE_OPENAI_API_KEY'),
+            azure_openai_endpoint=get('AZURE_OPENAI_ENDPOINT'),
+            azure_openai_api_version=get('AZURE_OPENAI_API_VERSION', cls.azure_openai_api_version),
+            azure_openai_chat_deployment=get('AZURE_OPENAI_CHAT_DEPLOYMENT', cls.azure_openai_chat_deployment),
+            aws_access_key_id=get('AWS_ACCESS_KEY_ID'),
+            aws_secret_access_key=get('AWS_SECRET_ACCESS_KEY'),
+            aws_region=get('AWS_REGION', cls.aws_region),
+            s3_bucket=get('S3_BUCKET_NAME'),
+            notes_bucket=get('NOTES_BUCKET_NAME'),
+            google_form_webhook_url=get('GOOGLE_FORM_WEBHOOK_URL'),
+            n8n_webhook_url=get('N8N_WEBHOOK_URL'),
+            pack_small_topics=_flag(get('PACK_SMALL_TOPICS')),
+            pack_token_budget=int(get('PACK_TOKEN_BUDGET', cls.pack_token_budget)),
+            verifier_context_mode=get('VERIFIER_CONTEXT_MODE', cls.verifier_context_mode),
+            chunking_mode=get('CHUNKING_MODE', cls.chunking_mode),
+            extractive_summaries=_flag(get('EXTRACTIVE_SUMMARIES')),
+            mongodb_uri=get('MONGODB_URI', cls.mongodb_uri),
+            db_name=get('DB_NAME', cls.db_name),
+            request_collection=get('REQUEST_COLLECTION', cls.request_collection),
+            paper_collection=get('PAPER_COLLECTION', cls.paper_collection),
+            log_file=get('LOG_FILE'),
+            log_max_bytes=int(get('LOG_MAX_BYTES', cls.log_max_bytes)),
+            log_backup_count=int(get('LOG_BACKUP_COUNT', cls.log_backup_count)),
+            log_payload_sample_rate=float(get('LOG_PAYLOAD_SAMPLE_RATE', cls.log_payload_sample_rate)),
+            log_payload_max_chars=int(get('LOG_PAYLOAD_MAX_CHARS', cls.log_payload_max_chars)),
+        )
+
+    def changed_fields(self, other: "Settings") -> Set[str]:
+        return {f.name for f in fields(self) if getattr(self, f.name) != getattr(other, f.name)}
+
+
+class ConfigStore:
+    """Holds the current Settings and reloads them when the env file changes"""
+
+    def __init__(self, env_file: str = ENV_FILE):
+        self.env_file = env_file
+        self._settings: Optional[Settings] = None
+        self._mtime: Optional[int] = None
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[Settings, Settings, Set[str]], None]] = []
+        self._watcher: Optional[threading.Thread] = None
+
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.env_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def read_values(self) -> Dict[str, Optional[str]]:
+        """The environment overlaid with the env file, read now"""
+        values: Dict[str, Optional[str]] = dict(os.environ)
+        if os.path.exists(self.env_file):
+            values.update({key: value for key, value in dotenv_values(self.env_file).items() if value is not None})
+        return values
+
+    def _read(self) -> Settings:
+        return Settings.from_mapping(self.read_values())
+
+    def get(self) -> Settings:
+        """The current snapshot; loaded on first use"""
+        settings = self._settings
+        if settings is None:
+            with self._lock:
+                if self._settings is None:
+                    self._mtime = self._file_mtime()
+                    self._settings = self._read()
+                settings = self._settings
+        return settings
+
+    def on_change(self, listener: Callable[[Settings, Settings, Set[str]], None]) -> None:
+        """Call `listener(old, new, changed_fields)` after each reload that changes something"""
+        self._listeners.append(listener)
+
+    def reload_if_changed(self) -> bool:
+        """Swap in a new snapshot if the env file's mtime moved; True if settings changed"""
+        old = self.get()
+        mtime = self._file_mtime()
+        if mtime == self._mtime:
+            return False
+        with self._lock:
+            self._mtime = mtime
+            try:
+                new = self._read()
+            except Exception as e:
+                logger.error(f"Keeping previous config; failed to read {self.env_file}: {e}")
+                return False
+            changed = new.changed_fields(old)
+            if not changed:
+                return False
+            self._settings = new
+        logger.info(f"Reloaded {self.env_file}; changed: {sorted(changed)}")
+        for listener in self._listeners:
+            try:
+                listener(old, new, changed)
+            except Exception as e:
+                logger.error(f"Config change listener failed: {e}")
+        return True
+
+    def start_watcher(self, interval: float = POLL_SECONDS) -> None:
+        """Poll the env file from a daemon thread (once per process)"""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self.get()
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    logger.error(f"Config watcher error: {e}")
+
+        self._watcher = threading.Thread(target=watch, name='config-watcher', daemon=True)
+        self._watcher.start()
+
+    def _restart_after_fork(self) -> None:
+        # The watcher thread (and any lock it held) did not survive the fork
+        self._lock = threading.Lock()
+        if self._watcher is not None:
+            self._watcher = None
+            self.start_watcher()
+
+
+config = ConfigStore()
+os.register_at_fork(after_in_child=config._restart_after_fork)
+
+
+def get_settings() -> Settings:
+    """The current immutable settings snapshot"""
+    return config.get()
+
+
+def startup_value(key: str, default: Optional[str] = None) -> Optional[str]:
+    """A process-level tunable (pool size, memory limit, path) read at import
+
+    Same sources and precedence as Settings, so these can live in the env
+    file too; they are not hot reloaded.
+    """
+    return config.read_values().get(key) or default
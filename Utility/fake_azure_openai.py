@@ -0,0 +1,332 @@
+import re
+import json
+import time
+import uuid
+import zlib
+import base64
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Offline Azure OpenAI stand-in
+# -------------------------------
+# A local HTTP server speaking the Azure OpenAI wire format for chat
+# completions and embeddings, so mylang4 and app.py run without credentials
+# or network: point AZURE_OPENAI_ENDPOINT at it (any API key works).
+# Replies are deterministic functions of the prompt: question prompts get
+# the requested number of templated questions, packed prompts one entry per
+# topic id, verifier prompts a verdict (REJECTED for a stable `reject_rate`
+# share of prompts, to exercise revisions). Embeddings hash words into a
+# unit vector, so texts sharing words land near each other. Latency is drawn
+# from a seeded distribution per call, and a `rate_limit` share of calls is
+# answered 429 with Retry-After, as Azure does past its quota.
+#
+#   python -m Utility.fake_azure_openai --port 8089 --chat-latency lognormal:1.2,0.4 --rate-limit 0.05
+#   AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8089 AZURE_OPENAI_API_KEY=fake python app.py
+
+DISTRIBUTIONS = ('fixed', 'uniform', 'normal', 'lognormal', 'exponential')
+
+
+class LatencyModel:
+    """Seconds per call from a spec such as 'fixed:0.5', 'uniform:0.2,1.0',
+    'normal:1.0,0.2', 'lognormal:1.2,0.4' (median, sigma) or 'exponential:0.8' (mean)
+    """
+
+    def __init__(self, spec: str = 'fixed:0', rng: random.Random = None):
+        name, _, params = spec.partition(':')
+        if name not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {name!r}; expected one of {DISTRIBUTIONS}")
+        self.spec = spec
+        self.name = name
+        self.params = [float(p) for p in params.split(',') if p.strip()] or [0.0]
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        p = self.params
+        with self._lock:
+            if self.name == 'fixed':
+                seconds = p[0]
+            elif self.name == 'uniform':
+                seconds = self.rng.uniform(p[0], p[1])
+            elif self.name == 'normal':
+                seconds = self.rng.gauss(p[0], p[1])
+            elif self.name == 'lognormal':
+                seconds = p[0] * self.rng.lognormvariate(0.0, p[1])
+            else:
+                seconds = self.rng.expovariate(1.0 / p[0]) if p[0] > 0 else 0.0
+        return max(0.0, seconds)
+
+
+def approximate_tokens(text: str) -> int:
+    """About 4 characters per token, like count_tokens without an encoder"""
+    return max(1, len(text) // 4)
+
+
+def _digest(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'big')
+
+
+def _questions(topic: str, count: int, question_type: str, seed: int) -> List[Dict[str, Any]]:
+    questions = []
+    for i in range(count):
+        options = [f"{topic} option {chr(65 + j)}" for j in range(4)]
+        answer = options[(seed + i) % 4]
+        questions.append({
+            'question': f"[{question_type}] Question {i + 1} on {topic}: which statement is correct?",
+            'options': options,
+            'answer': answer,
+            'explanation': f"{answer} is correct because it follows from the {topic} context.",
+        })
+    return questions
+
+
+def _field(prompt: str, label: str, default: str) -> str:
+    match = re.search(rf"^\s*{re.escape(label)}:\s*(.+?)\s*$", prompt, re.MULTILINE)
+    return match.group(1) if match else default
+
+
+def chat_reply(prompt: str, reject_rate: float = 0.0) -> str:
+    """Deterministic reply content for a rendered mylang4 prompt"""
+    seed = _digest(prompt)
+    if '"overall_verdict"' in prompt:
+        rejected = (seed % 10000) / 10000 < reject_rate
+        score = 55 if rejected else 88
+        return json.dumps({
+            'overall_verdict': 'REJECTED' if rejected else 'ACCEPTED',
+            'confidence_score': score,
+            'detailed_feedback': {key: score for key in (
+                'relevance_score', 'difficulty_alignment', 'bloom_taxonomy_alignment',
+                'subject_grade_alignment', 'overall_quality')},
+            'specific_issues': ['Distractors are too similar'] if rejected else [],
+            'improvement_suggestions': ['Make the distractors clearly distinct'] if rejected else [],
+        })
+
+    packed = re.findall(r"^- \[([^\]]+)\] (\d+) (\S+) questions; Topic: ([^;]*);", prompt, re.MULTILINE)
+    if packed:
+        return json.dumps({'topics': {
+            topic_id: {'questions': _questions(topic, int(count), question_type, seed)}
+            for topic_id, count, question_type, topic in packed
+        }})
+
+    requested = re.search(r"Generate exactly (\d+) (\S+) questions", prompt)
+    if requested:
+        topic = _field(prompt, 'Topic', 'the topic')
+        return json.dumps({'questions': _questions(topic, int(requested.group(1)), requested.group(2), seed)})
+
+    return "OK"
+
+
+def embed(text: str, dimensions: int) -> np.ndarray:
+    """Unit vector of hashed, signed word counts"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        h = zlib.crc32(word.encode('utf-8'))
+        vector[h % dimensions] += 1.0 if (h >> 31) & 1 else -1.0
+    norm = float(np.linalg.norm(vector))
+    if norm == 0.0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+
+class FakeAzureOpenAI:
+    """In-process or standalone server; `endpoint` is the AZURE_OPENAI_ENDPOINT to use"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, chat_latency: str = 'fixed:0',
+                 embedding_latency: str = 'fixed:0', seconds_per_output_token: float = 0.0,
+                 rate_limit: float = 0.0, retry_after: float = 1.0, reject_rate: float = 0.0,
+                 embedding_dimensions: int = 3072, seed: int = 0):
+        rng = random.Random(seed)
+        self.chat_latency = LatencyModel(chat_latency, random.Random(rng.random()))
+        self.embedding_latency = LatencyModel(embedding_latency, random.Random(rng.random()))
+        self.seconds_per_output_token = seconds_per_output_token
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.reject_rate = reject_rate
+        self.embedding_dimensions = embedding_dimensions
+        self._rng = random.Random(rng.random())
+        self._lock = threading.Lock()
+        self.stats = {'chat': 0, 'embeddings': 0, 'embedded_inputs': 0, 'rate_limited': 0,
+                      'prompt_tokens': 0, 'completion_tokens': 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeAzureOpenAI":
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-azure-openai', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve on the calling thread (the command-line entry point)"""
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeAzureOpenAI":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _count(self, **increments: int) -> None:
+        with self._lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def _rate_limited(self) -> bool:
+        if self.rate_limit <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < self.rate_limit
+
+    def chat_completion(self, body: Dict[str, Any], deployment: str) -> Tuple[Dict[str, Any], float]:
+        """(response body, seconds to wait before sending it)"""
+        prompt = "\n".join(
+            m['content'] if isinstance(m.get('content'), str)
+            else "".join(part.get('text', '') for part in m.get('content') or [])
+            for m in body.get('messages', [])
+        )
+        content = chat_reply(prompt, self.reject_rate)
+        prompt_tokens, completion_tokens = approximate_tokens(prompt), approximate_tokens(content)
+        self._count(chat=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        delay = self.chat_latency.sample() + completion_tokens * self.seconds_per_output_token
+        return {
+            'id': f"chatcmpl-fake-{uuid.uuid4().hex[:24]}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model') or deployment,
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': {'role': 'assistant', 'content': content},
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+                'prompt_tokens_details': {'cached_tokens': 0},
+            },
+            'system_fingerprint': 'fake-azure-openai',
+        }, delay
+
+    def embeddings(self, body: Dict[str, Any], deployment: str) -> Tuple[Dict[str, Any], float]:
+        inputs = body.get('input', [])
+        # A string, a token list, or a list of either (langchain sends token lists)
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        texts = [item if isinstance(item, str) else " ".join(f"t{token}" for token in item) for item in inputs]
+        dimensions = int(body.get('dimensions') or self.embedding_dimensions)
+        as_base64 = body.get('encoding_format') == 'base64'
+        data = []
+        for index, text in enumerate(texts):
+            vector = embed(text, dimensions)
+            data.append({
+                'object': 'embedding',
+                'index': index,
+                'embedding': base64.b64encode(vector.astype('<f4').tobytes()).decode() if as_base64 else vector.tolist(),
+            })
+        tokens = sum(len(item) if isinstance(item, list) else approximate_tokens(item) for item in inputs)
+        self._count(embeddings=1, embedded_inputs=len(texts), prompt_tokens=tokens)
+        return {
+            'object': 'list',
+            'data': data,
+            'model': body.get('model') or deployment,
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+        }, self.embedding_latency.sample()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                logger.debug("fake-azure-openai: " + format % args)
+
+            def _send(self, status: int, body: Dict[str, Any], headers: Dict[str, str] = None) -> None:
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path.split('?')[0] == '/stats':
+                    with fake._lock:
+                        return self._send(200, dict(fake.stats))
+                self._send(404, {'error': {'code': '404', 'message': 'Resource not found'}})
+
+            def do_POST(self):
+                path = self.path.split('?')[0]
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+                match = re.search(r"/deployments/([^/]+)/", path)
+                deployment = match.group(1) if match else body.get('model', 'fake')
+                if path.endswith('/chat/completions'):
+                    handler = fake.chat_completion
+                elif path.endswith('/embeddings'):
+                    handler = fake.embeddings
+                else:
+                    return self._send(404, {'error': {'code': '404', 'message': 'Resource not found'}})
+
+                if fake._rate_limited():
+                    fake._count(rate_limited=1)
+                    return self._send(429, {'error': {
+                        'code': '429',
+                        'message': f"Requests to the {deployment} deployment have exceeded the rate limit "
+                                   f"of your current pricing tier. Please retry after {fake.retry_after:g} seconds.",
+                    }}, {'Retry-After': f"{fake.retry_after:g}", 'retry-after-ms': str(int(fake.retry_after * 1000))})
+
+                response, delay = handler(body, deployment)
+                time.sleep(delay)
+                self._send(200, response, {'x-ms-region': 'local', 'apim-request-id': uuid.uuid4().hex})
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline Azure OpenAI stand-in (chat completions and embeddings)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--chat-latency", default="lognormal:1.0,0.4", help=f"per-call seconds; one of {DISTRIBUTIONS}")
+    parser.add_argument("--embedding-latency", default="fixed:0.05")
+    parser.add_argument("--seconds-per-output-token", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of calls answered 429")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="share of prompts the verifier rejects")
+    parser.add_argument("--embedding-dimensions", type=int, default=3072)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = FakeAzureOpenAI(args.host, args.port, args.chat_latency, args.embedding_latency,
+                             args.seconds_per_output_token, args.rate_limit, args.retry_after,
+                             args.reject_rate, args.embedding_dimensions, args.seed)
+    print(f"Fake Azure OpenAI listening; set AZURE_OPENAI_ENDPOINT={server.endpoint}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
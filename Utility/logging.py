@@ -1,51 +1,172 @@
 import os
+import json
+import queue
+import atexit
+import random
 import logging
-from datetime import datetime
-
-def setup_logging():
-    # Ensure 'logging' directory exists
-    log_dir = "logging"
-    os.makedirs(log_dir, exist_ok=True)
-
-    # Create log filename with timestamp
-    log_filename = f"{log_dir}/app_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-
-    # Correct logging configuration
-    logging.basicConfig(
-        filename=log_filename,
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
+import logging.handlers
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from Utility import tracing
+from Utility.config import get_settings
+
+# -------------------------------
+# Non-blocking JSON logging
+# -------------------------------
+# Request threads only put records on a queue; a listener thread formats
+# them as JSON lines and writes them to a size-rotated file (one per worker
+# process, since rotation is not safe across processes) and the console.
+# Every record carries the bound request id and the active trace id. Raw
+# LLM payloads go through log_payload, which samples and truncates them.
+# A forked child (gunicorn preload) restarts the listener for its own file.
+
+LOG_DIR = "logging"
+PAYLOAD_SAMPLE_RATE = get_settings().log_payload_sample_rate
+PAYLOAD_MAX_CHARS = get_settings().log_payload_max_chars
+
+_request_id: ContextVar[Optional[str]] = ContextVar('log_request_id', default=None)
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_kwargs: Optional[dict] = None
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id', 'trace_id'}
+
+
+def bind_request_id(request_id: Optional[str]) -> None:
+    """Attach `request_id` to every record logged from the current request"""
+    _request_id.set(request_id)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the request and trace ids of the logging thread"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        record.trace_id = tracing.current_span().trace_id
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; `extra` fields are included as keys"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key in ('request_id', 'trace_id'):
+            if getattr(record, key, None):
+                entry[key] = getattr(record, key)
+        for key, value in vars(record).items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Leave message formatting to the listener thread (records stay in-process)"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(level: int = logging.INFO, log_file: str = None,
+                  max_bytes: int = None, backup_count: int = None) -> logging.Logger:
+    """Route the root logger through a queue to a rotating JSON file and the console"""
+    global _listener, _setup_kwargs, PAYLOAD_SAMPLE_RATE, PAYLOAD_MAX_CHARS
+    stop_logging()
+    _setup_kwargs = dict(level=level, log_file=log_file, max_bytes=max_bytes, backup_count=backup_count)
+    settings = get_settings()
+    PAYLOAD_SAMPLE_RATE = settings.log_payload_sample_rate
+    PAYLOAD_MAX_CHARS = settings.log_payload_max_chars
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    log_file = log_file or settings.log_file or f"{LOG_DIR}/app_{os.getpid()}.log"
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file,
+        maxBytes=max_bytes or settings.log_max_bytes,
+        backupCount=backup_count if backup_count is not None else settings.log_backup_count,
+        encoding='utf-8'
     )
+    console_handler = logging.StreamHandler()
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(JsonFormatter())
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
 
-    # Create a logger
     logger = logging.getLogger()
-    
-    # Optional: Add console output as well
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-    console_handler.setFormatter(console_formatter)
-    logger.addHandler(console_handler)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
 
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
     return logger
 
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def _restart_after_fork() -> None:
+    """The listener thread does not survive fork; start a fresh one (and file) in the child"""
+    global _listener
+    if _listener is not None:
+        for handler in _listener.handlers:
+            handler.close()  # the parent's file stays open in the parent
+        _listener = None
+        setup_logging(**_setup_kwargs)
+
+
+atexit.register(stop_logging)
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def log_payload(logger: logging.Logger, label: str, payload: Any, level: int = logging.INFO) -> None:
+    """Log a sampled, truncated raw payload (all of them when DEBUG is enabled)"""
+    if not logger.isEnabledFor(level):
+        return
+    if not logger.isEnabledFor(logging.DEBUG) and random.random() >= PAYLOAD_SAMPLE_RATE:
+        return
+    text = payload if isinstance(payload, str) else str(payload)
+    logger.log(level, f"{label} (sampled)", extra={
+        'payload': text[:PAYLOAD_MAX_CHARS],
+        'payload_chars': len(text),
+        'payload_truncated': len(text) > PAYLOAD_MAX_CHARS,
+    })
+
+
 # Example usage
 def main():
     logger = setup_logging()
-    
+
     try:
         # Your application logic here
         logger.info("Application started")
         logger.warning("This is a warning message")
         logger.error("This is an error message")
-        
+
         # Simulating some operation
         result = 10 / 2
         logger.info(f"Calculation result: {result}")
-    
+
     except Exception as e:
         logger.exception("An error occurred")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,169 @@
+import os
+import time
+import signal
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from Utility.config import startup_value
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Memory governor
+# -------------------------------
+# A sampler thread reads this worker's RSS. Above the soft limit, new heavy
+# jobs (paper generation, note analysis) are refused with MemoryPressure and
+# tracemalloc starts recording. At the high-water mark the worker drains: it
+# refuses all heavy jobs, waits for in-flight ones to finish, logs the top
+# Python allocators, then sends itself SIGTERM so gunicorn replaces it with a
+# fresh worker. tracemalloc only sees Python allocations; FAISS and other
+# native memory shows up in RSS but not in the allocator report.
+#
+# A worker can also settle between the two marks (or start there after
+# preloading), refusing every heavy job without ever reaching the high-water
+# mark. It is drained as well once it has refused SOFT_REFUSALS_BEFORE_RECYCLE
+# jobs in a row, or has stayed above the soft limit for SOFT_LIMIT_GRACE_SECONDS
+# with nothing in flight to free memory.
+
+HIGH_WATER_MB = float(startup_value('MEMORY_HIGH_WATER_MB', '1536'))
+SOFT_LIMIT_MB = float(startup_value('MEMORY_SOFT_LIMIT_MB', str(HIGH_WATER_MB * 0.85)))
+SAMPLE_SECONDS = float(startup_value('MEMORY_SAMPLE_SECONDS', '5'))
+DRAIN_TIMEOUT_SECONDS = float(startup_value('MEMORY_DRAIN_TIMEOUT_SECONDS', '300'))
+# A worker whose baseline is already above the mark would otherwise be
+# recycled in a tight loop; young workers only refuse jobs
+MIN_WORKER_SECONDS = float(startup_value('MEMORY_MIN_WORKER_SECONDS', '60'))
+SOFT_REFUSALS_BEFORE_RECYCLE = int(startup_value('MEMORY_SOFT_REFUSALS_BEFORE_RECYCLE', '20'))
+SOFT_LIMIT_GRACE_SECONDS = float(startup_value('MEMORY_SOFT_LIMIT_GRACE_SECONDS', '120'))
+TRACEMALLOC_FRAMES = int(startup_value('TRACEMALLOC_FRAMES', '10'))
+REPORT_TOP = 20
+
+
+class MemoryPressure(RuntimeError):
+    """Raised instead of starting a heavy job while the worker is near its memory limit"""
+
+
+class MemoryGovernor:
+    def __init__(self, sample_mb: Callable[[], float], high_water_mb: float = HIGH_WATER_MB,
+                 soft_limit_mb: float = SOFT_LIMIT_MB, report_dir: str = 'logging',
+                 min_worker_seconds: float = MIN_WORKER_SECONDS,
+                 max_refusals: int = SOFT_REFUSALS_BEFORE_RECYCLE,
+                 soft_grace_seconds: float = SOFT_LIMIT_GRACE_SECONDS):
+        self.sample_mb = sample_mb
+        self.high_water_mb = high_water_mb
+        self.soft_limit_mb = min(soft_limit_mb, high_water_mb)
+        self.report_dir = report_dir
+        self.min_worker_seconds = min_worker_seconds
+        self.max_refusals = max_refusals
+        self.soft_grace_seconds = soft_grace_seconds
+        self.draining = False
+        self._refusals = 0
+        self._soft_since: Optional[float] = None
+        self.last_rss_mb = 0.0
+        self._inflight = 0
+        self._idle = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._recycle_signal: Optional[int] = None
+        self._started_at = time.monotonic()
+
+    @contextmanager
+    def job(self) -> Iterator[None]:
+        """Admit a heavy job, or raise MemoryPressure when draining or above the soft limit"""
+        rss = self.check()
+        if self.draining or rss >= self.soft_limit_mb:
+            self._refusals += 1
+            if self._refusals >= self.max_refusals:
+                self._drain(f"refused {self._refusals} jobs in a row at RSS {rss:.0f}MB")
+            raise MemoryPressure(f"Worker is near its memory limit ({rss:.0f}MB of {self.high_water_mb:.0f}MB); retry shortly")
+        with self._idle:
+            self._refusals = 0
+            self._inflight += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self._inflight -= 1
+                self._idle.notify_all()
+
+    def check(self) -> float:
+        """Sample RSS, start tracing above the soft limit, start draining at the high-water mark
+
+        Also drains a worker that has sat above the soft limit for
+        `soft_grace_seconds` with no job in flight.
+        """
+        rss = self.last_rss_mb = self.sample_mb()
+        now = time.monotonic()
+        if rss < self.soft_limit_mb:
+            self._soft_since = None
+            self._refusals = 0
+            return rss
+        if self._soft_since is None:
+            self._soft_since = now
+        if TRACEMALLOC_FRAMES > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            logger.warning(f"RSS {rss:.0f}MB above soft limit {self.soft_limit_mb:.0f}MB; started tracemalloc")
+        if rss >= self.high_water_mb:
+            self._drain(f"RSS {rss:.0f}MB reached high-water mark {self.high_water_mb:.0f}MB")
+        elif now - self._soft_since >= self.soft_grace_seconds and self._inflight == 0:
+            self._drain(f"RSS {rss:.0f}MB stayed above soft limit {self.soft_limit_mb:.0f}MB "
+                        f"for {now - self._soft_since:.0f}s with no jobs running")
+        return rss
+
+    def _drain(self, reason: str) -> None:
+        """Stop admitting jobs and recycle once in-flight ones finish; no-op for young or unmanaged workers"""
+        with self._idle:
+            if self._recycle_signal is None or self.draining:
+                return
+            if time.monotonic() - self._started_at < self.min_worker_seconds:
+                return
+            self.draining = True
+        logger.warning(f"{reason}; draining for recycle")
+        threading.Thread(target=self._recycle, name='memory-recycle', daemon=True).start()
+
+    def allocation_report(self) -> str:
+        """Top Python allocators by line, if tracemalloc has been recording"""
+        if not tracemalloc.is_tracing():
+            return "tracemalloc was not recording"
+        stats = tracemalloc.take_snapshot().statistics('lineno')
+        lines = [f"RSS {self.last_rss_mb:.0f}MB; top {REPORT_TOP} Python allocators since tracing began:"]
+        lines.extend(f"  {stat}" for stat in stats[:REPORT_TOP])
+        return "\n".join(lines)
+
+    def _recycle(self) -> None:
+        with self._idle:
+            self._idle.wait_for(lambda: self._inflight == 0, timeout=DRAIN_TIMEOUT_SECONDS)
+        report = self.allocation_report()
+        logger.warning(f"Recycling worker {os.getpid()}\n{report}")
+        try:
+            os.makedirs(self.report_dir, exist_ok=True)
+            path = os.path.join(self.report_dir, f"tracemalloc_{os.getpid()}_{int(time.time())}.txt")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(report + "\n")
+        except OSError as e:
+            logger.error(f"Could not write allocation report: {e}")
+        os.kill(os.getpid(), self._recycle_signal)
+
+    def start(self, recycle_signal: Optional[int] = signal.SIGTERM, interval: float = SAMPLE_SECONDS) -> None:
+        """Sample in the background; at the high-water mark send `recycle_signal` to this process
+
+        SIGTERM makes a gunicorn worker exit gracefully and the master start a
+        new one. Pass None where nothing would restart the process (the dev
+        server): jobs are then only refused, never recycled.
+        """
+        self._recycle_signal = recycle_signal
+        self._started_at = time.monotonic()
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        def sample():
+            while True:
+                try:
+                    self.check()
+                except Exception as e:
+                    logger.error(f"Memory sampling failed: {e}")
+                time.sleep(interval)
+
+        self._thread = threading.Thread(target=sample, name='memory-governor', daemon=True)
+        self._thread.start()
@@ -0,0 +1,541 @@
+import os
+import json
+import pickle
+import hashlib
+import uuid
+import shutil
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import faiss
+from langchain_core.documents import Document
+
+from Utility.chunkstore import CATEGORICAL_COLUMNS, ChunkStore, write_chunkstore
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines; single-process there anyway
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Memory-mapped vectorstore format
+# -------------------------------
+# A persisted index directory contains:
+#   manifest.json      - format, dimension, metric, live segments, tombstones
+#   seg-NNNNNN/        - immutable segment written by one ingest
+#     vectors.npy      - float32 matrix, opened with mmap_mode='r'
+#     docstore.bin     - native chunk store, see Utility/chunkstore.py
+#     ids.npy          - sorted 64-bit hashes of the chunk ids, then the
+#                        position of each; appends look new ids up here
+#                        instead of decoding every segment's ids
+#
+# Every gunicorn worker that opens the same directory maps the same files,
+# so the vectors and chunk text live once in the page cache instead of once
+# per worker. New notes are appended as new segments; removed chunks are
+# tombstoned in the manifest and dropped when the segments are compacted.
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+DOCSTORE_FILE = "docstore.bin"
+IDS_FILE = "ids.npy"
+LOCK_FILE = ".lock"
+FORMAT_NAME = "mmap-v3"
+
+# Compact once this share of vectors is tombstoned, or segments pile up
+COMPACT_TOMBSTONE_RATIO = 0.2
+COMPACT_MAX_SEGMENTS = 8
+
+# Search filter keys beyond the categorical columns
+MIN_QUALITY_KEY = "min_quality_score"
+PAGE_RANGE_KEY = "page_range"
+_EMPTY_POSITIONS = np.zeros(0, dtype=np.int64)
+
+# Files written by FAISS.save_local; only read by the legacy converter
+LEGACY_INDEX_FILE = "index.faiss"
+LEGACY_DOCSTORE_FILE = "index.pkl"
+
+
+def is_mmap_store(path: str) -> bool:
+    """Return True if `path` holds an index in the memory-mapped format"""
+    return os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+
+def _read_manifest(path: str) -> Dict[str, Any]:
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_NAME:
+        raise ValueError(f"Unsupported vectorstore format: {manifest.get('format')}")
+    return manifest
+
+
+def _write_manifest(path: str, manifest: Dict[str, Any]) -> None:
+    """Atomically publish a manifest; readers see the old or new one, never half"""
+    tmp_manifest = os.path.join(path, MANIFEST_FILE + ".tmp")
+    with open(tmp_manifest, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_manifest, os.path.join(path, MANIFEST_FILE))
+
+
+def _new_manifest(dim: int, metric: int) -> Dict[str, Any]:
+    return {
+        "format": FORMAT_NAME,
+        "dim": dim,
+        "metric": metric,
+        "next_segment": 0,
+        "segments": [],
+        "tombstones": {},
+    }
+
+
+@contextmanager
+def _store_lock(path: str):
+    """Serialize writers (across workers) on one index directory"""
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, LOCK_FILE), "w") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _record_id(doc_id: str, metadata: Dict[str, Any]) -> str:
+    """Records are keyed by the content-hash chunk_id when there is one"""
+    return metadata.get('chunk_id') or doc_id
+
+
+def _write_segment(path: str, manifest: Dict[str, Any], vectors: np.ndarray, ids: List[str],
+                   texts: List[str], metadatas: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Write a new immutable segment and return its manifest entry"""
+    name = f"seg-{manifest['next_segment']:06d}"
+    manifest["next_segment"] += 1
+
+    segment_path = os.path.join(path, name)
+    os.makedirs(segment_path, exist_ok=True)
+    with open(os.path.join(segment_path, VECTORS_FILE), "wb") as f:
+        np.save(f, np.ascontiguousarray(vectors, dtype="float32"))
+    write_chunkstore(os.path.join(segment_path, DOCSTORE_FILE), ids, texts, metadatas)
+    with open(os.path.join(segment_path, IDS_FILE), "wb") as f:
+        np.save(f, _id_index(ids))
+    return {"name": name, "count": len(ids)}
+
+
+def _drop_segments(path: str, names: Iterable[str]) -> None:
+    # Workers that still map these files keep valid pages until they reload
+    for name in names:
+        shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def save_mmap_store(vectorstore: Any, path: str) -> None:
+    """Persist a LangChain FAISS vectorstore as a single-segment store"""
+    index = vectorstore.index
+    count = index.ntotal
+    vectors = index.reconstruct_n(0, count) if count else np.zeros((0, index.d), dtype="float32")
+
+    ids, texts, metadatas = [], [], []
+    for position in range(count):
+        doc_id = vectorstore.index_to_docstore_id[position]
+        doc = vectorstore.docstore.search(doc_id)
+        ids.append(_record_id(doc_id, doc.metadata))
+        texts.append(doc.page_content)
+        metadatas.append(doc.metadata)
+
+    with _store_lock(path):
+        old_segments = []
+        manifest = _new_manifest(index.d, int(index.metric_type))
+        if is_mmap_store(path):
+            previous = _read_manifest(path)
+            old_segments = [segment["name"] for segment in previous["segments"]]
+            manifest["next_segment"] = previous["next_segment"]
+
+        manifest["segments"].append(_write_segment(path, manifest, vectors, ids, texts, metadatas))
+        _write_manifest(path, manifest)
+        _drop_segments(path, old_segments)
+
+    logger.info(f"Saved memory-mapped vectorstore to {path} ({count} vectors)")
+
+
+def _id_hashes(ids: Iterable[str]) -> np.ndarray:
+    return np.array([int.from_bytes(hashlib.blake2b(record_id.encode("utf-8"), digest_size=8).digest(), "little")
+                     for record_id in ids], dtype=np.uint64)
+
+
+def _id_index(ids: List[str]) -> np.ndarray:
+    """Sorted id hashes followed by the segment position of each, as one flat array"""
+    hashes = _id_hashes(ids)
+    order = np.argsort(hashes, kind="stable")
+    return np.concatenate((hashes[order], order.astype(np.uint64)))
+
+
+def _segment_id_index(segment_path: str) -> np.ndarray:
+    try:
+        return np.load(os.path.join(segment_path, IDS_FILE), mmap_mode="r")
+    except FileNotFoundError:  # written before ids.npy existed; rebuilt until compacted
+        store = ChunkStore(os.path.join(segment_path, DOCSTORE_FILE))
+        return _id_index([store.get_id(position) for position in range(len(store))])
+
+
+def _existing_ids(path: str, manifest: Optional[Dict[str, Any]], record_ids: Iterable[str]) -> Set[str]:
+    """Those of `record_ids` held by a live chunk
+
+    Each id is looked up by hash in every segment's id index; only a hash hit
+    decodes the stored id to confirm it, so the cost follows the new ids, not
+    the size of the store.
+    """
+    wanted = list(dict.fromkeys(record_ids))
+    existing = set()
+    if not manifest or not wanted:
+        return existing
+    hashes = _id_hashes(wanted)
+    for segment in manifest["segments"]:
+        segment_path = os.path.join(path, segment["name"])
+        index = _segment_id_index(segment_path)
+        count = len(index) // 2
+        keys, positions = index[:count], index[count:]
+        starts = np.searchsorted(keys, hashes, side="left")
+        ends = np.searchsorted(keys, hashes, side="right")
+        hits = np.flatnonzero(ends > starts)
+        if hits.size == 0:
+            continue
+        store = ChunkStore(os.path.join(segment_path, DOCSTORE_FILE))
+        deleted = set(manifest["tombstones"].get(segment["name"], []))
+        for i in hits.tolist():
+            for position in positions[starts[i]:ends[i]].tolist():
+                if position not in deleted and store.get_id(position) == wanted[i]:
+                    existing.add(wanted[i])
+                    break
+    return existing
+
+
+def unseen_documents(path: str, documents: List[Document]) -> List[Document]:
+    """The documents append_documents would embed right now (read without the writer lock)"""
+    manifest = _read_manifest(path) if is_mmap_store(path) else None
+    existing_ids = _existing_ids(path, manifest, [doc.metadata['chunk_id'] for doc in documents if doc.metadata.get('chunk_id')])
+    unseen = []
+    for doc in documents:
+        record_id = doc.metadata.get('chunk_id')
+        if record_id in existing_ids:
+            continue
+        if record_id:
+            existing_ids.add(record_id)
+        unseen.append(doc)
+    return unseen
+
+
+def append_documents(path: str, documents: List[Document], embeddings: Any) -> Dict[str, int]:
+    """Embed and append only the chunks whose chunk_id the index does not hold yet
+
+    Returns counts of added and skipped (duplicate) chunks. The cost is one
+    embedding call and one segment write for the new chunks only.
+    """
+    with _store_lock(path):
+        manifest = _read_manifest(path) if is_mmap_store(path) else None
+        existing_ids = _existing_ids(path, manifest, [doc.metadata['chunk_id'] for doc in documents if doc.metadata.get('chunk_id')])
+
+        new_docs = []
+        for doc in documents:
+            record_id = _record_id(uuid.uuid4().hex, doc.metadata)
+            if record_id in existing_ids:
+                continue
+            existing_ids.add(record_id)
+            new_docs.append((record_id, doc))
+
+        stats = {"added": len(new_docs), "skipped": len(documents) - len(new_docs)}
+        if not new_docs:
+            logger.info(f"No new chunks to append to {path} ({stats['skipped']} duplicates)")
+            return stats
+
+        texts = [doc.page_content for _, doc in new_docs]
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype="float32")
+        if manifest is None:
+            manifest = _new_manifest(vectors.shape[1], faiss.METRIC_L2)
+        elif vectors.shape[1] != manifest["dim"]:
+            raise ValueError(f"Embedding size {vectors.shape[1]} does not match index size {manifest['dim']}")
+
+        manifest["segments"].append(_write_segment(
+            path, manifest, vectors,
+            [record_id for record_id, _ in new_docs], texts, [doc.metadata for _, doc in new_docs]
+        ))
+        _write_manifest(path, manifest)
+        logger.info(f"Appended {stats['added']} chunks to {path} (skipped {stats['skipped']} duplicates)")
+
+        if _needs_compaction(manifest):
+            _compact_locked(path, manifest)
+        return stats
+
+
+def remove_documents(path: str, chunk_ids: Iterable[str] = (), metadata_filter: Optional[Dict[str, Any]] = None) -> int:
+    """Tombstone chunks by chunk_id and/or exact metadata match; returns the count"""
+    chunk_ids = set(chunk_ids)
+    removed = 0
+    with _store_lock(path):
+        manifest = _read_manifest(path)
+        for segment in manifest["segments"]:
+            store = ChunkStore(os.path.join(path, segment["name"], DOCSTORE_FILE))
+            deleted = set(manifest["tombstones"].get(segment["name"], []))
+            for position in range(len(store)):
+                if position in deleted:
+                    continue
+                matched = store.get_id(position) in chunk_ids
+                if not matched and metadata_filter:
+                    metadata = store.get_metadata(position)
+                    matched = all(metadata.get(key) == value for key, value in metadata_filter.items())
+                if matched:
+                    deleted.add(position)
+                    removed += 1
+            if deleted:
+                manifest["tombstones"][segment["name"]] = sorted(deleted)
+
+        if removed:
+            _write_manifest(path, manifest)
+            logger.info(f"Tombstoned {removed} chunks in {path}")
+            if _needs_compaction(manifest):
+                _compact_locked(path, manifest)
+    return removed
+
+
+def _needs_compaction(manifest: Dict[str, Any]) -> bool:
+    total = sum(segment["count"] for segment in manifest["segments"])
+    dead = sum(len(positions) for positions in manifest["tombstones"].values())
+    return len(manifest["segments"]) > COMPACT_MAX_SEGMENTS or (total > 0 and dead / total >= COMPACT_TOMBSTONE_RATIO)
+
+
+def _compact_locked(path: str, manifest: Dict[str, Any]) -> None:
+    """Merge all live chunks into one segment; caller holds the store lock"""
+    vectors, ids, texts, metadatas = [], [], [], []
+    for segment in manifest["segments"]:
+        segment_path = os.path.join(path, segment["name"])
+        store = ChunkStore(os.path.join(segment_path, DOCSTORE_FILE))
+        live = np.ones(len(store), dtype=bool)
+        live[manifest["tombstones"].get(segment["name"], [])] = False
+
+        vectors.append(np.load(os.path.join(segment_path, VECTORS_FILE), mmap_mode="r")[live])
+        for position in np.flatnonzero(live):
+            ids.append(store.get_id(position))
+            texts.append(store.get_text(position))
+            metadatas.append(store.get_metadata(position))
+
+    old_segments = [segment["name"] for segment in manifest["segments"]]
+    merged = np.concatenate(vectors) if vectors else np.zeros((0, manifest["dim"]), dtype="float32")
+    manifest["segments"] = [_write_segment(path, manifest, merged, ids, texts, metadatas)]
+    manifest["tombstones"] = {}
+    _write_manifest(path, manifest)
+    _drop_segments(path, old_segments)
+    logger.info(f"Compacted {path}: {len(old_segments)} segments into 1 ({len(ids)} live chunks)")
+
+
+def compact_store(path: str) -> None:
+    """Merge segments and drop tombstoned chunks"""
+    with _store_lock(path):
+        _compact_locked(path, _read_manifest(path))
+
+
+class _Segment:
+    """Mapped vectors and chunk store of one immutable segment"""
+
+    def __init__(self, path: str):
+        self.vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        self.docstore = ChunkStore(os.path.join(path, DOCSTORE_FILE))
+        self._postings: Dict[str, Dict[str, np.ndarray]] = {}
+        self._postings_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.docstore)
+
+    def postings(self, key: str) -> Dict[str, np.ndarray]:
+        """Inverted index for a categorical column: value -> sorted positions"""
+        with self._postings_lock:
+            if key not in self._postings:
+                codes = self.docstore.column(key)
+                order = np.argsort(codes, kind="stable")  # stable keeps positions sorted
+                values, starts = np.unique(codes[order], return_index=True)
+                ends = np.append(starts[1:], len(order))
+                table = self.docstore.string_table
+                self._postings[key] = {
+                    table[code]: order[start:end]
+                    for code, start, end in zip(values, starts, ends)
+                    if code < len(table)  # skips the missing-value code
+                }
+            return self._postings[key]
+
+    def eligible_positions(self, metadata_filter: Dict[str, Any]) -> np.ndarray:
+        """Sorted positions matching every condition in `metadata_filter`"""
+        positions = None
+        for key, value in metadata_filter.items():
+            if key in CATEGORICAL_COLUMNS:
+                values = value if isinstance(value, (list, tuple, set)) else [value]
+                index = self.postings(key)
+                matched = np.sort(np.concatenate([index.get(v, _EMPTY_POSITIONS) for v in values]))
+            elif key == MIN_QUALITY_KEY:
+                matched = np.flatnonzero(self.docstore.column('quality_score') >= value)
+            elif key == PAGE_RANGE_KEY:
+                pages = self.docstore.column('page')
+                matched = np.flatnonzero((pages >= value[0]) & (pages <= value[1]))
+            else:
+                raise ValueError(f"Unsupported metadata filter key: {key}")
+            positions = matched if positions is None else np.intersect1d(positions, matched, assume_unique=True)
+        return positions if positions is not None else np.arange(len(self))
+
+
+class MmapVectorStore:
+    """Similarity search over memory-mapped, append-only segments
+
+    Exposes the subset of the LangChain FAISS API used by the retrievers.
+    Search runs `faiss.knn` directly on each mapped matrix, which is the same
+    brute-force scan an IndexFlat performs, without copying the vectors into
+    per-process memory; per-segment results are merged into one top-k.
+
+    A `filter` dict restricts the search up front: categorical keys
+    (content_type/subject/grade, a value or a list of values) resolve through
+    per-segment inverted indexes, `min_quality_score` and `page_range`
+    (inclusive (first, last)) through the numeric columns. Only the eligible
+    rows are gathered and scanned, so no over-fetching is needed. (A FAISS
+    IDSelector on a flat index would still walk every id and drop the BLAS
+    path, hence the gather.)
+    """
+
+    supports_metadata_prefilter = True
+
+    def __init__(self, path: str, embeddings: Any, previous: Optional["MmapVectorStore"] = None):
+        manifest = _read_manifest(path)
+
+        self.path = path
+        self.embeddings = embeddings
+        self.metric = manifest.get("metric", faiss.METRIC_L2)
+        self.segments: List[Tuple[str, _Segment, np.ndarray]] = []
+
+        # Segments are immutable, so mappings survive a manifest change
+        reusable = {name: segment for name, segment, _ in previous.segments} if previous else {}
+        for entry in manifest["segments"]:
+            segment = reusable.get(entry["name"]) or _Segment(os.path.join(path, entry["name"]))
+            deleted = np.zeros(len(segment), dtype=bool)
+            deleted[manifest["tombstones"].get(entry["name"], [])] = True
+            self.segments.append((entry["name"], segment, deleted))
+
+    def __len__(self) -> int:
+        return sum(len(segment) - int(deleted.sum()) for _, segment, deleted in self.segments)
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        query = np.asarray([embedding], dtype="float32")
+        candidates = []
+        for _, segment, deleted in self.segments:
+            if filter:
+                positions = segment.eligible_positions(filter)
+                positions = positions[~deleted[positions]]
+                if positions.size == 0:
+                    continue
+                distances, found = faiss.knn(query, segment.vectors[positions], min(k, positions.size), metric=self.metric)
+                for distance, index in zip(distances[0], found[0]):
+                    if index >= 0:
+                        candidates.append((float(distance), segment, int(positions[index])))
+                continue
+
+            dead = int(deleted.sum())
+            if len(segment) - dead <= 0:
+                continue
+            distances, positions = faiss.knn(query, segment.vectors, min(k + dead, len(segment)), metric=self.metric)
+            for distance, position in zip(distances[0], positions[0]):
+                if position >= 0 and not deleted[position]:
+                    candidates.append((float(distance), segment, int(position)))
+
+        # L2 distances rank ascending, inner products descending
+        candidates.sort(key=lambda c: c[0], reverse=self.metric == faiss.METRIC_INNER_PRODUCT)
+        return [(segment.docstore.get(position), distance) for distance, segment, position in candidates[:k]]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        embedding = self.embeddings.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+
+# Process-wide cache so each worker maps a given store once; keyed by the
+# manifest inode and mtime so an append or compaction is picked up on the
+# next load.
+_store_cache: Dict[str, Tuple[Tuple[int, int], MmapVectorStore]] = {}
+_store_cache_lock = threading.Lock()
+cache_stats = {'hits': 0, 'misses': 0}
+
+
+def cached_store_count() -> int:
+    """Number of vectorstores currently mapped by this process"""
+    return len(_store_cache)
+
+
+def load_mmap_store(path: str, embeddings: Any) -> MmapVectorStore:
+    """Open (or reuse) the memory-mapped vectorstore at `path`"""
+    key = os.path.abspath(path)
+    stat = os.stat(os.path.join(path, MANIFEST_FILE))
+    version = (stat.st_ino, stat.st_mtime_ns)
+
+    with _store_cache_lock:
+        cached = _store_cache.get(key)
+        if cached and cached[0] == version:
+            cache_stats['hits'] += 1
+            cached[1].embeddings = embeddings
+            return cached[1]
+
+        cache_stats['misses'] += 1
+        store = MmapVectorStore(path, embeddings, previous=cached[1] if cached else None)
+        _store_cache[key] = (version, store)
+        logger.info(f"Mapped vectorstore from {path} ({len(store)} vectors)")
+        return store
+
+
+def evict_mmap_store(path: str) -> None:
+    """Drop a cached store, e.g. before its directory is deleted"""
+    with _store_cache_lock:
+        _store_cache.pop(os.path.abspath(path), None)
+
+
+def convert_legacy_store(path: str) -> None:
+    """Rewrite a FAISS.save_local directory (index.faiss + index.pkl) natively
+
+    This unpickles index.pkl, so only run it on directories this app wrote.
+    """
+    index = faiss.read_index(os.path.join(path, LEGACY_INDEX_FILE))
+    with open(os.path.join(path, LEGACY_DOCSTORE_FILE), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    save_mmap_store(SimpleNamespace(
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    ), path)
+
+
+if __name__ == "__main__":
+    # Usage: python -m Utility.mmap_store [--compact] vectorstores/*
+    parser = argparse.ArgumentParser(description="Convert or compact persisted vectorstores")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--compact", action="store_true", help="compact native stores instead of converting")
+    args = parser.parse_args()
+
+    for store_path in args.paths:
+        if args.compact:
+            if is_mmap_store(store_path):
+                compact_store(store_path)
+                print(f"Compacted {store_path}")
+            continue
+        if is_mmap_store(store_path):
+            print(f"Skipping {store_path}: already converted")
+            continue
+        if not os.path.exists(os.path.join(store_path, LEGACY_DOCSTORE_FILE)):
+            print(f"Skipping {store_path}: no {LEGACY_DOCSTORE_FILE}")
+            continue
+        convert_legacy_store(store_path)
+        print(f"Converted {store_path}")
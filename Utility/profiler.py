@@ -0,0 +1,230 @@
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import random
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+from Utility.config import startup_value
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# On-demand request profiling
+# -------------------------------
+# A sampling profiler for single heavy requests (paper generation, note
+# analysis). While a profiled request runs, a daemon thread reads the stacks
+# of the request's threads from sys._current_frames() every
+# PROFILE_INTERVAL_MS; nothing is hooked into the interpreter, so the
+# profiled request runs at close to full speed. The samples are saved under
+# PROFILE_DIR as <id>.collapsed.txt (flamegraph.pl / speedscope input) and
+# <id>.speedscope.json, keyed by request id.
+#
+# A request is profiled when it sends `X-Profile: 1` with an `X-Admin-Token`
+# matching PROFILE_ADMIN_TOKEN, or at random with probability
+# PROFILE_SAMPLE_RATE. The admin token also guards the endpoints that list
+# and download profiles. With neither set, profiling is off and the views
+# are not wrapped at all.
+
+PROFILE_DIR = startup_value('PROFILE_DIR', os.path.join('logging', 'profiles'))
+PROFILE_ADMIN_TOKEN = startup_value('PROFILE_ADMIN_TOKEN')
+PROFILE_SAMPLE_RATE = float(startup_value('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(startup_value('PROFILE_INTERVAL_MS', '5'))
+PROFILE_MAX_PROFILES = int(startup_value('PROFILE_MAX_PROFILES', '200'))
+ENABLED = bool(PROFILE_ADMIN_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+FORMATS = {
+    'collapsed': ('.collapsed.txt', 'text/plain'),
+    'speedscope': ('.speedscope.json', 'application/json'),
+}
+_PROFILE_ID = re.compile(r'[A-Za-z0-9_.-]{1,80}')
+# Leaf frames of a pool thread waiting for work; such samples are dropped
+IDLE_FRAMES = {('thread.py', '_worker')}
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(PROFILE_ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, PROFILE_ADMIN_TOKEN)
+
+
+def wants_profile(profile_header: Optional[str], admin_token: Optional[str]) -> bool:
+    """Profile this request: asked for by an admin, or picked by PROFILE_SAMPLE_RATE"""
+    if profile_header and profile_header.strip().lower() in ('1', 'true', 'yes') and is_admin(admin_token):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def profile_id_for(request_id: str) -> str:
+    """Request ids come from a client header; keep them to safe file names"""
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', request_id or '')[:80] or f"profile-{time.time_ns()}"
+
+
+class SamplingProfiler:
+    """Stacks of a set of threads, sampled from a daemon thread"""
+
+    def __init__(self, threads: Callable[[], Set[int]], interval: float = PROFILE_INTERVAL_MS / 1000):
+        self.threads = threads
+        self.interval = interval
+        self.frames: List[Dict[str, Any]] = []
+        self._frame_index: Dict[tuple, int] = {}
+        # thread id -> (name, [stack of frame indices, root first], [seconds each sample stands for])
+        self.samples: Dict[int, tuple] = {}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started = self.ended = None
+
+    def _frame(self, frame) -> int:
+        code = frame.f_code
+        key = (code.co_filename, code.co_firstlineno, code.co_name)
+        index = self._frame_index.get(key)
+        if index is None:
+            index = self._frame_index[key] = len(self.frames)
+            self.frames.append({'name': code.co_name, 'file': code.co_filename, 'line': code.co_firstlineno})
+        return index
+
+    def _sample(self, weight: float) -> None:
+        names = None
+        current = sys._current_frames()
+        for ident in self.threads():
+            frame = current.get(ident)
+            if frame is None or (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame(frame))
+                frame = frame.f_back
+            stack.reverse()
+            if ident not in self.samples:
+                names = names or {thread.ident: thread.name for thread in threading.enumerate()}
+                self.samples[ident] = (names.get(ident, str(ident)), [], [])
+            _, stacks, weights = self.samples[ident]
+            stacks.append(stack)
+            weights.append(weight)
+
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            now = time.perf_counter()
+            self._sample(now - last)
+            last = now
+
+    def start(self) -> "SamplingProfiler":
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+        self.ended = time.perf_counter()
+
+    @property
+    def sample_count(self) -> int:
+        return sum(len(stacks) for _, stacks, _ in self.samples.values())
+
+    def _label(self, index: int) -> str:
+        frame = self.frames[index]
+        return f"{frame['name']} ({os.path.basename(frame['file'])}:{frame['line']})"
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's folded format: root;...;leaf count, one stack per line"""
+        counts = Counter()
+        prefix_threads = len(self.samples) > 1
+        for name, stacks, _ in self.samples.values():
+            for stack in stacks:
+                labels = [self._label(index).replace(';', ':') for index in stack]
+                counts[';'.join([name] + labels if prefix_threads else labels)] += 1
+        return ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+    def speedscope(self, name: str) -> Dict[str, Any]:
+        """speedscope's file format: one sampled profile per thread, in time order"""
+        duration = (self.ended or time.perf_counter()) - self.started
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'prashnotri request profiler',
+            'activeProfileIndex': 0,
+            'shared': {'frames': self.frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': thread_name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': round(duration, 6),
+                'samples': stacks,
+                'weights': [round(weight, 6) for weight in weights],
+            } for thread_name, stacks, weights in self.samples.values()],
+        }
+
+
+def _prune(directory: str, keep: int) -> None:
+    profiles = list_profiles(directory)[::-1]  # oldest first
+    for profile in profiles[:max(len(profiles) - keep, 0)]:
+        for fmt in profile['formats']:
+            try:
+                os.remove(os.path.join(directory, profile['id'] + FORMATS[fmt][0]))
+            except OSError:
+                pass
+
+
+def save_profile(profiler: SamplingProfiler, profile_id: str, name: str, directory: str = None) -> None:
+    directory = directory or PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, profile_id)
+    with open(base + FORMATS['collapsed'][0], 'w', encoding='utf-8') as f:
+        f.write(profiler.collapsed())
+    with open(base + FORMATS['speedscope'][0], 'w', encoding='utf-8') as f:
+        json.dump(profiler.speedscope(name), f, separators=(',', ':'))
+    _prune(directory, PROFILE_MAX_PROFILES)
+
+
+@contextmanager
+def profiling(request_id: str, name: str, threads: Callable[[], Set[int]] = None) -> Iterator[str]:
+    """Sample the calling thread (or `threads()`) until exit, then save; yields the profile id"""
+    profile_id = profile_id_for(request_id)
+    if threads is None:
+        caller = threading.get_ident()
+        threads = lambda: {caller}
+    profiler = SamplingProfiler(threads).start()
+    try:
+        yield profile_id
+    finally:
+        profiler.stop()
+        try:
+            save_profile(profiler, profile_id, f"{name} {request_id}")
+            logger.info(f"Saved profile {profile_id} of {name}: {profiler.sample_count} samples "
+                        f"over {profiler.ended - profiler.started:.2f}s")
+        except Exception as e:
+            logger.error(f"Failed to save profile {profile_id}: {e}")
+
+
+def list_profiles(directory: str = None) -> List[Dict[str, Any]]:
+    """Saved profiles, newest first"""
+    directory = directory or PROFILE_DIR
+    profiles: Dict[str, Dict[str, Any]] = {}
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    for filename in names:
+        for fmt, (suffix, _) in FORMATS.items():
+            if filename.endswith(suffix):
+                stat = os.stat(os.path.join(directory, filename))
+                profile = profiles.setdefault(filename[:-len(suffix)], {'id': filename[:-len(suffix)], 'formats': {}, 'created': stat.st_mtime})
+                profile['formats'][fmt] = stat.st_size
+                profile['created'] = min(profile['created'], stat.st_mtime)
+    return sorted(profiles.values(), key=lambda p: p['created'], reverse=True)
+
+
+def profile_file(profile_id: str, fmt: str = 'speedscope', directory: str = None) -> Optional[str]:
+    """File name of a saved profile in `fmt` under the profile directory, or None"""
+    if fmt not in FORMATS or not _PROFILE_ID.fullmatch(profile_id or ''):
+        return None
+    filename = profile_id + FORMATS[fmt][0]
+    return filename if os.path.isfile(os.path.join(directory or PROFILE_DIR, filename)) else None
@@ -0,0 +1,99 @@
+import os
+import time
+import logging
+from typing import Any, Dict
+
+import psutil
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+from Utility import mmap_store, stage_metrics
+
+# -------------------------------
+# Prometheus metrics, aggregated across gunicorn workers
+# -------------------------------
+# Under gunicorn, prometheus_client's multiprocess mode: every worker writes
+# its samples to files in PROMETHEUS_MULTIPROC_DIR and the /metrics handler
+# merges them. gunicorn.conf.py sets the directory before the app is
+# imported, clears it on start and marks exited workers dead. Anywhere else
+# (tests, the Flask dev server, a single uvicorn) the variable is unset and
+# the metrics live in this process's default registry.
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+logger = logging.getLogger(__name__)
+
+LLM_CHAINS = ('generation', 'revision', 'verification')
+
+REQUEST_LATENCY = Histogram(
+    'prashnotri_http_request_duration_seconds', 'Endpoint latency',
+    ['endpoint', 'method', 'status'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 90, 120, 180)
+)
+LLM_CALL_LATENCY = Histogram(
+    'prashnotri_llm_call_duration_seconds', 'LLM call latency by chain',
+    ['chain'],
+    buckets=(0.5, 1, 2, 4, 8, 12, 16, 24, 32, 45, 60, 90)
+)
+LLM_TOKENS = Counter('prashnotri_llm_tokens_total', 'LLM tokens by chain and kind (prompt, cached, completion)', ['chain', 'kind'])
+LLM_RATE_LIMITED = Counter('prashnotri_llm_rate_limited_total', 'LLM calls that failed with HTTP 429', ['chain'])
+ATTEMPTS_USED = Counter('prashnotri_question_attempts_used_total', 'Question batches by generation attempts used', ['attempts'])
+VERDICTS = Counter('prashnotri_verification_verdicts_total', 'Final verifier verdicts per question batch', ['verdict'])
+CACHE_LOOKUPS = Counter('prashnotri_cache_lookups_total', 'Cache lookups by cache and result', ['cache', 'result'])
+WEBHOOK_FAILURES = Counter('prashnotri_webhook_failures_total', 'Failed outbound webhooks', ['webhook'])
+MEMORY_REFUSALS = Counter('prashnotri_memory_refusals_total', 'Heavy jobs refused by the memory governor')
+
+RSS_BYTES = Gauge('prashnotri_worker_rss_bytes', 'Resident set size per worker', multiprocess_mode='all')
+LOADED_VECTORSTORES = Gauge('prashnotri_loaded_vectorstores', 'Vectorstores mapped across workers', multiprocess_mode='livesum')
+INFLIGHT_JOBS = Gauge('prashnotri_inflight_jobs', 'Paper generation requests in progress', multiprocess_mode='livesum')
+
+_synced_cache_stats = dict(mmap_store.cache_stats)
+
+
+def _observe_stage(record: Dict[str, Any]) -> None:
+    """stage_metrics observer: LLM latency, tokens and 429s per chain"""
+    chain = record['stage']
+    if chain not in LLM_CHAINS:
+        return
+    LLM_CALL_LATENCY.labels(chain=chain).observe(record['seconds'])
+    for kind in ('prompt', 'cached', 'completion'):
+        if record.get(f'{kind}_tokens'):
+            LLM_TOKENS.labels(chain=chain, kind=kind).inc(record[f'{kind}_tokens'])
+    if record.get('error') == 'RateLimitError':
+        LLM_RATE_LIMITED.labels(chain=chain).inc()
+
+
+stage_metrics.add_stage_observer(_observe_stage)
+
+
+def record_batch_result(result: Dict[str, Any]) -> None:
+    """Count attempts used and the final verdict of one generate_questions result"""
+    ATTEMPTS_USED.labels(attempts=str(result.get('attempts_used', 1))).inc()
+    verdict = (result.get('verification_result') or {}).get('overall_verdict', 'UNKNOWN')
+    VERDICTS.labels(verdict=verdict).inc()
+
+
+def update_process_gauges() -> None:
+    """Refresh this worker's RSS and vectorstore gauges and sync cache counters"""
+    RSS_BYTES.set(psutil.Process(os.getpid()).memory_info().rss)
+    LOADED_VECTORSTORES.set(mmap_store.cached_store_count())
+    for result, key in (('hit', 'hits'), ('miss', 'misses')):
+        delta = mmap_store.cache_stats[key] - _synced_cache_stats[key]
+        if delta:
+            CACHE_LOOKUPS.labels(cache='vectorstore', result=result).inc(delta)
+            _synced_cache_stats[key] += delta
+
+
+def observe_request(endpoint: str, method: str, status: int, started: float) -> None:
+    REQUEST_LATENCY.labels(endpoint=endpoint, method=method, status=str(status)).observe(time.perf_counter() - started)
+    update_process_gauges()
+
+
+def render_metrics() -> tuple:
+    """Prometheus text exposition, merged across all worker processes in multiprocess mode"""
+    if not MULTIPROCESS:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
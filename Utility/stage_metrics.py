@@ -0,0 +1,160 @@
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from Utility import tracing
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Per-stage token and latency accounting
+# -------------------------------
+# A StageRecorder is bound to the current request with `recording()`; code
+# anywhere below it wraps work in `track_stage(name)` and adds token usage
+# to the yielded record. Outside a recording, records only reach observers.
+# Finished requests are folded into a per-process aggregate for /api/metrics.
+# Every stage is also a tracing span carrying the record as attributes.
+
+STAGES = ('retrieval', 'generation', 'parsing', 'verification', 'revision', 'pdf', 's3')
+TOKEN_FIELDS = ('prompt_tokens', 'cached_tokens', 'completion_tokens')
+SAMPLE_WINDOW = 2048  # latency samples kept per stage for percentiles
+
+_current_recorder: ContextVar[Optional["StageRecorder"]] = ContextVar('stage_recorder', default=None)
+_current_labels: ContextVar[Dict[str, Any]] = ContextVar('stage_labels', default={})
+_observers: List[Callable[[Dict[str, Any]], None]] = []
+
+
+def add_stage_observer(observer: Callable[[Dict[str, Any]], None]) -> None:
+    """Call `observer` with every finished stage record, e.g. to export it"""
+    _observers.append(observer)
+
+
+class StageRecorder:
+    """Wall time and token records for one request"""
+
+    def __init__(self, request_id: str = None):
+        self.request_id = request_id
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def add(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self.records.append(record)
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals per stage plus the individual records, ready to store with the paper"""
+        stages: Dict[str, Dict[str, Any]] = {}
+        for record in self.records:
+            totals = stages.setdefault(record['stage'], {'calls': 0, 'seconds': 0.0, **{field: 0 for field in TOKEN_FIELDS}})
+            totals['calls'] += 1
+            totals['seconds'] += record['seconds']
+            for field in TOKEN_FIELDS:
+                totals[field] += record.get(field, 0)
+        for totals in stages.values():
+            totals['seconds'] = round(totals['seconds'], 4)
+        return {
+            'request_id': self.request_id,
+            'wall_seconds': round(time.perf_counter() - self._started, 4),
+            'stages': stages,
+            'records': list(self.records),
+        }
+
+
+class _Aggregate:
+    """In-process rollup of finished requests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.stages: Dict[str, Dict[str, Any]] = {}
+
+    def merge(self, recorder: StageRecorder) -> None:
+        with self._lock:
+            self.requests += 1
+            for record in recorder.records:
+                stage = self.stages.setdefault(record['stage'], {
+                    'calls': 0, 'seconds': 0.0, 'samples': deque(maxlen=SAMPLE_WINDOW),
+                    **{field: 0 for field in TOKEN_FIELDS}
+                })
+                stage['calls'] += 1
+                stage['seconds'] += record['seconds']
+                stage['samples'].append(record['seconds'])
+                for field in TOKEN_FIELDS:
+                    stage[field] += record.get(field, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                samples = np.fromiter(stage['samples'], dtype=np.float64)
+                stages[name] = {
+                    'calls': stage['calls'],
+                    'seconds_total': round(stage['seconds'], 4),
+                    'seconds_mean': round(stage['seconds'] / stage['calls'], 4),
+                    'seconds_p50': round(float(np.percentile(samples, 50)), 4),
+                    'seconds_p95': round(float(np.percentile(samples, 95)), 4),
+                    **{field: stage[field] for field in TOKEN_FIELDS},
+                }
+            return {'requests': self.requests, 'stages': stages}
+
+
+aggregate = _Aggregate()
+
+
+@contextmanager
+def recording(request_id: str = None) -> Iterator[StageRecorder]:
+    """Bind a new recorder to the current request; merged into the aggregate on exit"""
+    recorder = StageRecorder(request_id)
+    token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_recorder.reset(token)
+        aggregate.merge(recorder)
+
+
+@contextmanager
+def stage_labels(**labels: Any) -> Iterator[None]:
+    """Labels (topic, batch, ...) added to every stage recorded inside the block"""
+    token = _current_labels.set({**_current_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        _current_labels.reset(token)
+
+
+@contextmanager
+def track_stage(stage: str, **labels: Any) -> Iterator[Dict[str, Any]]:
+    """Time a stage; callers may add token counts to the yielded record"""
+    recorder = _current_recorder.get()
+    record: Dict[str, Any] = {'stage': stage, **_current_labels.get(), **labels}
+    with tracing.span(stage) as span:
+        if recorder is None and not _observers:
+            try:
+                yield record
+            finally:
+                span.set_attributes(record)
+            return
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 4)
+            span.set_attributes(record)
+            if recorder is not None:
+                recorder.add(record)
+            for observer in _observers:
+                try:
+                    observer(record)
+                except Exception as e:
+                    logger.warning(f"Stage observer failed: {e}")
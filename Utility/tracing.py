@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import logging
+import secrets
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from Utility.config import startup_value
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Request tracing
+# -------------------------------
+# OpenTelemetry-style spans: one root span per request, nested child spans
+# for topic batches, chain invocations, Mongo, PDF, S3 and webhooks. The
+# current span lives in a ContextVar so nesting follows the call stack.
+# Finished spans are appended to TRACE_EXPORT_PATH as OTLP/JSON lines (one
+# ExportTraceServiceRequest per line, the collector's file exporter format),
+# so traces can be inspected offline or replayed into a collector with its
+# otlpjsonfile receiver. Tracing is off unless TRACE_EXPORT_PATH is set.
+
+SERVICE_NAME = 'prashnotri'
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar('current_span', default=None)
+
+
+class Span:
+    """One timed operation; attributes may be added until it ends"""
+
+    recording = True
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.status = STATUS_UNSET
+        self.status_message = ''
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        self.attributes.update(attributes)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1 if self.parent_id else 2,  # INTERNAL, root spans are SERVER
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in self.attributes.items() if value is not None],
+            'status': {'code': self.status, **({'message': self.status_message} if self.status_message else {})},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Returned while tracing is disabled"""
+
+    recording = False
+    trace_id = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class FileSpanExporter:
+    """Appends finished spans to a file as OTLP/JSON lines"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans: List[Span]) -> None:
+        line = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [
+                {'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}},
+                {'key': 'process.pid', 'value': {'intValue': str(os.getpid())}},
+            ]},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': [span.to_otlp() for span in spans]}],
+        }]})
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+_export_path = startup_value('TRACE_EXPORT_PATH')
+_exporter: Optional[FileSpanExporter] = FileSpanExporter(_export_path) if _export_path else None
+
+
+def configure(path: Optional[str]) -> None:
+    """Export spans to `path`, or disable tracing with None"""
+    global _exporter
+    _exporter = FileSpanExporter(path) if path else None
+
+
+def current_span():
+    """The innermost active span, or a no-op span"""
+    return _current_span.get() or _NOOP_SPAN
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """Run the block inside a child of the current span (a new trace if there is none)"""
+    exporter = _exporter
+    if exporter is None:
+        yield _NOOP_SPAN
+        return
+
+    parent = _current_span.get()
+    new_span = Span(name, parent.trace_id if parent else secrets.token_hex(16), parent.span_id if parent else None, attributes)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+        if new_span.status == STATUS_UNSET:
+            new_span.status = STATUS_OK
+    except BaseException as e:
+        new_span.status = STATUS_ERROR
+        new_span.status_message = f"{type(e).__name__}: {e}"[:512]
+        raise
+    finally:
+        new_span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        try:
+            exporter.export([new_span])
+        except Exception as e:
+            logger.warning(f"Span export failed: {e}")
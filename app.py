@@ -1,50 +1,45 @@
 import os
 import logging
+import time
+import uuid
 from datetime import datetime, timedelta
 
-log_dir = "logging"
-os.makedirs(log_dir, exist_ok=True)
-log_filename = f"{log_dir}/app_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-logging.basicConfig(
-    filename=log_filename,
-    level=logging.INFO,
-    format='%(message)s'
-)
-logging.info("Test log entry: Logging is working.")
+from Utility.logging import setup_logging, bind_request_id
 
-print("Logging to:", os.path.abspath(log_filename))  # Add this for debugging
+# Route logging through a queue to a rotating per-worker JSON file
+setup_logging()
 
 
-from flask import Flask, request, jsonify, send_from_directory, make_response
+from flask import Flask, request, jsonify, send_from_directory, make_response, g
 from flask_cors import CORS
 from pymongo import MongoClient
 
-from dotenv import load_dotenv
 import pytz
-import openai
 import json
 from bson import ObjectId
-import httpx
-import boto3
-from botocore.exceptions import ClientError
 import io
+import threading
 import asyncio
 import hashlib
 #from concurrent.futures import ThreadPoolExecutor
+# Heavy modules (LangChain/Azure clients, openai, boto3, reportlab) load
+# lazily; mylang4 builds its components on first use or in warm_up()
 import mylang4  # Import the LangChain module
 #from langchain.vectorstores import Chroma
-from langchain_community.embeddings import OpenAIEmbeddings
 #from question_prompt import QuestionPromptGenerator
-from langchain_community.vectorstores import FAISS
-from Utility.pdfmaker import CreatePDF
+from Utility.mmap_store import is_mmap_store, load_mmap_store, evict_mmap_store, remove_documents
+from Utility import stage_metrics
+from Utility import prometheus_metrics
+from Utility import tracing
+from Utility import profiler
+from Utility.config import config, get_settings, startup_value
+from Utility.memory_governor import MemoryGovernor, MemoryPressure
 import requests 
 
 import re
-import gc
+import functools
 import psutil
 
-# Load environment variables
-load_dotenv()
 
 
 
@@ -52,6 +47,26 @@ load_dotenv()
 # Initialize Flask app
 app = Flask(__name__, static_folder='dist', static_url_path='')
 
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    bind_request_id(g.request_id)
+
+
+@app.after_request
+def observe_request_latency(response):
+    # Label by route rule, not raw path, to keep label cardinality bounded
+    if 'request_started' in g and request.url_rule is not None:
+        prometheus_metrics.observe_request(request.url_rule.rule, request.method, response.status_code, g.request_started)
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    if 'profile_id' in g:
+        response.headers['X-Profile-Id'] = g.profile_id
+    return response
+
+
 def generate_email(data):
     return f"""
     Dear Student,<br><br>
@@ -78,59 +93,115 @@ CORS(app, resources={
 
 # Initialize MongoDB with configurable database and collections
 try:
-    MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
-    DB_NAME = os.getenv('DB_NAME', 'question_paper_db')
-    REQUEST_COLLECTION = os.getenv('REQUEST_COLLECTION', 'question_requests')
-    PAPER_COLLECTION = os.getenv('PAPER_COLLECTION', 'question_papers')
+    startup_settings = get_settings()
     
-    client = MongoClient(MONGODB_URI)
-    db = client[DB_NAME]
-    requests_collection = db[REQUEST_COLLECTION]
-    papers_collection = db[PAPER_COLLECTION]
+    # connect=False: no monitor threads until first use, so the client is fork-safe under preload
+    client = MongoClient(startup_settings.mongodb_uri, connect=False)
+    db = client[startup_settings.db_name]
+    requests_collection = db[startup_settings.request_collection]
+    papers_collection = db[startup_settings.paper_collection]
     logging.info("MongoDB Connection Successful!")
 except Exception as e:
     logging.info(f"MongoDB Connection Error: {e}")
     db = None
 
-# Initialize OpenAI client
-try:
-    #benifit is retrying upto finite time
-    http_client = httpx.Client(
-        base_url=os.getenv('AZURE_OPENAI_ENDPOINT'),
-        timeout=60.0,
-        follow_redirects=True
-    )
-    
-    openai_client = openai.AzureOpenAI(
-        api_key=os.getenv('AZURE_OPENAI_API_KEY'),
-        azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT'),
-        api_version=os.getenv('AZURE_OPENAI_API_VERSION'),
-        http_client=http_client
-    )
-    logging.info("Azure OpenAI client initialized successfully")
-except Exception as e:
-    logging.info(f"Error initializing OpenAI client: {e}")
-    raise
+# OpenAI and S3 clients are built on first use; importing openai and boto3
+# dominates worker start-up otherwise
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _lazy_client(name, factory):
+    if name not in _clients:
+        with _clients_lock:
+            if name not in _clients:
+                _clients[name] = factory()
+    return _clients[name]
+
+
+def get_openai_client():
+    def build():
+        import httpx
+        import openai
+        #benifit is retrying upto finite time
+        settings = get_settings()
+        http_client = httpx.Client(
+            base_url=settings.azure_openai_endpoint,
+            timeout=60.0,
+            follow_redirects=True
+        )
+        openai_client = openai.AzureOpenAI(
+            api_key=settings.azure_openai_api_key,
+            azure_endpoint=settings.azure_openai_endpoint,
+            api_version=settings.azure_openai_api_version,
+            http_client=http_client
+        )
+        logging.info("Azure OpenAI client initialized successfully")
+        return openai_client
+    return _lazy_client('openai', build)
 
 
 # Export the client for use in other modules
-__all__ = ['openai_client']
+__all__ = ['get_openai_client']
+
+
+def get_s3_client():
+    def build():
+        import boto3
+        settings = get_settings()
+        s3_client = boto3.client(
+            's3',
+            aws_access_key_id=settings.aws_access_key_id,
+            aws_secret_access_key=settings.aws_secret_access_key,
+            region_name=settings.aws_region
+        )
+        logging.info("AWS S3 client initialized successfully")
+        return s3_client
+    return _lazy_client('s3', build)
 
 
-# Initialize AWS S3 client
-try:
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        region_name=os.getenv('AWS_REGION', 'us-east-1')
+# Clients rebuilt when .env changes the settings they were built from
+CLIENT_SETTINGS = {
+    'openai': {'azure_openai_api_key', 'azure_openai_endpoint', 'azure_openai_api_version'},
+    's3': {'aws_access_key_id', 'aws_secret_access_key', 'aws_region'},
+}
+CLIENT_FACTORIES = {'openai': get_openai_client, 's3': get_s3_client}
+
+
+def rebuild_clients(old, new, changed):
+    """Config listener (runs on the watcher thread): replace affected clients already built"""
+    for name, keys in CLIENT_SETTINGS.items():
+        if name in _clients and changed & keys:
+            with _clients_lock:
+                previous = _clients.pop(name)
+            try:
+                CLIENT_FACTORIES[name]()
+                logging.info(f"Rebuilt {name} client after config change")
+            except Exception as e:
+                _clients.setdefault(name, previous)
+                logging.error(f"Failed to rebuild {name} client, keeping the old one: {e}")
+
+
+config.on_change(rebuild_clients)
+config.start_watcher()
+
+
+def warm_up():
+    """Build the LangChain components and S3 client and load reportlab ahead of traffic
+
+    Runs in the gunicorn master before forking when preloading, else in a
+    background thread per worker. Must not touch Mongo or open sockets.
+    """
+    started = time.perf_counter()
+    mylang4.warm_up()
+    get_s3_client()
+    # One throwaway render loads reportlab's fonts, style sheets and parsers
+    from Utility.pdfmaker import CreatePDF
+    CreatePDF.generate(
+        [{'topic': 'Warm-up', 'questions': [{'question': 'Q', 'options': ['A'], 'answer': 'A', 'explanation': 'E'}]}],
+        'warm_up.pdf'
     )
-    S3_BUCKET = os.getenv('S3_BUCKET_NAME')
-    NOTES_BUCKET = os.getenv('NOTES_BUCKET_NAME')  # Separate bucket for notes
-    logging.info("AWS S3 Connection Successful!")
-except Exception as e:
-    logging.info(f"AWS S3 Connection Error: {e}")
-    s3_client = None
+    logging.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
 
 # Add memory monitoring function
 def monitor_memory():
@@ -138,16 +209,50 @@ def monitor_memory():
     memory_info = process.memory_info()
     return memory_info.rss / 1024 / 1024  # Convert to MB
 
-# Add cleanup function
-def cleanup_memory():
-    gc.collect()
-    if hasattr(psutil.Process(), "memory_maps"):
-        for proc in psutil.process_iter(['pid', 'name']):
-            if proc.info['name'] == 'python':
-                try:
-                    proc.kill()
-                except:
-                    pass
+# Refuses heavy jobs near the memory limit and recycles the worker past it
+# (sampling starts in gunicorn's post_worker_init, or in __main__)
+memory_governor = MemoryGovernor(monitor_memory)
+
+
+def heavy_job(view):
+    """Admit the request through the memory governor, else answer 503"""
+    @functools.wraps(view)
+    def guarded(*args, **kwargs):
+        try:
+            with memory_governor.job():
+                return view(*args, **kwargs)
+        except MemoryPressure as e:
+            logging.warning(f"Refused {request.path}: {e}")
+            prometheus_metrics.MEMORY_REFUSALS.inc()
+            response = jsonify({'success': False, 'error': str(e)})
+            response.headers['Retry-After'] = '30'
+            return response, 503
+    return guarded
+
+
+def profiled(view):
+    """Sample the view's stacks when the request is picked for profiling (Utility/profiler.py)"""
+    if not profiler.ENABLED:
+        return view
+
+    @functools.wraps(view)
+    def sampled(*args, **kwargs):
+        if not profiler.wants_profile(request.headers.get('X-Profile'), request.headers.get('X-Admin-Token')):
+            return view(*args, **kwargs)
+        with profiler.profiling(g.request_id, request.path) as profile_id:
+            g.profile_id = profile_id
+            return view(*args, **kwargs)
+    return sampled
+
+def get_index_path(data):
+    """Persistent per-user/per-course index directory, or None without both keys"""
+    email = (data.get('email') or '').strip().lower()
+    course = data.get('course') or '-'.join(str(data[k]) for k in ('subjectName', 'classGrade') if data.get(k))
+    if not email or not course:
+        return None
+    user_key = hashlib.sha256(email.encode()).hexdigest()[:16]
+    course_key = re.sub(r'[^a-z0-9]+', '-', str(course).lower()).strip('-') or 'default'
+    return os.path.join('vectorstores', user_key, course_key)
 
 @app.route('/')
 def serve():
@@ -164,98 +269,100 @@ def serve_static(path):
 #question_generator = QuestionPromptGenerator()
 
 @app.route('/api/generate-questions', methods=['POST'])
+@profiled
+@heavy_job
 def generate_questions():
-    load_dotenv(override=True)
+    # Stage timings and token counts for this request, stored with the paper
+    prometheus_metrics.INFLIGHT_JOBS.inc()
     try:
-        logging.info("Received request at /api/generate-questions")
-        data = request.get_json()
-        user_email = data['email']
+        with tracing.span('POST /api/generate-questions') as root_span, stage_metrics.recording() as recorder:
+            response = _generate_questions(recorder)
+            status = response[1] if isinstance(response, tuple) else 200
+            root_span.set_attribute('http.status_code', status)
+            return response
+    finally:
+        prometheus_metrics.INFLIGHT_JOBS.dec()
 
-        if not data:
-            return jsonify({'success': False, 'error': 'No data provided'}), 400
 
-        # Validate required fields
-        required_fields = ['email', 'subjectName', 'classGrade', 'topics']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'success': False, 'error': f"Missing required field: {field}"}), 400
+# Steps of paper generation shared with the async server (asgi.py), which
+# awaits the Mongo, S3, LLM and webhook I/O between them
 
-        # Insert request metadata
-        data['created_at'] = datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M:%S')
-        request_id = requests_collection.insert_one(data).inserted_id
+# Questions per generate_questions call when a topic asks for more
+QUESTION_BATCH_SIZE = 5
 
-        # Load vectorstore if exists
-        vectorstore_path = "vectorstores/latest"
-        vectorstore = None
-        if os.path.exists(vectorstore_path):
-            try:
-                embeddings = OpenAIEmbeddings()
-                vectorstore = FAISS.load_local(vectorstore_path, embeddings, allow_dangerous_deserialization=True)
-                logging.info(f"Loaded vectorstore from {vectorstore_path}")
-            except Exception as e:
-                logging.warning(f"Vectorstore load failed: {e}")
 
-        # Generate questions for each topic in batches
-        all_questions = []
-        for topic in data['topics']:
-            topic_data = {
-                **topic,
-                'subjectName': data['subjectName'],
-                'classGrade': data['classGrade']
-            }
+def validate_paper_request(data):
+    """Error message for a malformed generate-questions body, else None"""
+    if not data:
+        return 'No data provided'
+    for field in ('email', 'subjectName', 'classGrade', 'topics'):
+        if field not in data:
+            return f"Missing required field: {field}"
+    return None
 
-            try:
-                num_qs = int(topic.get('numQuestions', 1))
-            except ValueError:
-                num_qs = 1
 
-            batch_size = 5
-            topic_questions = []
+def now_ist():
+    return datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M:%S')
 
-            for i in range(0, num_qs, batch_size):
-                current_batch = min(batch_size, num_qs - i)
-                batch_data = {**topic_data, 'numQuestions': current_batch}
 
-                questions = mylang4.question_generator.generate_questions(batch_data, vectorstore, mylang4.question_verifier)
-                # Handle the returned structure correctly
-                if isinstance(questions['questions'], dict) and 'questions' in questions['questions']:
-                    # If questions['questions'] is a dict with nested 'questions' key
-                    topic_questions.extend(questions['questions']['questions'])
-                elif isinstance(questions['questions'], list):
-                    # If questions['questions'] is directly a list
-                    topic_questions.extend(questions['questions'])
-                else:
-                    # Fallback - try to extract questions from the result
-                    logging.error(f"Unexpected questions structure: {type(questions['questions'])}")
-                    if isinstance(questions['questions'], dict):
-                        topic_questions.extend(questions['questions'].get('questions', []))
-                
-                # Log verification results
-                if 'verification_result' in questions:
-                    logging.info(f"Question verification for topic '{topic.get('sectionName', '')}': {questions['verification_result']['overall_verdict']} (Attempts: {questions.get('attempts_used', 1)})")
-                    if questions.get('warning'):
-                        logging.warning(f"Quality warning for topic '{topic.get('sectionName', '')}': {questions['warning']}")
-
-                # Free memory
-                gc.collect()
+def load_request_vectorstore(data):
+    """(vectorstore or None, its path, whether it is a persistent course index)
 
-            all_questions.append({
-                'topic': topic.get('sectionName', ''),
-                'questions': topic_questions,
-                'cached': False
-            })
+    The user's persistent course index, else the one-shot index from the
+    last analysed note.
+    """
+    index_path = get_index_path(data)
+    persistent_index = bool(index_path) and is_mmap_store(index_path)
+    vectorstore_path = index_path if persistent_index else "vectorstores/latest"
+    vectorstore = None
+    if is_mmap_store(vectorstore_path):
+        try:
+            vectorstore = load_mmap_store(vectorstore_path, mylang4.document_processor.embeddings)
+            logging.info(f"Loaded memory-mapped vectorstore from {vectorstore_path}")
+        except Exception as e:
+            logging.warning(f"Memory-mapped vectorstore load failed: {e}")
+    elif os.path.exists(vectorstore_path):
+        # Pickled FAISS.save_local stores are not loaded on the request path
+        logging.warning(f"Vectorstore at {vectorstore_path} is in the legacy pickle format; "
+                        f"convert it with `python -m Utility.mmap_store {vectorstore_path}`")
+    return vectorstore, vectorstore_path, persistent_index
 
-        # Save to MongoDB
-        paper_data = {
-            'request_id': str(request_id),
-            'questions': all_questions,
-            'created_at': datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M:%S'),
-            'previous_paper_id': data.get('previous_paper_id')
-        }
-        paper_id = papers_collection.insert_one(paper_data).inserted_id
 
-        # Generate PDFs
-        pdf_filename = f"question_paper_{paper_id}.pdf"
+def topic_question_count(topic):
+    try:
+        return int(topic.get('numQuestions', 1))
+    except ValueError:
+        return 1
+
+
+def collect_batch_questions(topic, questions, topic_questions):
+    """Append one batch result's questions to `topic_questions` and log its verdict"""
+    prometheus_metrics.record_batch_result(questions)
+    # Handle the returned structure correctly
+    if isinstance(questions['questions'], dict) and 'questions' in questions['questions']:
+        # If questions['questions'] is a dict with nested 'questions' key
+        topic_questions.extend(questions['questions']['questions'])
+    elif isinstance(questions['questions'], list):
+        # If questions['questions'] is directly a list
+        topic_questions.extend(questions['questions'])
+    else:
+        # Fallback - try to extract questions from the result
+        logging.error(f"Unexpected questions structure: {type(questions['questions'])}")
+        if isinstance(questions['questions'], dict):
+            topic_questions.extend(questions['questions'].get('questions', []))
+
+    # Log verification results
+    if 'verification_result' in questions:
+        logging.info(f"Question verification for topic '{topic.get('sectionName', '')}': {questions['verification_result']['overall_verdict']} (Attempts: {questions.get('attempts_used', 1)})")
+        if questions.get('warning'):
+            logging.warning(f"Quality warning for topic '{topic.get('sectionName', '')}': {questions['warning']}")
+
+
+def render_and_upload_pdf(all_questions, data, paper_id, settings):
+    """Render the paper PDF, upload it to S3 and return a presigned URL"""
+    pdf_filename = f"question_paper_{paper_id}.pdf"
+    from Utility.pdfmaker import CreatePDF
+    with stage_metrics.track_stage('pdf'):
         pdf_buffer = CreatePDF.generate(
             all_questions,
             pdf_filename,
@@ -263,50 +370,161 @@ def generate_questions():
             subject_name=data['subjectName']
         )
 
-        s3_client.upload_fileobj(
+    with stage_metrics.track_stage('s3'):
+        get_s3_client().upload_fileobj(
             pdf_buffer,
-            S3_BUCKET,
+            settings.s3_bucket,
             pdf_filename,
             ExtraArgs={'ContentType': 'application/pdf'}
         )
 
-        pdf_url = s3_client.generate_presigned_url(
+        return get_s3_client().generate_presigned_url(
             'get_object',
-            Params={'Bucket': S3_BUCKET, 'Key': pdf_filename},
+            Params={'Bucket': settings.s3_bucket, 'Key': pdf_filename},
             ExpiresIn=3600
         )
 
+
+def cleanup_request_vectorstore(vectorstore_path, persistent_index):
+    # Persistent course indexes are kept for later papers
+    if not persistent_index and os.path.exists(vectorstore_path):
+        try:
+            import shutil
+            evict_mmap_store(vectorstore_path)
+            shutil.rmtree(vectorstore_path)
+            logging.info(f"Cleaned up vectorstore directory: {vectorstore_path}")
+        except Exception as e:
+            logging.warning(f"Failed to delete vectorstore directory: {e}")
+
+
+def google_form_payload(data, all_questions):
+    return {
+        "email": data['email'],
+        "paper_name": data['subjectName'],
+        "class_grade": data['classGrade'],
+        "all_questions": all_questions,
+    }
+
+
+def n8n_payload(data, all_questions, google_form_url, pdf_url):
+    return {
+        "email": data['email'],
+        "paper_name": data['subjectName'],
+        "class_grade": data['classGrade'],
+        "all_questions": all_questions,
+        "topics": data['topics'],
+        "num_questions": sum(int(t.get('numQuestions', 1)) for t in data['topics']),
+        "google_form_url": google_form_url,
+        "pdf_url": pdf_url,
+    }
+
+
+def _generate_questions(recorder):
+    settings = get_settings()  # one snapshot for the whole request
+    try:
+        logging.info("Received request at /api/generate-questions")
+        data = request.get_json()
+        error = validate_paper_request(data)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+
+        # Insert request metadata
+        data['created_at'] = now_ist()
+        with tracing.span('mongo.insert', collection='requests'):
+            request_id = requests_collection.insert_one(data).inserted_id
+        recorder.request_id = str(request_id)
+        logging.info("Stored paper request", extra={'paper_request_id': str(request_id)})
+        tracing.current_span().set_attributes({'request_id': str(request_id), 'topics': len(data['topics'])})
+
+        vectorstore, vectorstore_path, persistent_index = load_request_vectorstore(data)
+
+        topics_data = [
+            {**topic, 'subjectName': data['subjectName'], 'classGrade': data['classGrade']}
+            for topic in data['topics']
+        ]
+
+        # Packing mode: small topics share LLM calls, keyed by topic index
+        packed_results = {}
+        pack_topics = data.get('packTopics', settings.pack_small_topics)
+        if pack_topics and len(topics_data) > 1:
+            packed_results = mylang4.question_generator.generate_questions_packed(
+                {str(index): topic_data for index, topic_data in enumerate(topics_data)},
+                vectorstore,
+                mylang4.question_verifier
+            )
+
+        def generate_batches(topic_data, num_qs, batch_size=QUESTION_BATCH_SIZE):
+            for i in range(0, num_qs, batch_size):
+                current_batch = min(batch_size, num_qs - i)
+                batch_data = {**topic_data, 'numQuestions': current_batch}
+                with tracing.span('topic_batch', topic=topic_data.get('sectionName', ''), batch=i // batch_size, questions=current_batch) as span, \
+                        stage_metrics.stage_labels(topic=topic_data.get('sectionName', ''), batch=i // batch_size):
+                    result = mylang4.question_generator.generate_questions(batch_data, vectorstore, mylang4.question_verifier)
+                    span.set_attributes({
+                        'attempts_used': result.get('attempts_used', 1),
+                        'verdict': (result.get('verification_result') or {}).get('overall_verdict'),
+                    })
+                yield result
+
+        # Generate questions for each topic in batches
+        all_questions = []
+        for index, (topic, topic_data) in enumerate(zip(data['topics'], topics_data)):
+            topic_questions = []
+
+            if str(index) in packed_results:
+                batch_results = [packed_results[str(index)]]
+            else:
+                batch_results = generate_batches(topic_data, topic_question_count(topic))
+
+            for questions in batch_results:
+                collect_batch_questions(topic, questions, topic_questions)
+
+            all_questions.append({
+                'topic': topic.get('sectionName', ''),
+                'questions': topic_questions,
+                'cached': False
+            })
+
+        # Save to MongoDB
+        paper_data = {
+            'request_id': str(request_id),
+            'questions': all_questions,
+            'created_at': now_ist(),
+            'previous_paper_id': data.get('previous_paper_id')
+        }
+        with tracing.span('mongo.insert', collection='papers'):
+            paper_id = papers_collection.insert_one(paper_data).inserted_id
+        tracing.current_span().set_attribute('paper_id', str(paper_id))
+
+        # Generate the PDF and upload it
+        pdf_url = render_and_upload_pdf(all_questions, data, paper_id, settings)
+
+        try:
+            with tracing.span('mongo.update', collection='papers'):
+                papers_collection.update_one({'_id': paper_id}, {'$set': {'metrics': recorder.summary()}})
+        except Exception as e:
+            logging.warning(f"Failed to store stage metrics for paper {paper_id}: {e}")
+
         # Final cleanups
-        if os.path.exists(vectorstore_path):
-            try:
-                import shutil
-                shutil.rmtree(vectorstore_path)
-                logging.info(f"Cleaned up vectorstore directory: {vectorstore_path}")
-            except Exception as e:
-                logging.warning(f"Failed to delete vectorstore directory: {e}")
+        cleanup_request_vectorstore(vectorstore_path, persistent_index)
 
 
         #try except block for google form connection
         try:
-            response = requests.post(
-                os.getenv('GOOGLE_FORM_WEBHOOK_URL'),
-                json={
-                "email": data['email'],
-                "paper_name": data['subjectName'],
-                "class_grade": data['classGrade'],
-                "all_questions": all_questions,
-            }
-        ) 
-
-        #print(all_questions)
-            response.raise_for_status()
-            result = response.json()
+            with tracing.span('webhook', webhook='google_form'):
+                response = requests.post(
+                    settings.google_form_webhook_url,
+                    json=google_form_payload(data, all_questions)
+                )
+                response.raise_for_status()
+                result = response.json()
 
             google_form_url = result.get("publicUrl")  # ✅ Capture public URL
 
             logging.info(f"Google Form webhook triggered successfully: {response.text}")
         except Exception as e:
             logging.error(f"Error in triggering google form webhook: {e}")
+            prometheus_metrics.WEBHOOK_FAILURES.labels(webhook='google_form').inc()
             google_form_url = None
 
 
@@ -327,26 +545,17 @@ def generate_questions():
 
 #try except block for n8n connection
         try:
-            response = requests.post(
-                os.getenv('N8N_WEBHOOK_URL'),
-               
-                json={
-
-                    "email": data['email'],
-                    "paper_name": data['subjectName'],
-                    "class_grade": data['classGrade'],
-                    "all_questions": all_questions,
-                    "topics": data['topics'],
-                    "num_questions": sum(int(t.get('numQuestions', 1)) for t in data['topics']),
-                    "google_form_url": google_form_url,
-                    "pdf_url": pdf_url,
-                },
-                timeout=10
-            )
-            response.raise_for_status()
+            with tracing.span('webhook', webhook='n8n'):
+                response = requests.post(
+                    settings.n8n_webhook_url,
+                    json=n8n_payload(data, all_questions, google_form_url, pdf_url),
+                    timeout=10
+                )
+                response.raise_for_status()
             logging.info(f"n8n webhook triggered successfully: {response.text}")
         except Exception as e:
             logging.error(f"Error in triggering n8n webhook: {e}")
+            prometheus_metrics.WEBHOOK_FAILURES.labels(webhook='n8n').inc()
 
 #canI try to directly send email to user here?
             
@@ -370,15 +579,49 @@ def generate_questions():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Per-stage latency percentiles and token totals for this worker process"""
+    return jsonify(stage_metrics.aggregate.snapshot())
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_scrape():
+    """Prometheus exposition, aggregated across all gunicorn workers"""
+    body, content_type = prometheus_metrics.render_metrics()
+    return app.response_class(body, content_type=content_type)
+
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def list_profiles():
+    """Saved request profiles, newest first; needs X-Admin-Token"""
+    if not profiler.is_admin(request.headers.get('X-Admin-Token')):
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    return jsonify({'success': True, 'profiles': profiler.list_profiles()})
+
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """One profile as ?format=speedscope (default) or collapsed; needs X-Admin-Token"""
+    if not profiler.is_admin(request.headers.get('X-Admin-Token')):
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    fmt = request.args.get('format', 'speedscope')
+    filename = profiler.profile_file(profile_id, fmt)
+    if filename is None:
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    return send_from_directory(os.path.abspath(profiler.PROFILE_DIR), filename,
+                               mimetype=profiler.FORMATS[fmt][1], as_attachment=True)
+
+
 @app.route('/api/download-pdf/<paper_id>', methods=['GET'])
 def download_pdf(paper_id):
     try:
         filename = f"question_paper_{paper_id}.pdf"
         # Generate a pre-signed URL for the S3 object
-        url = s3_client.generate_presigned_url(
+        url = get_s3_client().generate_presigned_url(
             'get_object',
             Params={
-                'Bucket': S3_BUCKET,
+                'Bucket': get_settings().s3_bucket,
                 'Key': filename
             },
             ExpiresIn=3600  # URL expires in 1 hour
@@ -432,9 +675,10 @@ def upload_note():
         file.save(local_path)
 
         # Upload to S3 (no metadata)
-        s3_client.upload_fileobj(
+        notes_bucket = get_settings().notes_bucket  # Separate bucket for notes
+        get_s3_client().upload_fileobj(
             file,
-            NOTES_BUCKET,
+            notes_bucket,
             filename,
             ExtraArgs={'ContentType': 'application/pdf'}
         )
@@ -444,7 +688,7 @@ def upload_note():
             'filename': filename,
             'original_name': file.filename,
             'uploaded_at': datetime.now(pytz.timezone('Asia/Kolkata')).strftime('%Y-%m-%d %H:%M:%S'),
-            's3_url': f"s3://{NOTES_BUCKET}/{filename}"
+            's3_url': f"s3://{notes_bucket}/{filename}"
         }
         notes_collection = db['notes']
         note_id = notes_collection.insert_one(note_data).inserted_id
@@ -462,11 +706,31 @@ def upload_note():
 
 
 @app.route('/api/analyse-note', methods=['POST'])
+@profiled
+@heavy_job
 def analyse_note():
+    payload, status = analyse_note_job(request.get_json(silent=True) or {})
+    return jsonify(payload), status
+
+
+def analyse_note_job(data):
+    """Index the last uploaded PDF; (response body, status). Shared with asgi.py"""
     try:
         local_pdf_path = 'temp_uploads/latest.pdf'
         if not os.path.exists(local_pdf_path):
-            return jsonify({'success': False, 'error': 'No PDF found to analyze'}), 400
+            return {'success': False, 'error': 'No PDF found to analyze'}, 400
+
+        index_path = get_index_path(data)
+        if index_path:
+            # Append to the user's course index; only unseen chunks are embedded
+            stats = mylang4.document_processor.ingest_document(
+                local_pdf_path,
+                index_path,
+                subject=data.get('subjectName'),
+                grade=data.get('classGrade'),
+                note_id=data.get('note_id')
+            )
+            return {'success': True, **stats}, 200
 
         vectorstore_path = f'vectorstores/latest'
         os.makedirs(vectorstore_path, exist_ok=True)
@@ -474,9 +738,26 @@ def analyse_note():
 
         
 
-        return jsonify({'success': True})
+        return {'success': True}, 200
     except Exception as e:
         logging.info(f"Error in analyse_note: {e}")
+        return {'success': False, 'error': str(e)}, 500
+
+@app.route('/api/remove-note', methods=['POST'])
+def remove_note():
+    try:
+        data = request.get_json(silent=True) or {}
+        index_path = get_index_path(data)
+        if not index_path or not data.get('note_id'):
+            return jsonify({'success': False, 'error': 'email, course (or subjectName/classGrade) and note_id are required'}), 400
+        if not is_mmap_store(index_path):
+            return jsonify({'success': False, 'error': 'No index found for this course'}), 404
+
+        # Chunks are tombstoned now and dropped at the next compaction
+        removed = remove_documents(index_path, metadata_filter={'note_id': data['note_id']})
+        return jsonify({'success': True, 'removed': removed})
+    except Exception as e:
+        logging.info(f"Error in remove_note: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.errorhandler(404)
@@ -488,13 +769,16 @@ def server_error(e):
     return jsonify({"error": "Internal server error"}), 500
 
 if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5000))
+    memory_governor.start(recycle_signal=None)  # nothing would restart the dev server
+    port = int(startup_value('PORT', '5000'))
     logging.info(f"Server starting on http://localhost:{port}")
     logging.info(f"Serving static files from: {os.path.abspath(app.static_folder)}")
+    # The reloader/debugger is opt-in; production runs gunicorn (see
+    # gunicorn.conf.py) or the async server in asgi.py
     app.run(
         host='0.0.0.0',
         port=port,
-        debug=True
+        debug=startup_value('FLASK_DEBUG', 'false').lower() == 'true'
     )
 
 
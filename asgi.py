@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from a2wsgi import WSGIMiddleware
+
+import app as wsgi
+import mylang4
+from Utility import stage_metrics
+from Utility import prometheus_metrics
+from Utility import tracing
+from Utility import profiler
+from Utility.config import get_settings, startup_value
+from Utility.logging import bind_request_id
+from Utility.memory_governor import MemoryPressure
+
+# -------------------------------
+# Async serving mode
+# -------------------------------
+# The long-running endpoints (paper generation, note analysis) are served as
+# coroutines: LLM and note embedding calls are awaited through LangChain's
+# ainvoke and aembed_documents, webhooks through httpx.AsyncClient, and Mongo,
+# S3, retrieval, PDF parsing, FAISS builds and PDF rendering run in a bounded
+# thread pool, so a worker holds hundreds of in-flight papers instead of one
+# per OS process. Every other route is the Flask app from
+# app.py, run in a separate WSGI thread pool. Profiled requests (see
+# Utility/profiler.py) sample the event loop and blocking pool threads.
+#
+#   gunicorn --config gunicorn.conf.py --worker-class uvicorn.workers.UvicornWorker asgi:app
+#   python asgi.py   (single process, development)
+
+BLOCKING_THREADS = int(startup_value('ASYNC_BLOCKING_THREADS', '32'))
+WSGI_THREADS = int(startup_value('ASYNC_WSGI_THREADS', '10'))
+WEBHOOK_TIMEOUT_SECONDS = 60.0
+
+_http_client = None
+
+
+def http_client() -> httpx.AsyncClient:
+    """Shared client for webhook calls, created on the serving loop"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT_SECONDS)
+    return _http_client
+
+
+async def post_webhook(webhook, url, payload, **kwargs):
+    """POST `payload`; the decoded JSON response, or None after logging the failure"""
+    try:
+        with tracing.span('webhook', webhook=webhook):
+            response = await http_client().post(url, json=payload, **kwargs)
+            response.raise_for_status()
+        logging.info(f"{webhook} webhook triggered successfully: {response.text}")
+        return response.json() if response.content else {}
+    except Exception as e:
+        logging.error(f"Error in triggering {webhook} webhook: {e}")
+        prometheus_metrics.WEBHOOK_FAILURES.labels(webhook=webhook).inc()
+        return None
+
+
+async def generate_topic_batch(topic_data, batch, count, vectorstore):
+    batch_data = {**topic_data, 'numQuestions': count}
+    with tracing.span('topic_batch', topic=topic_data.get('sectionName', ''), batch=batch, questions=count) as span, \
+            stage_metrics.stage_labels(topic=topic_data.get('sectionName', ''), batch=batch):
+        result = await mylang4.question_generator.agenerate_questions(batch_data, vectorstore, mylang4.question_verifier)
+        span.set_attributes({
+            'attempts_used': result.get('attempts_used', 1),
+            'verdict': (result.get('verification_result') or {}).get('overall_verdict'),
+        })
+    return result
+
+
+async def _generate_questions(data, recorder):
+    """The app.py pipeline with its I/O awaited; (status, response body)"""
+    settings = get_settings()
+    try:
+        logging.info("Received request at /api/generate-questions")
+        error = wsgi.validate_paper_request(data)
+        if error:
+            return 400, {'success': False, 'error': error}
+
+        data['created_at'] = wsgi.now_ist()
+        with tracing.span('mongo.insert', collection='requests'):
+            request_id = (await asyncio.to_thread(wsgi.requests_collection.insert_one, data)).inserted_id
+        recorder.request_id = str(request_id)
+        logging.info("Stored paper request", extra={'paper_request_id': str(request_id)})
+        tracing.current_span().set_attributes({'request_id': str(request_id), 'topics': len(data['topics'])})
+
+        vectorstore, vectorstore_path, persistent_index = await asyncio.to_thread(wsgi.load_request_vectorstore, data)
+
+        topics_data = [
+            {**topic, 'subjectName': data['subjectName'], 'classGrade': data['classGrade']}
+            for topic in data['topics']
+        ]
+
+        packed_results = {}
+        if data.get('packTopics', settings.pack_small_topics) and len(topics_data) > 1:
+            packed_results = await mylang4.question_generator.agenerate_questions_packed(
+                {str(index): topic_data for index, topic_data in enumerate(topics_data)},
+                vectorstore,
+                mylang4.question_verifier
+            )
+
+        all_questions = []
+        for index, (topic, topic_data) in enumerate(zip(data['topics'], topics_data)):
+            topic_questions = []
+            if str(index) in packed_results:
+                wsgi.collect_batch_questions(topic, packed_results[str(index)], topic_questions)
+            else:
+                num_qs = wsgi.topic_question_count(topic)
+                for start in range(0, num_qs, wsgi.QUESTION_BATCH_SIZE):
+                    count = min(wsgi.QUESTION_BATCH_SIZE, num_qs - start)
+                    result = await generate_topic_batch(topic_data, start // wsgi.QUESTION_BATCH_SIZE, count, vectorstore)
+                    wsgi.collect_batch_questions(topic, result, topic_questions)
+            all_questions.append({
+                'topic': topic.get('sectionName', ''),
+                'questions': topic_questions,
+                'cached': False
+            })
+
+        paper_data = {
+            'request_id': str(request_id),
+            'questions': all_questions,
+            'created_at': wsgi.now_ist(),
+            'previous_paper_id': data.get('previous_paper_id')
+        }
+        with tracing.span('mongo.insert', collection='papers'):
+            paper_id = (await asyncio.to_thread(wsgi.papers_collection.insert_one, paper_data)).inserted_id
+        tracing.current_span().set_attribute('paper_id', str(paper_id))
+
+        pdf_url = await asyncio.to_thread(wsgi.render_and_upload_pdf, all_questions, data, paper_id, settings)
+
+        try:
+            with tracing.span('mongo.update', collection='papers'):
+                await asyncio.to_thread(
+                    wsgi.papers_collection.update_one, {'_id': paper_id}, {'$set': {'metrics': recorder.summary()}}
+                )
+        except Exception as e:
+            logging.warning(f"Failed to store stage metrics for paper {paper_id}: {e}")
+
+        await asyncio.to_thread(wsgi.cleanup_request_vectorstore, vectorstore_path, persistent_index)
+
+        result = await post_webhook('google_form', settings.google_form_webhook_url,
+                                    wsgi.google_form_payload(data, all_questions))
+        google_form_url = result.get("publicUrl") if result else None
+        await post_webhook('n8n', settings.n8n_webhook_url,
+                           wsgi.n8n_payload(data, all_questions, google_form_url, pdf_url), timeout=10)
+
+        return 200, {
+            'success': True,
+            'paper_id': str(paper_id),
+            'questions': all_questions,
+            'pdf_url': pdf_url
+        }
+    except Exception as e:
+        logging.error(f"Exception in /generate-questions: {str(e)}")
+        return 500, {'success': False, 'error': str(e)}
+
+
+async def generate_questions(data):
+    prometheus_metrics.INFLIGHT_JOBS.inc()
+    try:
+        with tracing.span('POST /api/generate-questions') as root_span, stage_metrics.recording() as recorder:
+            status, body = await _generate_questions(data, recorder)
+            root_span.set_attribute('http.status_code', status)
+            return status, body
+    finally:
+        prometheus_metrics.INFLIGHT_JOBS.dec()
+
+
+async def analyse_note(data):
+    """app.analyse_note_job with the embedding call awaited; (status, response body)"""
+    data = data or {}
+    try:
+        local_pdf_path = 'temp_uploads/latest.pdf'
+        if not os.path.exists(local_pdf_path):
+            return 400, {'success': False, 'error': 'No PDF found to analyze'}
+
+        index_path = wsgi.get_index_path(data)
+        if index_path:
+            # Append to the user's course index; only unseen chunks are embedded
+            stats = await mylang4.document_processor.aingest_document(
+                local_pdf_path,
+                index_path,
+                subject=data.get('subjectName'),
+                grade=data.get('classGrade'),
+                note_id=data.get('note_id')
+            )
+            return 200, {'success': True, **stats}
+
+        vectorstore_path = 'vectorstores/latest'
+        os.makedirs(vectorstore_path, exist_ok=True)
+        await mylang4.document_processor.aprocess_uploaded_document(local_pdf_path, persist_directory=vectorstore_path)
+        return 200, {'success': True}
+    except Exception as e:
+        logging.info(f"Error in analyse_note: {e}")
+        return 500, {'success': False, 'error': str(e)}
+
+
+# Heavy JSON endpoints served natively; both go through the memory governor
+ROUTES = {
+    ('POST', '/api/generate-questions'): generate_questions,
+    ('POST', '/api/analyse-note'): analyse_note,
+}
+
+
+def loop_and_blocking_threads():
+    """Threads a profiled request's work runs on: this event loop and the blocking pool
+
+    Both are shared, so a profile also holds whatever other requests ran there meanwhile.
+    """
+    loop_thread = threading.get_ident()
+    return lambda: {loop_thread} | {thread.ident for thread in threading.enumerate() if thread.name.startswith('blocking')}
+
+
+async def read_json(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionError('client disconnected')
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    body = b''.join(chunks)
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+
+async def send_json(send, status, body, headers=()):
+    payload = json.dumps(body).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode()), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+class AsyncApp:
+    """ASGI entry point: native coroutines for ROUTES, the Flask app for the rest"""
+
+    def __init__(self, routes, wsgi_app):
+        self.routes = routes
+        self.fallback = WSGIMiddleware(wsgi_app, workers=WSGI_THREADS)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        handler = self.routes.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+        if handler is None:
+            return await self.fallback(scope, receive, send)
+
+        started = time.perf_counter()
+        headers = dict(scope.get('headers') or [])
+        request_id = headers.get(b'x-request-id', b'').decode() or uuid.uuid4().hex
+        bind_request_id(request_id)
+        extra_headers = [(b'x-request-id', request_id.encode())]
+        profile = profiler.ENABLED and profiler.wants_profile(
+            headers.get(b'x-profile', b'').decode(), headers.get(b'x-admin-token', b'').decode())
+        try:
+            data = await read_json(receive)
+            with wsgi.memory_governor.job():
+                sampling = profiler.profiling(request_id, scope['path'], loop_and_blocking_threads()) if profile else nullcontext()
+                with sampling as profile_id:
+                    status, body = await handler(data)
+                if profile_id:
+                    extra_headers.append((b'x-profile-id', profile_id.encode()))
+        except ConnectionError:
+            return
+        except MemoryPressure as e:
+            logging.warning(f"Refused {scope['path']}: {e}")
+            prometheus_metrics.MEMORY_REFUSALS.inc()
+            status, body = 503, {'success': False, 'error': str(e)}
+            extra_headers.append((b'retry-after', b'30'))
+        await send_json(send, status, body, extra_headers)
+        prometheus_metrics.observe_request(scope['path'], scope['method'], status, started)
+
+    async def lifespan(self, receive, send):
+        global _http_client
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # asyncio.to_thread uses the loop's default executor
+                asyncio.get_running_loop().set_default_executor(
+                    ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix='blocking')
+                )
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if _http_client is not None:
+                    await _http_client.aclose()
+                    _http_client = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = AsyncApp(ROUTES, wsgi.app)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    wsgi.memory_governor.start(recycle_signal=None)  # nothing would restart the dev server
+    uvicorn.run(app, host='0.0.0.0', port=int(startup_value('PORT', '5000')))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Sync vs async deployment under concurrent paper generation
+
+Runs gunicorn from gunicorn.conf.py twice: sync workers serving app:app, and
+uvicorn workers serving asgi:app. Mongo, S3 and the LLM are replaced in each
+worker by benchmarks/stand_ins.py (LLM calls sleep LLM_LATENCY seconds), so
+the numbers show how many in-flight papers a deployment holds, not Azure's
+speed. For each concurrency level, that many clients each POST one paper to
+/api/generate-questions; reported are throughput, p50/p95 latency, failures
+and the peak summed RSS of the master and its workers.
+
+Usage: python benchmarks/bench_async_concurrency.py [sync_workers] [async_workers] [levels] [llm_latency]
+       e.g. python benchmarks/bench_async_concurrency.py 4 1 8,64,256 0.5
+"""
+
+import sys
+import time
+import asyncio
+import threading
+import statistics
+
+import httpx
+import psutil
+
+from stand_ins import serve
+
+PAPER = {
+    'email': 'loadtest@example.com',
+    'subjectName': 'Mathematics',
+    'classGrade': '10th',
+    'topics': [{'sectionName': 'Algebra', 'numQuestions': 2, 'questionType': 'MCQ',
+                'difficulty': 'Medium', 'bloomLevel': 'Understand'}],
+}
+
+
+class RssSampler(threading.Thread):
+    """Peak summed RSS of a process tree"""
+
+    def __init__(self, pid: int):
+        super().__init__(daemon=True)
+        self.root = psutil.Process(pid)
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                processes = [self.root, *self.root.children(recursive=True)]
+                self.peak = max(self.peak, sum(p.memory_info().rss for p in processes))
+            except psutil.Error:
+                pass
+            time.sleep(0.1)
+
+
+async def wave(url: str, concurrency: int) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=600) as client:
+        async def one():
+            started = time.perf_counter()
+            try:
+                response = await client.post('/api/generate-questions', json=PAPER)
+                ok = response.status_code == 200 and response.json().get('success')
+            except httpx.HTTPError:
+                ok = False
+            return ok, time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies = sorted(seconds for ok, seconds in results if ok)
+    return {
+        'throughput': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) if latencies else float('nan'),
+        'p95': latencies[int(0.95 * (len(latencies) - 1))] if latencies else float('nan'),
+        'failed': sum(1 for ok, _ in results if not ok),
+    }
+
+
+def run_mode(mode: str, workers: int, levels, latency: float) -> list:
+    with serve(mode, workers, llm_latency=latency) as (url, master):
+        results = []
+        for concurrency in levels:
+            sampler = RssSampler(master.pid)
+            sampler.start()
+            result = asyncio.run(wave(url, concurrency))
+            sampler.stopped.set()
+            sampler.join()
+            results.append({'concurrency': concurrency, 'peak_rss': sampler.peak, **result})
+        return results
+
+
+def main(sync_workers: int, async_workers: int, levels, latency: float) -> None:
+    mib = 1024 * 1024
+    print(f"LLM stand-in latency {latency}s per call; one paper = generation + verification")
+    print(f"{'mode':<18}{'clients':>9}{'papers/s':>10}{'p50':>9}{'p95':>9}{'failed':>8}{'peak RSS':>12}")
+    for mode, workers in (('sync', sync_workers), ('async', async_workers)):
+        for r in run_mode(mode, workers, levels, latency):
+            print(f"{f'{mode} x{workers}':<18}{r['concurrency']:>9}{r['throughput']:>10.2f}{r['p50']:>8.2f}s"
+                  f"{r['p95']:>8.2f}s{r['failed']:>8}{r['peak_rss'] / mib:>9.0f}MiB")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 4,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1,
+        [int(level) for level in sys.argv[3].split(',')] if len(sys.argv) > 3 else [8, 64, 256],
+        float(sys.argv[4]) if len(sys.argv) > 4 else 0.5,
+    )
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Chunking profiles: character-measured vs token-measured splitters
+
+For every retrieval budget in EnhancedContextRetriever._determine_search_parameters
+the top-k chunks are packed into max_tokens the way _truncate_to_tokens does it.
+Reports prompt tokens wasted (retrieved but cut off by truncation) and recall
+(the planted fact sentence survives intact in the final context).
+
+Usage: python benchmarks/bench_chunking_profiles.py [num_facts]
+"""
+
+import os
+import re
+import sys
+import random
+from collections import Counter
+
+os.environ.setdefault('AZURE_OPENAI_API_KEY', 'benchmark')
+os.environ.setdefault('AZURE_OPENAI_ENDPOINT', 'https://benchmark.invalid')
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+
+from mylang4 import DocumentProcessor, count_tokens, get_token_encoder
+
+# (k_docs, max_tokens) pairs produced by _determine_search_parameters
+BUDGETS = [(3, 800), (4, 1000), (5, 1000), (6, 1500)]
+
+FILLER = (
+    "The chapter revisits earlier examples before moving on to new material. "
+    "Students should read each worked example carefully and attempt the exercises. "
+    "Diagrams in the margin summarise the main steps of every method described. "
+    "Teachers may assign the review questions at the end as homework practice. "
+).split(". ")
+
+WORD = re.compile(r"[a-z0-9]+")
+
+
+def build_corpus(num_facts: int, rng: random.Random):
+    """Paragraphs of filler with one uniquely worded fact sentence each"""
+    paragraphs, facts = [], []
+    for i in range(num_facts):
+        fact = f"Fact {i}: the reagent zeta{i} turns the solution violet{i} at {20 + i} degrees."
+        sentences = [rng.choice(FILLER).strip().rstrip('.') + '.' for _ in range(rng.randint(6, 14))]
+        sentences.insert(rng.randint(0, len(sentences)), fact)
+        paragraphs.append(" ".join(sentences))
+        facts.append((f"zeta{i} violet{i}", fact))
+    return "\n\n".join(paragraphs), facts
+
+
+def lexical_top_k(chunks, query: str, k: int):
+    """Rank chunks by query term overlap; a stand-in for the embedding search"""
+    terms = set(WORD.findall(query.lower()))
+    scored = []
+    for position, chunk in enumerate(chunks):
+        counts = Counter(WORD.findall(chunk.page_content.lower()))
+        scored.append((sum(counts[t] for t in terms), -position, chunk))
+    scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+    return [chunk for _, _, chunk in scored[:k]]
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """Same cut as EnhancedContextRetriever._truncate_to_tokens"""
+    encoding = get_token_encoder()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text)
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def evaluate(chunks, facts, k: int, max_tokens: int):
+    wasted = hits = 0
+    for query, fact in facts:
+        context = "\n\n".join(chunk.page_content for chunk in lexical_top_k(chunks, query, k))
+        packed = truncate(context, max_tokens)
+        wasted += count_tokens(context) - count_tokens(packed)
+        hits += fact in packed
+    return wasted / len(facts), hits / len(facts)
+
+
+def main(num_facts: int) -> None:
+    text, facts = build_corpus(num_facts, random.Random(0))
+    document = Document(page_content=text, metadata={'page': 0})
+    processor = DocumentProcessor()
+
+    if get_token_encoder() is None:
+        print("tiktoken encoding unavailable; token counts use the len/4 approximation\n")
+
+    print(f"{num_facts} facts, {count_tokens(text)} corpus tokens\n")
+    print(f"{'profile':<24}{'chunks':>8}{'k':>4}{'budget':>8}{'wasted/query':>14}{'recall':>9}")
+    for mode in ('character', 'token'):
+        splitters = processor.character_text_splitters if mode == 'character' else processor.token_text_splitters
+        for content_type in ('default', 'mathematics', 'science', 'literature'):
+            chunks = splitters[content_type].split_documents([document])
+            for k, max_tokens in BUDGETS:
+                wasted, recall = evaluate(chunks, facts, k, max_tokens)
+                print(f"{mode + '/' + content_type:<24}{len(chunks):>8}{k:>4}{max_tokens:>8}{wasted:>14.1f}{recall:>9.1%}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Content type detection: per-page keyword scans (previous implementation)
+vs the batch classifier (numpy byte scans over the joined pages)
+
+Usage: python benchmarks/bench_content_type.py [num_pages]
+"""
+
+import os
+import sys
+import time
+import random
+
+os.environ.setdefault('AZURE_OPENAI_API_KEY', 'benchmark')
+os.environ.setdefault('AZURE_OPENAI_ENDPOINT', 'https://benchmark.invalid')
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+
+from mylang4 import DocumentProcessor, classify_content_types
+
+MATH = ['equation', 'formula', 'calculate', 'solve', 'mathematics', 'math', 'algebra', 'geometry', 'trigonometry', 'calculus', '+', '-', '*', '/', '=', '√', 'π', '∫', '∑']
+SCIENCE = ['experiment', 'hypothesis', 'theory', 'molecule', 'atom', 'cell', 'organism', 'physics', 'chemistry', 'biology', 'laboratory', 'observation', 'conclusion']
+LITERATURE = ['poem', 'story', 'novel', 'character', 'plot', 'theme', 'metaphor', 'simile', 'literature', 'english', 'grammar', 'vocabulary', 'comprehension']
+
+PROSE = (
+    "in this unit we look at how the ideas from the previous chapter are used in everyday "
+    "situations and why they matter for the examples that follow on the next few pages"
+).split()
+PHRASES = [
+    "the cell membrane controls what enters a well-known organism",
+    "solve 3x + 4 = 19 using the formula",
+    "the poem uses a metaphor to develop its theme",
+    "revise chapters 4-7 and/or attempt the self-test",
+]
+
+
+def legacy_detect(text: str) -> str:
+    text_lower = text.lower()
+    math_score = sum(1 for indicator in MATH if indicator in text_lower)
+    science_score = sum(1 for indicator in SCIENCE if indicator in text_lower)
+    literature_score = sum(1 for indicator in LITERATURE if indicator in text_lower)
+    if math_score > max(science_score, literature_score):
+        return 'mathematics'
+    elif science_score > literature_score:
+        return 'science'
+    elif literature_score > 0:
+        return 'literature'
+    return 'default'
+
+
+def main(num_pages: int) -> None:
+    rng = random.Random(0)
+    # ~450 words per page, roughly one sentence in ten carrying indicators
+    pages = [
+        " ".join(rng.choice(PHRASES) if rng.random() < 0.02 else rng.choice(PROSE) for _ in range(450))
+        for _ in range(num_pages)
+    ]
+
+    start = time.perf_counter()
+    legacy = [legacy_detect(page) for page in pages]
+    legacy_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    batch = classify_content_types(pages)
+    batch_ms = (time.perf_counter() - start) * 1000
+
+    splitter = DocumentProcessor().text_splitters['default']
+    start = time.perf_counter()
+    splitter.split_documents([Document(page_content=page) for page in pages])
+    split_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{num_pages} pages")
+    print(f"chunk splitting:        {split_ms:8.1f} ms  (the rest of the per-page ingest work)")
+    print(f"per-page keyword scans: {legacy_ms:8.1f} ms  ({legacy.count('mathematics')} classified mathematics)")
+    print(f"batch byte scans:       {batch_ms:8.1f} ms  ({batch.count('mathematics')} classified mathematics)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
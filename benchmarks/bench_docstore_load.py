@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Load-time benchmark: pickled LangChain docstore vs native chunk store
+
+Usage: python benchmarks/bench_docstore_load.py [num_chunks ...]
+"""
+
+import os
+import sys
+import time
+import pickle
+import random
+import tempfile
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+from Utility.chunkstore import ChunkStore, write_chunkstore
+
+WORDS = ("equation formula theory experiment molecule poem character plot "
+         "algebra geometry cell organism hypothesis observation conclusion").split()
+
+
+def make_chunks(count: int):
+    """Synthetic chunks with the metadata DocumentProcessor attaches"""
+    rng = random.Random(42)
+    chunks = []
+    for i in range(count):
+        text = " ".join(rng.choice(WORDS) for _ in range(150))
+        chunks.append(Document(page_content=text, metadata={
+            'source': 'temp_uploads/latest.pdf',
+            'page': i // 4,
+            'content_type': rng.choice(['mathematics', 'science', 'literature', 'default']),
+            'subject': 'Mathematics',
+            'grade': '10',
+            'chunk_id': uuid.uuid4().hex[:8],
+            'processed_at': '2025-01-01T00:00:00',
+            'word_count': 150,
+            'quality_score': rng.choice([0.4, 0.7, 1.0]),
+        }))
+    return chunks
+
+
+def timed(fn, repeat: int = 5) -> float:
+    """Best-of-N wall time in milliseconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(count: int, tmp_dir: str) -> None:
+    chunks = make_chunks(count)
+    ids = [str(uuid.uuid4()) for _ in chunks]
+
+    pickle_path = os.path.join(tmp_dir, f"index_{count}.pkl")
+    with open(pickle_path, "wb") as f:
+        pickle.dump((InMemoryDocstore(dict(zip(ids, chunks))), dict(enumerate(ids))), f)
+
+    native_path = os.path.join(tmp_dir, f"docstore_{count}.bin")
+    write_chunkstore(native_path, ids, [c.page_content for c in chunks], [c.metadata for c in chunks])
+
+    def load_pickle():
+        with open(pickle_path, "rb") as f:
+            pickle.load(f)
+
+    def open_native():
+        ChunkStore(native_path)
+
+    def fetch_native_topk():
+        store = ChunkStore(native_path)
+        for position in range(0, count, max(1, count // 6))[:6]:
+            store.get(position)
+
+    def materialize_native():
+        store = ChunkStore(native_path)
+        for position in range(len(store)):
+            store.get(position)
+
+    print(f"{count:>8} chunks | pickle {os.path.getsize(pickle_path) / 1e6:7.2f} MB "
+          f"| native {os.path.getsize(native_path) / 1e6:7.2f} MB")
+    print(f"{'':>8}        | pickle.load        {timed(load_pickle):9.2f} ms")
+    print(f"{'':>8}        | native open        {timed(open_native):9.2f} ms")
+    print(f"{'':>8}        | native open + top6 {timed(fetch_native_topk):9.2f} ms")
+    print(f"{'':>8}        | native open + all  {timed(materialize_native, repeat=1):9.2f} ms")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000]
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            run(size, tmp)
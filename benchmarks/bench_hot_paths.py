@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the mylang4 hot paths on synthetic inputs of
+increasing size
+
+Each case times one function in isolation (JSON parsing, content typing,
+quality scoring, splitting, query building, context ranking, token
+truncation, FAISS build/search, PDF rendering) and reports the per-call
+median and minimum. No network: Azure clients are built but never called,
+and FAISS gets precomputed random vectors. Results are written as JSON
+(default benchmarks/results/hot_paths-<commit>.json) so two releases can be
+compared with --compare; cases whose fastest round is slower than
+--threshold times the old one are flagged and make the script exit 1.
+
+Usage: python benchmarks/bench_hot_paths.py [--quick] [--only SUBSTRING] [--json OUT] [--compare OLD.json] [--threshold 1.25]
+       e.g. python benchmarks/bench_hot_paths.py --json before.json
+            python benchmarks/bench_hot_paths.py --compare before.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+
+os.environ.setdefault('AZURE_OPENAI_API_KEY', 'benchmark')
+os.environ.setdefault('AZURE_OPENAI_ENDPOINT', 'https://benchmark.invalid')
+os.environ.setdefault('ENV_FILE', os.devnull)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+
+import mylang4
+from mylang4 import safe_json_loads, get_token_encoder, EnhancedContextRetriever
+from Utility.pdfmaker import CreatePDF
+
+# Time the code, not the log handlers
+logging.disable(logging.CRITICAL)
+
+SENTENCES = [
+    "Photosynthesis converts light energy into chemical energy in green plants.",
+    "Solve the quadratic equation x^2 - 5x + 6 = 0 by factorisation.",
+    "Key terms: chlorophyll, stomata, glucose, carbon dioxide.",
+    "Step 1 - measure the angle with a protractor and record it.",
+    "The narrator describes the village at dawn, quiet and grey.",
+    "Newton's second law states that force equals mass times acceleration.",
+    "• Revise the worked example before attempting the exercise.",
+    "The theorem of Pythagoras relates the sides of a right triangle.",
+]
+TOPIC = {
+    'subjectName': 'Science', 'sectionName': 'Photosynthesis', 'classGrade': '10th',
+    'difficulty': 'Medium', 'bloomLevel': 'Understand', 'questionType': 'MCQ', 'numQuestions': 5,
+}
+DIM = 3072  # text-embedding-3-large
+
+
+def synthetic_text(chars: int, seed: int = 0) -> str:
+    """Paragraphs of curriculum-like sentences, about `chars` characters long"""
+    rng = random.Random(seed)
+    paragraphs, length = [], 0
+    while length < chars:
+        paragraph = " ".join(rng.choice(SENTENCES) for _ in range(rng.randint(2, 6)))
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return "\n\n".join(paragraphs)[:chars]
+
+
+def synthetic_questions(count: int) -> list:
+    return [{
+        'question': f"Question {i + 1}: which process converts light energy into chemical energy?",
+        'options': ['Photosynthesis', 'Respiration', 'Transpiration', 'Digestion'],
+        'answer': 'Photosynthesis',
+        'explanation': "Green plants use chlorophyll to capture light and make glucose. " * 2,
+    } for i in range(count)]
+
+
+def llm_reply(count: int) -> str:
+    """A chat reply the way models send it: fenced JSON after a line of prose"""
+    return "Here are the questions:\n```json\n" + json.dumps({'questions': synthetic_questions(count)}, indent=2) + "\n```"
+
+
+def chunk_documents(count: int) -> list:
+    processor = mylang4.document_processor
+    docs = []
+    for i in range(count):
+        doc = Document(page_content=synthetic_text(900, seed=i), metadata={'page': i // 4, 'start_index': (i % 4) * 900})
+        doc.metadata = processor._enhance_metadata(doc, 'science', 'Science', '10th')
+        docs.append(doc)
+    return docs
+
+
+# -------------------------------
+# Cases: name -> (sizes, quick sizes, setup(size) returning the call to time)
+# -------------------------------
+
+def case_safe_json_loads(size):
+    reply = llm_reply(size)
+    return lambda: safe_json_loads(reply)
+
+
+def case_parse_llm_response(size):
+    generator = mylang4.question_generator
+    response = AIMessage(content=llm_reply(size))
+    return lambda: generator._parse_llm_response(response)
+
+
+def case_detect_content_type(size):
+    processor, text = mylang4.document_processor, synthetic_text(size)
+    return lambda: processor._detect_content_type(text)
+
+
+def case_calculate_quality_score(size):
+    processor, text = mylang4.document_processor, synthetic_text(size)
+    return lambda: processor._calculate_quality_score(text)
+
+
+def splitter_case(family, name):
+    def setup(size):
+        splitter = getattr(mylang4.document_processor, family)[name]
+        page = Document(page_content=synthetic_text(size), metadata={'page': 0})
+        return lambda: splitter.split_documents([page])
+    return setup
+
+
+def case_build_semantic_query(size):
+    retriever = EnhancedContextRetriever(None)
+    topic = dict(TOPIC, sectionName=synthetic_text(size))
+    return lambda: retriever._build_semantic_query(topic)
+
+
+def case_combine_and_rank_documents(size):
+    retriever, docs = EnhancedContextRetriever(None), chunk_documents(size)
+    return lambda: retriever._combine_and_rank_documents(docs, TOPIC)
+
+
+def case_truncate_to_tokens(size):
+    retriever, text = EnhancedContextRetriever(None), synthetic_text(size)
+    return lambda: retriever._truncate_to_tokens(text, 1000)
+
+
+def faiss_inputs(size):
+    from langchain_community.vectorstores import FAISS
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((size, DIM), dtype=np.float32)
+    pairs = [(f"chunk {i}", vector) for i, vector in enumerate(vectors)]
+    return FAISS, pairs, rng.standard_normal(DIM, dtype=np.float32).tolist()
+
+
+def case_faiss_build(size):
+    FAISS, pairs, _ = faiss_inputs(size)
+    return lambda: FAISS.from_embeddings(pairs, embedding=None)
+
+
+def case_faiss_search(size):
+    FAISS, pairs, query = faiss_inputs(size)
+    store = FAISS.from_embeddings(pairs, embedding=None)
+    return lambda: store.similarity_search_by_vector(query, k=6)
+
+
+def case_pdf_generate(size):
+    # Paper layout: topics of five questions each
+    questions = synthetic_questions(size)
+    topics = [{'topic': f"Topic {i // 5 + 1}", 'questions': questions[i:i + 5]} for i in range(0, size, 5)]
+    return lambda: CreatePDF.generate(topics, 'bench.pdf', '10th', 'Science')
+
+
+CASES = {
+    'safe_json_loads': ([1, 10, 50], [1, 10], case_safe_json_loads),                       # questions
+    'parse_llm_response': ([1, 10, 50], [1, 10], case_parse_llm_response),                 # questions
+    'detect_content_type': ([1000, 10000, 100000], [1000, 10000], case_detect_content_type),  # characters
+    'calculate_quality_score': ([1000, 10000, 100000], [1000, 10000], case_calculate_quality_score),
+    'split_characters_default': ([3000, 30000, 150000], [3000, 30000], splitter_case('character_text_splitters', 'default')),
+    'split_tokens_default': ([3000, 30000, 150000], [3000, 30000], splitter_case('token_text_splitters', 'default')),
+    'build_semantic_query': ([20, 200, 2000], [20, 200], case_build_semantic_query),       # section name characters
+    'combine_and_rank_documents': ([5, 20, 80], [5, 20], case_combine_and_rank_documents),  # chunks
+    'truncate_to_tokens': ([2000, 20000, 200000], [2000, 20000], case_truncate_to_tokens),  # characters, 1000-token limit
+    'faiss_build': ([500, 2000, 8000], [500], case_faiss_build),                            # vectors of DIM
+    'faiss_search': ([500, 2000, 8000], [500], case_faiss_search),
+    'pdf_generate': ([5, 50, 200], [5, 50], case_pdf_generate),                              # questions
+}
+
+
+def measure(fn, repeat: int = 5, min_seconds: float = 0.1) -> dict:
+    """Per-call seconds over `repeat` rounds of enough loops to last `min_seconds`"""
+    fn()  # warm caches and lazy imports
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds or loops >= 1_000_000:
+            break
+        loops *= 10 if elapsed < min_seconds / 10 else 2
+    samples = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        samples.append((time.perf_counter() - start) / loops)
+    return {'loops': loops, 'repeat': repeat, 'median_s': statistics.median(samples),
+            'min_s': min(samples), 'max_s': max(samples)}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def environment() -> dict:
+    from importlib.metadata import version, PackageNotFoundError
+    packages = {}
+    for name in ('numpy', 'faiss-cpu', 'langchain-core', 'langchain-text-splitters', 'langchain-community', 'tiktoken', 'reportlab'):
+        try:
+            packages[name] = version(name)
+        except PackageNotFoundError:
+            packages[name] = None
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'packages': packages,
+        # Without its BPE file tiktoken falls back to len/4, which changes the token cases
+        'tiktoken_encoder': get_token_encoder() is not None,
+    }
+
+
+def run(quick: bool, only: str) -> list:
+    results = []
+    for name, (sizes, quick_sizes, setup) in CASES.items():
+        if only and only not in name:
+            continue
+        for size in quick_sizes if quick else sizes:
+            result = {'case': name, 'size': size, **measure(setup(size))}
+            results.append(result)
+            print(f"{name:<28}{size:>9}{result['median_s'] * 1000:>12.3f} ms{result['min_s'] * 1000:>12.3f} ms{result['loops']:>9}")
+    return results
+
+
+def compare(results: list, old_path: str, threshold: float) -> list:
+    with open(old_path) as f:
+        old = json.load(f)
+    # Fastest rounds, which scheduler and frequency noise inflate least
+    before = {(r['case'], r['size']): r['min_s'] for r in old['results']}
+    regressions = []
+    print(f"\nvs {old_path} (commit {old['environment']['commit']})")
+    for r in results:
+        previous = before.get((r['case'], r['size']))
+        if not previous:
+            continue
+        ratio = r['min_s'] / previous
+        flag = '  REGRESSION' if ratio > threshold else ''
+        print(f"{r['case']:<28}{r['size']:>9}{ratio:>10.2f}x{flag}")
+        if flag:
+            regressions.append({**r, 'ratio': ratio})
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the mylang4 hot paths")
+    parser.add_argument('--quick', action='store_true', help="smaller sizes only")
+    parser.add_argument('--only', default='', help="run cases whose name contains this")
+    parser.add_argument('--json', help="results file (default benchmarks/results/hot_paths-<commit>.json)")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="per-call time ratio above which a case is a regression")
+    args = parser.parse_args()
+
+    env = environment()
+    print(f"commit {env['commit']}, python {env['python']}, tiktoken encoder {'yes' if env['tiktoken_encoder'] else 'no (len/4 fallback)'}")
+    print(f"{'case':<28}{'size':>9}{'median':>15}{'min':>15}{'loops':>9}")
+    results = run(args.quick, args.only)
+
+    path = args.json or os.path.join(ROOT, 'benchmarks', 'results', f"hot_paths-{env['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'environment': env, 'quick': args.quick, 'results': results}, f, indent=2)
+    print(f"\nwrote {path}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} case(s) slower than {args.threshold}x")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
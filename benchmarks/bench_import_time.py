@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark: `python -X importtime` for mylang4 and app, plus the
+time mylang4.warm_up() takes once the module is imported
+
+Usage: python benchmarks/bench_import_time.py [runs] [top_n]
+"""
+
+import os
+import sys
+import time
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ('mylang4', 'app')
+
+
+def child_env(temp_dir: str) -> dict:
+    """Placeholder credentials; nothing here talks to Azure, Mongo or S3"""
+    env = dict(os.environ)
+    env.setdefault('AZURE_OPENAI_API_KEY', 'benchmark')
+    env.setdefault('AZURE_OPENAI_ENDPOINT', 'https://benchmark.invalid')
+    env.setdefault('AZURE_OPENAI_API_VERSION', '2024-02-15-preview')
+    env['LOG_FILE'] = os.path.join(temp_dir, 'bench.log')
+    env['PROMETHEUS_MULTIPROC_DIR'] = os.path.join(temp_dir, 'prometheus')
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    return env
+
+
+def import_profile(module: str, env: dict):
+    """Total import seconds and {package: cumulative seconds} for one cold import"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    total, packages = 0.0, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        seconds = int(cumulative) / 1e6
+        if name == module:
+            total = seconds
+        top_level = name.split('.')[0]
+        packages[top_level] = max(packages.get(top_level, 0.0), seconds)
+    packages.pop(module, None)
+    return total, packages
+
+
+def warm_up_seconds(env: dict) -> float:
+    code = "import time, mylang4; t = time.perf_counter(); mylang4.warm_up(); print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main(runs: int, top_n: int) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        env = child_env(temp_dir)
+        for module in MODULES:
+            totals, heaviest = [], {}
+            for _ in range(runs):
+                total, packages = import_profile(module, env)
+                totals.append(total)
+                for name, seconds in packages.items():
+                    heaviest.setdefault(name, []).append(seconds)
+            print(f"import {module}: median {statistics.median(totals):.3f}s over {runs} runs "
+                  f"(min {min(totals):.3f}s, max {max(totals):.3f}s)")
+            ranked = sorted(heaviest.items(), key=lambda item: -statistics.median(item[1]))[:top_n]
+            for name, samples in ranked:
+                print(f"    {name:<28} {statistics.median(samples):.3f}s")
+
+        started = time.perf_counter()
+        warm = [warm_up_seconds(env) for _ in range(runs)]
+        print(f"mylang4.warm_up(): median {statistics.median(warm):.3f}s "
+              f"({time.perf_counter() - started:.1f}s including interpreter start-up and import)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3, int(sys.argv[2]) if len(sys.argv) > 2 else 8)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Search latency: unfiltered scan vs metadata-prefiltered scan on a
+multi-subject memory-mapped index
+
+Usage: python benchmarks/bench_prefilter_search.py [num_chunks] [dim]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+
+from Utility import mmap_store
+
+SUBJECTS = ['Mathematics', 'Science', 'English', 'History', 'Geography']
+
+
+class RandomEmbeddings:
+    """Deterministic random vectors; no network calls"""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.rng = np.random.default_rng(0)
+
+    def embed_documents(self, texts):
+        return self.rng.standard_normal((len(texts), self.dim), dtype=np.float32)
+
+    def embed_query(self, text):
+        return self.rng.standard_normal(self.dim, dtype=np.float32)
+
+
+def timed(fn, repeat: int = 50) -> float:
+    """Median wall time in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples)) * 1000
+
+
+def main(count: int, dim: int) -> None:
+    embeddings = RandomEmbeddings(dim)
+    docs = [
+        Document(page_content=f"chunk {i}", metadata={
+            'chunk_id': f"c{i}",
+            'subject': SUBJECTS[i % len(SUBJECTS)],
+            'grade': '10',
+            'page': i // 8,
+            'quality_score': (0.4, 0.7, 1.0)[i % 3],
+        })
+        for i in range(count)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mmap_store.append_documents(tmp_dir, docs, embeddings)
+        store = mmap_store.load_mmap_store(tmp_dir, embeddings)
+        query = embeddings.embed_query("algebra")
+
+        filters = {
+            'none': None,
+            'subject': {'subject': 'Science'},
+            'subject+grade+quality': {'subject': 'Science', 'grade': '10', 'min_quality_score': 0.7},
+            'subject+pages': {'subject': 'Science', 'page_range': (0, count // 80)},
+        }
+        print(f"{count} chunks x {dim} dims")
+        for name, metadata_filter in filters.items():
+            ms = timed(lambda: store.similarity_search_by_vector(query, k=6, filter=metadata_filter))
+            print(f"  {name:<24} {ms:8.3f} ms")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(args[0] if args else 50000, args[1] if len(args) > 1 else 3072)
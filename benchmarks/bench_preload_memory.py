@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Worker memory and respawn time: gunicorn with and without preload_app
+
+Starts gunicorn from gunicorn.conf.py in each mode, waits until every worker
+is booted and warm, then reports per-worker RSS, USS (pages only that worker
+holds) and PSS (shared pages split between sharers). One worker is then
+killed and the time until its replacement is warm is measured.
+
+Usage: python benchmarks/bench_preload_memory.py [workers]
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import statistics
+import subprocess
+import tempfile
+import urllib.request
+
+import psutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Wraps the repo config: warm up synchronously in post_worker_init (so "ready"
+# means warm in both modes) and drop a timestamp file per ready worker
+WRAPPER_CONFIG = """
+exec(open({config!r}).read())
+
+def post_worker_init(worker):
+    import time, app
+    if not worker.cfg.preload_app:
+        app.warm_up()
+    with open(os.path.join({marker_dir!r}, str(worker.pid)), 'w') as f:
+        f.write(repr(time.time()))
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_markers(marker_dir: str, count: int, timeout: float = 180.0) -> None:
+    deadline = time.time() + timeout
+    while len(os.listdir(marker_dir)) < count:
+        if time.time() > deadline:
+            raise TimeoutError(f"only {len(os.listdir(marker_dir))}/{count} workers became ready")
+        time.sleep(0.05)
+
+
+def run_mode(preload: bool, workers: int) -> dict:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        marker_dir = os.path.join(temp_dir, 'ready')
+        os.makedirs(marker_dir)
+        config_path = os.path.join(temp_dir, 'bench.conf.py')
+        with open(config_path, 'w') as f:
+            f.write(WRAPPER_CONFIG.format(config=os.path.join(ROOT, 'gunicorn.conf.py'), marker_dir=marker_dir))
+
+        env = dict(os.environ)
+        env.update({
+            'PRELOAD_APP': 'true' if preload else 'false',
+            'WARM_UP_ON_START': 'false',
+            'AZURE_OPENAI_API_KEY': env.get('AZURE_OPENAI_API_KEY', 'benchmark'),
+            'AZURE_OPENAI_ENDPOINT': env.get('AZURE_OPENAI_ENDPOINT', 'https://benchmark.invalid'),
+            'AZURE_OPENAI_API_VERSION': env.get('AZURE_OPENAI_API_VERSION', '2024-02-15-preview'),
+            'LOG_FILE': os.path.join(temp_dir, 'app.log'),
+            'PROMETHEUS_MULTIPROC_DIR': os.path.join(temp_dir, 'prometheus'),
+        })
+        port = free_port()
+        started = time.time()
+        master = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', config_path, '--bind', f'127.0.0.1:{port}',
+             '--workers', str(workers), 'app:app'],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_for_markers(marker_dir, workers)
+            boot_seconds = time.time() - started
+            time.sleep(1.0)
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=10) as response:
+                assert response.status == 200
+
+            parent = psutil.Process(master.pid)
+            children = parent.children()
+            memory = [child.memory_full_info() for child in children]
+            result = {
+                'boot_seconds': boot_seconds,
+                'master_rss': parent.memory_info().rss,
+                'rss': statistics.mean(m.rss for m in memory),
+                'uss': statistics.mean(m.uss for m in memory),
+                'pss': statistics.mean(m.pss for m in memory),
+            }
+
+            # Respawn: kill one worker and time its warm replacement
+            before = set(os.listdir(marker_dir))
+            killed_at = time.time()
+            os.kill(children[0].pid, signal.SIGKILL)
+            deadline = killed_at + 180
+            while not (set(os.listdir(marker_dir)) - before):
+                if time.time() > deadline:
+                    raise TimeoutError("replacement worker never became ready")
+                time.sleep(0.02)
+            new_marker = (set(os.listdir(marker_dir)) - before).pop()
+            time.sleep(0.05)
+            with open(os.path.join(marker_dir, new_marker)) as f:
+                result['respawn_seconds'] = float(f.read()) - killed_at
+            return result
+        finally:
+            master.send_signal(signal.SIGTERM)
+            master.wait(timeout=60)
+
+
+def main(workers: int) -> None:
+    mib = 1024 * 1024
+    print(f"{'mode':<12}{'boot':>8}{'respawn':>10}{'RSS/worker':>13}{'USS/worker':>13}{'PSS/worker':>13}{'master RSS':>13}")
+    for preload in (False, True):
+        r = run_mode(preload, workers)
+        print(f"{'preload' if preload else 'no preload':<12}{r['boot_seconds']:>7.2f}s{r['respawn_seconds']:>9.2f}s"
+              f"{r['rss'] / mib:>10.1f}MiB{r['uss'] / mib:>10.1f}MiB{r['pss'] / mib:>10.1f}MiB{r['master_rss'] / mib:>10.1f}MiB")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
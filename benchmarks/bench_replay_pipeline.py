@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Paper pipeline timings against recorded LLM and embedding responses
+
+Record once (--record) against Azure, or against a Utility/fake_azure_openai.py
+server with --fake, into a cassette (Utility/cassette.py); later runs replay
+it, so retrieval, parsing, verification logic and PDF stages run on realistic
+model outputs with the model's own latency ('original') or none ('zero').
+
+Each run uploads a synthetic notes PDF built from the payloads' topics,
+analyses it, then generates every paper in the payloads file through the
+Flask test client with Mongo and S3 stand-ins (benchmarks/stand_ins.py).
+Reported are wall time per request and the per-stage timings from
+/api/metrics. A replay that misses the cassette fails with a CassetteMiss
+404; re-record after changing prompts, chunking or the payloads.
+
+Usage: python benchmarks/bench_replay_pipeline.py CASSETTE [--record [--fake]] [--latency original|zero|FACTOR]
+           [--payloads FILE] [--repeat N]
+       e.g. python benchmarks/bench_replay_pipeline.py /tmp/papers.cassette --record --fake
+            python benchmarks/bench_replay_pipeline.py /tmp/papers.cassette --latency zero --repeat 5
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+from stand_ins import ROOT, install
+from load_test import DEFAULT_PAYLOADS, ENDPOINTS, load_payloads, notes_pdf
+
+sys.path.insert(0, ROOT)
+
+
+def run_papers(client, papers, pdf: bytes, timings: dict) -> None:
+    def timed(name, **request):
+        started = time.perf_counter()
+        response = client.post(ENDPOINTS[name], **request)
+        timings.setdefault(name, []).append(time.perf_counter() - started)
+        body = response.get_json(silent=True) or {}
+        if response.status_code != 200 or not body.get('success', False):
+            raise RuntimeError(f"{name} failed with {response.status_code}: {body.get('error', body)}")
+
+    timed('upload', data={'file': (io.BytesIO(pdf), 'replay-notes.pdf', 'application/pdf')},
+          content_type='multipart/form-data')
+    first = papers[0]
+    timed('analyse', json={key: first[key] for key in ('email', 'subjectName', 'classGrade', 'course') if key in first})
+    for paper in papers:
+        timed('generate', json=paper)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time the paper pipeline against a record/replay cassette")
+    parser.add_argument('cassette', help="cassette file (gzip JSON lines)")
+    parser.add_argument('--record', action='store_true', help="call the model and save its responses")
+    parser.add_argument('--fake', action='store_true', help="record against a local fake Azure OpenAI server")
+    parser.add_argument('--latency', default='original', help="replay latency: original, zero or a factor")
+    parser.add_argument('--payloads', default=DEFAULT_PAYLOADS, help="paper requests (as in load_test.py)")
+    parser.add_argument('--repeat', type=int, default=1, help="replay runs (recording always runs once)")
+    args = parser.parse_args()
+
+    cassette_path = os.path.abspath(args.cassette)
+    if args.record and os.path.exists(cassette_path):
+        sys.exit(f"{cassette_path} exists; recording appends, so remove it first")
+    os.environ.update({
+        'LLM_CASSETTE': cassette_path,
+        'LLM_CASSETTE_MODE': 'record' if args.record else 'replay',
+        'LLM_CASSETTE_LATENCY': args.latency,
+        'S3_BUCKET_NAME': 'benchmark',
+        'NOTES_BUCKET_NAME': 'benchmark-notes',
+    })
+    os.environ.setdefault('ENV_FILE', os.path.join(ROOT, '.env'))
+    os.environ.setdefault('LOG_FILE', os.devnull)
+    fake = None
+    if args.fake:
+        from Utility.fake_azure_openai import FakeAzureOpenAI
+        fake = FakeAzureOpenAI(chat_latency='lognormal:1.0,0.4', embedding_latency='fixed:0.1').start()
+        os.environ.update({'AZURE_OPENAI_ENDPOINT': fake.endpoint, 'AZURE_OPENAI_API_KEY': 'fake', 'ENV_FILE': os.devnull})
+    elif not args.record:
+        # Replays never reach the network; the clients only need something to be built from
+        os.environ.setdefault('AZURE_OPENAI_ENDPOINT', 'https://replay.invalid')
+        os.environ.setdefault('AZURE_OPENAI_API_KEY', 'replay')
+
+    papers = [body for endpoint, body in load_payloads(args.payloads) if endpoint in (None, ENDPOINTS['generate'], 'generate')]
+    pdf = notes_pdf(papers)
+    scratch = tempfile.TemporaryDirectory()
+    os.chdir(scratch.name)  # vectorstores/ and temp_uploads/ land here
+
+    import app
+    from Utility.cassette import get_cassette
+    install(app, llm_latency=None)
+    client = app.app.test_client()
+    timings: dict = {}
+    started = time.perf_counter()
+    try:
+        for _ in range(1 if args.record else args.repeat):
+            run_papers(client, papers, pdf, timings)
+    finally:
+        if fake is not None:
+            fake.stop()
+    elapsed = time.perf_counter() - started
+    cassette = get_cassette()
+
+    mode = 'recorded' if args.record else f"replayed ({args.latency} latency)"
+    print(f"{len(papers)} paper(s) {mode} in {elapsed:.2f}s; cassette {cassette.stats}, {len(cassette)} responses")
+    print(f"{'request':<12}{'count':>7}{'mean':>10}{'min':>10}")
+    for name, samples in timings.items():
+        print(f"{name:<12}{len(samples):>7}{statistics.mean(samples):>9.3f}s{min(samples):>9.3f}s")
+    stages = client.get('/api/metrics').get_json()['stages']
+    print(f"\n{'stage':<14}{'calls':>7}{'total':>10}{'p50':>10}{'p95':>10}{'tokens in/out':>16}")
+    for name, stage in stages.items():
+        tokens = f"{stage['prompt_tokens']}/{stage['completion_tokens']}"
+        print(f"{name:<14}{stage['calls']:>7}{stage['seconds_total']:>9.3f}s{stage['seconds_p50']:>9.3f}s"
+              f"{stage['seconds_p95']:>9.3f}s{tokens:>16}")
+
+
+if __name__ == "__main__":
+    main()
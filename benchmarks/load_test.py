@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test: replay request payloads against the API
+
+Replays paper requests from Samples/Sample.json (or --payloads: a JSON
+object, a JSON list, or JSON lines; a line may also be {"endpoint": ...,
+"body": ...}) against /api/generate-questions, /api/upload-note and
+/api/analyse-note in a weighted mix. Upload-note sends a synthetic notes
+PDF built from the payloads' topics, and analyse-note indexes it into the
+payload's course index.
+
+By default the harness starts gunicorn (sync or async workers) with
+in-process Mongo and S3 stand-ins (benchmarks/stand_ins.py), pointed at a
+Utility/fake_azure_openai.py server run by this process; --url targets a
+server that is already running instead.
+
+Load is either closed-loop (--concurrency clients, each sending its next
+request when the last finishes) or open-loop (--rate requests/s with Poisson
+arrivals; latency is measured from the scheduled send time, so a backed-up
+server is not hidden by slower sending). Reported per endpoint: requests,
+failures, throughput and p50/p95/p99 latency. --json saves the run;
+--baseline prints the change against a saved run.
+
+Usage: python benchmarks/load_test.py [--target sync|async] [--workers 4] [--url URL]
+           [--concurrency 16 | --rate 5] [--requests 200 | --duration 60]
+           [--mix generate=8,upload=1,analyse=1] [--payloads FILE]
+           [--chat-latency lognormal:1.0,0.4] [--rate-limit 0] [--json OUT] [--baseline IN]
+       e.g. python benchmarks/load_test.py --target async --concurrency 64 --requests 500 --json baseline.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import statistics
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from stand_ins import ROOT, serve
+
+sys.path.insert(0, ROOT)
+from Utility.fake_azure_openai import FakeAzureOpenAI  # noqa: E402
+
+ENDPOINTS = {
+    'generate': '/api/generate-questions',
+    'upload': '/api/upload-note',
+    'analyse': '/api/analyse-note',
+}
+DEFAULT_PAYLOADS = os.path.join(ROOT, 'Samples', 'Sample.json')
+
+
+def load_payloads(path: str) -> List[Tuple[Optional[str], Dict[str, Any]]]:
+    """(endpoint or None, body) pairs; tolerates trailing non-JSON text, as in Sample.json"""
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    decoder, payloads, position = json.JSONDecoder(), [], 0
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position >= len(text) or text[position] not in '{[':
+            break
+        value, position = decoder.raw_decode(text, position)
+        for item in value if isinstance(value, list) else [value]:
+            if 'body' in item and 'endpoint' in item:
+                payloads.append((item['endpoint'], item['body']))
+            else:
+                payloads.append((None, item))
+    if not payloads:
+        raise ValueError(f"No JSON payloads in {path}")
+    return payloads
+
+
+def notes_pdf(papers: List[Dict[str, Any]], pages: int = 4) -> bytes:
+    """A few pages of synthetic notes on the payloads' topics"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    topics = [(paper.get('subjectName', 'Subject'), topic.get('sectionName', 'Topic'), topic.get('topicNotes', ''))
+              for paper in papers for topic in paper.get('topics', [])] or [('Subject', 'Topic', '')]
+    for page in range(pages):
+        subject, section, notes = topics[page % len(topics)]
+        y = 800
+        pdf.drawString(50, y, f"{subject}: {section} (page {page + 1})")
+        for line in range(40):
+            y -= 18
+            pdf.drawString(50, y, f"{section} note {line + 1}: {notes or 'key idea'} - worked example {page}.{line} "
+                                  f"explains the rule and how to apply it.")
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+class Workload:
+    """Picks the next request: endpoint by weight, body by rotating through the payloads"""
+
+    def __init__(self, payloads, mix: Dict[str, float], seed: int = 0):
+        self.rng = random.Random(seed)
+        self.endpoints = [name for name, weight in mix.items() if weight > 0]
+        self.weights = [mix[name] for name in self.endpoints]
+        self.by_endpoint = {name: [body for endpoint, body in payloads if endpoint in (None, ENDPOINTS[name], name)]
+                            for name in ENDPOINTS}
+        papers = [body for endpoint, body in payloads if endpoint in (None, ENDPOINTS['generate'], 'generate')]
+        self.pdf = notes_pdf(papers)
+        self.counter = 0
+
+    def next(self) -> Tuple[str, Dict[str, Any]]:
+        name = self.rng.choices(self.endpoints, self.weights)[0]
+        bodies = self.by_endpoint[name] or self.by_endpoint['generate']
+        body = bodies[self.counter % len(bodies)]
+        self.counter += 1
+        if name == 'generate':
+            return name, {'json': body}
+        if name == 'upload':
+            return name, {'files': {'file': ('loadtest-notes.pdf', self.pdf, 'application/pdf')}}
+        course = {key: body[key] for key in ('email', 'subjectName', 'classGrade', 'course', 'note_id') if key in body}
+        return name, {'json': course}
+
+
+async def send(client: httpx.AsyncClient, name: str, request: Dict[str, Any], scheduled: float, results: list) -> None:
+    try:
+        response = await client.post(ENDPOINTS[name], **request)
+        try:
+            ok = response.status_code == 200 and response.json().get('success', False)
+        except ValueError:
+            ok = False
+        status = response.status_code
+    except httpx.HTTPError as e:
+        ok, status = False, type(e).__name__
+    results.append({'endpoint': name, 'ok': bool(ok), 'status': status, 'seconds': time.perf_counter() - scheduled})
+
+
+async def closed_loop(client, workload: Workload, concurrency: int, requests: int, duration: float, results: list):
+    deadline = time.perf_counter() + duration if duration else None
+    issued = 0
+
+    async def client_loop():
+        nonlocal issued
+        while (requests is None or issued < requests) and (deadline is None or time.perf_counter() < deadline):
+            issued += 1
+            name, request = workload.next()
+            await send(client, name, request, time.perf_counter(), results)
+
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+
+
+async def open_loop(client, workload: Workload, rate: float, requests: int, duration: float, results: list, seed: int):
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    scheduled, tasks = started, []
+    while (requests is None or len(tasks) < requests) and (not duration or scheduled - started < duration):
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        name, request = workload.next()
+        tasks.append(asyncio.create_task(send(client, name, request, scheduled, results)))
+        scheduled += rng.expovariate(rate)
+    await asyncio.gather(*tasks)
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))]
+
+
+def summarize(results: list, elapsed: float) -> Dict[str, Dict[str, Any]]:
+    summary = {}
+    for name in [*ENDPOINTS, 'all']:
+        rows = [r for r in results if name == 'all' or r['endpoint'] == name]
+        if not rows:
+            continue
+        latencies = sorted(r['seconds'] for r in rows if r['ok'])
+        failures: Dict[str, int] = {}
+        for r in rows:
+            if not r['ok']:
+                failures[str(r['status'])] = failures.get(str(r['status']), 0) + 1
+        summary[name] = {
+            'requests': len(rows),
+            'failed': len(rows) - len(latencies),
+            'failures_by_status': failures,
+            'throughput': len(latencies) / elapsed,
+            'mean': statistics.fmean(latencies) if latencies else float('nan'),
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+        }
+    return summary
+
+
+def print_summary(summary: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Any]] = None) -> None:
+    print(f"{'endpoint':<10}{'requests':>9}{'failed':>8}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, s in summary.items():
+        print(f"{name:<10}{s['requests']:>9}{s['failed']:>8}{s['throughput']:>9.2f}"
+              f"{s['p50']:>8.2f}s{s['p95']:>8.2f}s{s['p99']:>8.2f}s")
+        base = (baseline or {}).get('summary', {}).get(name)
+        if base:
+            change = lambda key: f"{(s[key] / base[key] - 1) * 100:+.0f}%" if base[key] else "n/a"
+            print(f"{'  vs base':<10}{'':>9}{s['failed'] - base['failed']:>+8}{change('throughput'):>9}"
+                  f"{change('p50'):>9}{change('p95'):>9}{change('p99'):>9}")
+
+
+async def run(url: str, args, workload: Workload) -> Tuple[list, float]:
+    results: list = []
+    limits = httpx.Limits(max_connections=max(args.concurrency or 0, 1000))
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+        if 'analyse' in workload.endpoints:
+            # analyse-note indexes the last upload; make sure there is one
+            await client.post(ENDPOINTS['upload'], files={'file': ('loadtest-notes.pdf', workload.pdf, 'application/pdf')})
+        started = time.perf_counter()
+        if args.rate:
+            await open_loop(client, workload, args.rate, args.requests, args.duration, results, args.seed)
+        else:
+            await closed_loop(client, workload, args.concurrency, args.requests, args.duration, results)
+        elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay request payloads against the API and report latency percentiles")
+    parser.add_argument('--target', choices=('sync', 'async'), default='sync', help="deployment to start")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--url', help="load an already running server instead of starting one")
+    parser.add_argument('--concurrency', type=int, default=16, help="closed-loop clients")
+    parser.add_argument('--rate', type=float, help="open-loop arrivals per second (overrides --concurrency)")
+    parser.add_argument('--requests', type=int, help="total requests (default 200 unless --duration)")
+    parser.add_argument('--duration', type=float, help="seconds to keep sending")
+    parser.add_argument('--mix', default='generate=8,upload=1,analyse=1', help="endpoint weights")
+    parser.add_argument('--payloads', default=DEFAULT_PAYLOADS)
+    parser.add_argument('--chat-latency', default='lognormal:1.0,0.4', help="fake Azure chat latency distribution")
+    parser.add_argument('--embedding-latency', default='fixed:0.05')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="share of fake Azure calls answered 429")
+    parser.add_argument('--timeout', type=float, default=600.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="save config and results here")
+    parser.add_argument('--baseline', help="print the change against a run saved with --json")
+    args = parser.parse_args()
+    if args.requests is None and args.duration is None:
+        args.requests = 200
+
+    mix = {name: float(weight) for name, weight in (item.split('=') for item in args.mix.split(','))}
+    unknown = set(mix) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints in --mix: {sorted(unknown)}")
+    workload = Workload(load_payloads(args.payloads), mix, args.seed)
+
+    if args.url:
+        results, elapsed = asyncio.run(run(args.url, args, workload))
+    else:
+        with FakeAzureOpenAI(chat_latency=args.chat_latency, embedding_latency=args.embedding_latency,
+                             rate_limit=args.rate_limit, seed=args.seed) as fake_azure:
+            env = {'AZURE_OPENAI_ENDPOINT': fake_azure.endpoint, 'AZURE_OPENAI_API_KEY': 'fake'}
+            with serve(args.target, args.workers, llm_latency=None, env=env) as (url, _):
+                results, elapsed = asyncio.run(run(url, args, workload))
+
+    summary = summarize(results, elapsed)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    load = f"{args.rate}/s open-loop" if args.rate else f"{args.concurrency} clients"
+    print(f"{args.url or f'{args.target} x{args.workers}'}, {load}, {elapsed:.1f}s")
+    print_summary(summary, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'config': {k: v for k, v in vars(args).items() if k not in ('json', 'baseline')},
+                'python': platform.python_version(),
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'elapsed': elapsed,
+                'summary': summary,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
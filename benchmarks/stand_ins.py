@@ -0,0 +1,190 @@
+"""
+In-process stand-ins for Mongo, S3 and the chat model, for load tests
+
+install(app_module) swaps them into an imported app.py (and the mylang4
+components it uses) so a served worker runs the whole paper pipeline,
+including PDF rendering, with no network. With `llm_latency` set, LLM calls
+sleep that many seconds (±20%), blocking in the sync chains and awaiting in
+the async ones; with None the real chains stay, pointed at whatever
+AZURE_OPENAI_ENDPOINT says (e.g. Utility/fake_azure_openai.py).
+
+serve() runs gunicorn from gunicorn.conf.py with the stand-ins installed in
+every worker, in a scratch working directory.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import asyncio
+import tempfile
+import itertools
+import subprocess
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from bson import ObjectId
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+
+class FakeCollection:
+    """insert_one/update_one that only count documents"""
+
+    def __init__(self):
+        self.inserted = itertools.count(1)
+
+    def insert_one(self, document):
+        next(self.inserted)
+        return SimpleNamespace(inserted_id=ObjectId())
+
+    def update_one(self, query, update):
+        return SimpleNamespace(matched_count=1, modified_count=1)
+
+
+class FakeDatabase(dict):
+    """db['name'] for app code that looks collections up per request"""
+
+    def __missing__(self, name):
+        collection = self[name] = FakeCollection()
+        return collection
+
+
+class FakeS3:
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        fileobj.read()
+
+    def generate_presigned_url(self, method, Params, ExpiresIn=3600):
+        return f"https://{Params['Bucket']}.s3.invalid/{Params['Key']}"
+
+
+def question_reply(inputs):
+    count = int(inputs.get('num_questions', 1))
+    topic = inputs.get('topic', 'Topic')
+    return json.dumps({'questions': [{
+        'question': f"Stand-in question {i + 1} on {topic}?",
+        'options': ['Option A', 'Option B', 'Option C', 'Option D'],
+        'answer': 'Option A',
+        'explanation': f"Option A is correct for {topic}.",
+    } for i in range(count)]})
+
+
+def verifier_reply(inputs):
+    return json.dumps({
+        'overall_verdict': 'ACCEPTED',
+        'confidence_score': 90,
+        'detailed_feedback': {},
+        'specific_issues': [],
+        'improvement_suggestions': [],
+    })
+
+
+def fake_chat(reply, llm_latency):
+    """A chain stand-in: prompt inputs in, AIMessage with token usage out"""
+
+    def message(inputs):
+        content = reply(inputs)
+        usage = {'prompt_tokens': sum(len(str(v)) for v in inputs.values()) // 4, 'completion_tokens': len(content) // 4}
+        return AIMessage(content=content, response_metadata={'token_usage': usage})
+
+    def delay():
+        return llm_latency * random.uniform(0.8, 1.2)
+
+    def invoke(inputs):
+        time.sleep(delay())
+        return message(inputs)
+
+    async def ainvoke(inputs):
+        await asyncio.sleep(delay())
+        return message(inputs)
+
+    return RunnableLambda(invoke, afunc=ainvoke)
+
+
+def install(app_module, llm_latency=0.5):
+    """Point `app_module` (app.py) at the stand-ins"""
+    import mylang4
+    app_module.db = FakeDatabase()
+    app_module.requests_collection = app_module.db['requests']
+    app_module.papers_collection = app_module.db['papers']
+    app_module._clients['s3'] = FakeS3()
+    if llm_latency is None:
+        return
+    generator, verifier = mylang4.question_generator, mylang4.question_verifier
+    generator.chain = fake_chat(question_reply, llm_latency)
+    generator.revision_chain = fake_chat(question_reply, llm_latency)
+    verifier.chain = fake_chat(verifier_reply, llm_latency)
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The repo config plus stand-ins installed in every worker
+WRAPPER_CONFIG = """
+exec(open({config!r}).read())
+_repo_post_worker_init = post_worker_init
+
+def post_worker_init(worker):
+    import sys, app
+    _repo_post_worker_init(worker)
+    sys.path.insert(0, {bench_dir!r})
+    import stand_ins
+    stand_ins.install(app, llm_latency={latency!r})
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_serving(url: str, timeout: float = 180.0) -> None:
+    import httpx
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f'{url}/api/metrics', timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError("server never answered /api/metrics")
+
+
+@contextmanager
+def serve(mode='sync', workers=4, llm_latency=0.5, env=None):
+    """Yield (base URL, master Popen) for gunicorn serving app:app ('sync') or asgi:app ('async')"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, 'bench.conf.py')
+        with open(config_path, 'w') as f:
+            f.write(WRAPPER_CONFIG.format(config=os.path.join(ROOT, 'gunicorn.conf.py'), bench_dir=BENCH_DIR, latency=llm_latency))
+        child_env = dict(os.environ)
+        child_env.update({
+            'AZURE_OPENAI_API_KEY': child_env.get('AZURE_OPENAI_API_KEY', 'benchmark'),
+            'AZURE_OPENAI_ENDPOINT': child_env.get('AZURE_OPENAI_ENDPOINT', 'https://benchmark.invalid'),
+            'S3_BUCKET_NAME': 'benchmark',
+            'NOTES_BUCKET_NAME': 'benchmark-notes',
+            'ENV_FILE': os.devnull,
+            'LOG_FILE': os.path.join(temp_dir, 'app.log'),
+            'PROMETHEUS_MULTIPROC_DIR': os.path.join(temp_dir, 'prometheus'),
+            **(env or {}),
+        })
+        port = free_port()
+        command = [sys.executable, '-m', 'gunicorn', '-c', config_path, '--bind', f'127.0.0.1:{port}',
+                   '--workers', str(workers), '--backlog', '4096', '--chdir', temp_dir, '--pythonpath', ROOT]
+        if mode == 'async':
+            command += ['--worker-class', 'uvicorn.workers.UvicornWorker', 'asgi:app']
+        else:
+            command += ['--timeout', '600', 'app:app']
+        master = subprocess.Popen(command, cwd=temp_dir, env=child_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        url = f'http://127.0.0.1:{port}'
+        try:
+            wait_until_serving(url)
+            yield url, master
+        finally:
+            master.send_signal(signal.SIGTERM)
+            master.wait(timeout=60)
@@ -0,0 +1,60 @@
+import gc
+import os
+import shutil
+
+# Gunicorn settings (used by the Dockerfile CMD via --config)
+bind = "0.0.0.0:5000"
+workers = 4
+timeout = 120
+
+# Preload mode: the master imports and warms the app once, then forks. With
+# collection disabled until the fork and everything frozen out of the GC,
+# workers share those pages copy-on-write instead of each importing
+# LangChain, reportlab and boto3 and building clients on their own.
+preload_app = os.getenv('PRELOAD_APP', 'true').lower() == 'true'
+if preload_app:
+    gc.disable()
+
+# Prometheus multiprocess mode: workers share sample files in this directory
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join('logging', 'prometheus'))
+
+
+def on_starting(server):
+    # Samples left over from a previous run would be merged into /metrics
+    shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    import app  # already imported by the master when preloading
+    app.warm_up()
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"Preloaded app; froze {gc.get_freeze_count()} objects before forking workers")
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        gc.enable()
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's live gauges (in-flight jobs, loaded vectorstores)
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    import app  # already loaded by the worker as the WSGI module
+    # Sample RSS; past MEMORY_HIGH_WATER_MB the worker drains and SIGTERMs
+    # itself, and the master starts a fresh one
+    app.memory_governor.start()
+    # Without preloading, build LLM/S3 clients in the background so the worker
+    # answers health checks immediately; a request that arrives first waits on
+    # the same lock
+    if worker.cfg.preload_app or os.getenv('WARM_UP_ON_START', 'true').lower() != 'true':
+        return
+    import threading
+    threading.Thread(target=app.warm_up, name='warm-up', daemon=True).start()
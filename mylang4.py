@@ -1,21 +1,25 @@
-from langchain_community.document_loaders import PyPDFLoader  
+# langchain_openai, the PDF loader, FAISS and tiktoken are imported where
+# they are used, so importing this module stays cheap (see warm_up below)
 from langchain_text_splitters import RecursiveCharacterTextSplitter  
-from langchain_openai import AzureOpenAIEmbeddings, AzureChatOpenAI  
-from langchain_community.vectorstores import FAISS  
 from langchain_core.prompts import PromptTemplate  
-import os  
-from dotenv import load_dotenv  
-from typing import Dict, List, Any, Tuple, Optional  
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from typing import Callable, Dict, List, Any, Tuple, Optional
 import logging  
-import tiktoken  
 import json  
 import re  
 import hashlib
+import asyncio
+import threading
+import numpy as np
 from datetime import datetime
+from functools import lru_cache
+from collections import Counter
+from Utility.mmap_store import save_mmap_store, append_documents, unseen_documents
+from Utility.stage_metrics import track_stage
+from Utility.logging import log_payload
+from Utility.config import config, get_settings
 
-# Load environment variables  
-load_dotenv()  
-  
 # Configure logging  
 logging.basicConfig(level=logging.INFO)  
 logger = logging.getLogger(__name__)  
@@ -57,145 +61,542 @@ def safe_json_loads(text: str, default: Any = None) -> Any:
         logger.error("Failed to parse JSON; returning default.")  
         return default  
 
+@lru_cache(maxsize=None)
+def get_token_encoder(model: str = "gpt-4"):
+    """tiktoken encoder for `model`, built once per process (None if unavailable)"""
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:
+        # Cached too, so an offline worker does not retry the BPE download per call
+        logger.error(f"Could not load tiktoken encoding for {model}: {e}")
+        return None
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    """Token count for `text`, approximated as 4 characters per token without an encoder"""
+    enc = get_token_encoder(model)
+    return len(enc.encode(text)) if enc else len(text) // 4
+
+# -------------------------------
+# Prompt layout for provider-side prompt caching
+# -------------------------------
+def cache_friendly_template(static_instructions: str, corpus_section: str, request_section: str) -> str:
+    """Join prompt sections from most to least shared
+    
+    Azure OpenAI reuses cached prompt prefixes (1024 tokens and up), so the
+    static instructions and output schema come first, then the retrieved
+    context every batch of a topic shares, then the per-batch parameters.
+    """
+    return "\n\n".join(section.strip("\n") for section in (static_instructions, corpus_section, request_section)) + "\n"
+
+def log_prompt_cache_usage(response: Any, call: str) -> Dict[str, int]:
+    """Log prompt tokens and the cached share reported in a chat response's usage metadata"""
+    token_usage = (getattr(response, 'response_metadata', None) or {}).get('token_usage') or {}
+    usage_metadata = getattr(response, 'usage_metadata', None) or {}
+    
+    prompt_tokens = token_usage.get('prompt_tokens', usage_metadata.get('input_tokens'))
+    if prompt_tokens is None:
+        return {}
+    cached_tokens = (token_usage.get('prompt_tokens_details') or {}).get('cached_tokens')
+    if cached_tokens is None:
+        cached_tokens = (usage_metadata.get('input_token_details') or {}).get('cache_read', 0)
+    
+    usage = {
+        'prompt_tokens': prompt_tokens,
+        'cached_tokens': cached_tokens or 0,
+        'completion_tokens': token_usage.get('completion_tokens', usage_metadata.get('output_tokens', 0))
+    }
+    logger.info(f"{call} prompt tokens: {usage['prompt_tokens']} ({usage['cached_tokens']} cached), "
+                f"completion tokens: {usage['completion_tokens']}")
+    return usage
+
+# -------------------------------
+# Content type classification
+# -------------------------------
+CONTENT_TYPE_KEYWORDS = {
+    'mathematics': ['equation', 'formula', 'calculate', 'solve', 'math', 'algebra', 'geometry', 'trigonometry', 'calculus'],
+    'science': ['experiment', 'hypothesis', 'theory', 'molecule', 'atom', 'cell', 'organism', 'physics', 'chemistry', 'biology', 'laboratory', 'observation', 'conclusion'],
+    'literature': ['poem', 'story', 'novel', 'character', 'plot', 'theme', 'metaphor', 'simile', 'literature', 'english', 'grammar', 'vocabulary', 'comprehension'],
+}
+CONTENT_TYPES = ('mathematics', 'science', 'literature')
+
+# Indicator scans over a whole batch at once. Keywords match at the start of a
+# word ("cell" -> "cells", "cellular"). The lowercased pages are joined into
+# one byte string, one byte per character with non-ASCII as '?', and numpy
+# compares the bytes at each word start with the keywords: first the four-byte
+# prefixes, then the whole keyword for the few words that pass. Operators only
+# count between operands, so hyphenated words, dashes, page ranges and
+# "and/or" no longer score as mathematics; the operator pattern is only tried
+# at operator characters. As in the per-page checks this replaced, each
+# indicator scores once per page however often it appears.
+INDICATOR_CONTENT_TYPE = {
+    keyword: content_type
+    for content_type, keywords in CONTENT_TYPE_KEYWORDS.items()
+    for keyword in keywords
+}
+PAGE_SEPARATOR = '\n'  # not a word character, operand or space, so no match spans two pages
+KEYWORD_WINDOW = 16  # bytes compared per word start; the longest keyword must fit
+OPERATORS = '+=^*/-'
+MATH_SYMBOLS = '√π∫∑'
+
+def _keyword_tables():
+    """Byte-window values and masks of every keyword, longest first, and their score columns"""
+    keywords = sorted(INDICATOR_CONTENT_TYPE, key=len, reverse=True)
+    values = np.zeros((len(keywords), 2), dtype=np.uint64)
+    masks = np.zeros((len(keywords), 2), dtype=np.uint64)
+    for i, keyword in enumerate(keywords):
+        padded = keyword.encode('ascii').ljust(KEYWORD_WINDOW, b'\0')
+        mask = (b'\xff' * len(keyword)).ljust(KEYWORD_WINDOW, b'\0')
+        values[i] = np.frombuffer(padded, dtype='<u8')
+        masks[i] = np.frombuffer(mask, dtype='<u8')
+    prefixes = np.unique(np.array([int.from_bytes(keyword[:4].encode('ascii'), 'little') for keyword in keywords],
+                                  dtype=np.uint32))
+    return prefixes, values, masks
+
+KEYWORD_PREFIXES, KEYWORD_VALUES, KEYWORD_MASKS = _keyword_tables()
+# Indicator ids: keywords longest first, then the operators, then the symbols
+INDICATOR_COLUMNS = np.array(
+    [CONTENT_TYPES.index(INDICATOR_CONTENT_TYPE[keyword]) for keyword in sorted(INDICATOR_CONTENT_TYPE, key=len, reverse=True)]
+    + [CONTENT_TYPES.index('mathematics')] * len(OPERATORS + MATH_SYMBOLS),
+    dtype=np.intp
+)
+OPERATOR_IDS = np.zeros(256, dtype=np.intp)
+OPERATOR_IDS[list(OPERATORS.encode('ascii'))] = np.arange(len(OPERATORS)) + len(INDICATOR_CONTENT_TYPE)
+MATH_SYMBOL_IDS = {symbol: len(INDICATOR_CONTENT_TYPE) + len(OPERATORS) + i for i, symbol in enumerate(MATH_SYMBOLS)}
+# Byte classes: regex \w characters (non-ASCII ones are re-checked) and
+# operators; √π∫∑ count wherever they appear and are found in the string
+WORD_BYTE, OPERATOR_BYTE = 1, 2
+BYTE_CLASSES = np.zeros(256, dtype=np.uint8)
+BYTE_CLASSES[[code for code in range(128) if chr(code).isalnum() or chr(code) == '_']] = WORD_BYTE
+BYTE_CLASSES[list(OPERATORS.encode('ascii'))] = OPERATOR_BYTE
+MATH_SYMBOL_PATTERN = re.compile(f"[{MATH_SYMBOLS}]")
+OPERATOR_PATTERN = re.compile(
+    r"[+=^*/-](?:(?:(?<=[\w)][+=^])|(?<=[\w)] [+=^]))(?= ?[\w(√π])"
+    r"|(?:(?<=[\d)][*/])|(?<=[\d)] [*/]))(?= ?[\d(])"
+    r"|(?<=[\d)] -)(?= [\d(]))"
+)
+
+def _byte_windows(raw: bytes, dtype: str, count: int) -> np.ndarray:
+    """Overlapping little-endian integers starting at every byte of `raw`"""
+    return np.ndarray((count,), dtype=dtype, buffer=raw, strides=(1,))
+
+def content_type_scores(texts: List[str]) -> np.ndarray:
+    """Number of distinct indicators per text, shape (len(texts), len(CONTENT_TYPES))"""
+    scores = np.zeros((len(texts), len(CONTENT_TYPES)), dtype=np.int32)
+    if not texts:
+        return scores
+    lowered = [text.lower() for text in texts]
+    batch = PAGE_SEPARATOR.join(lowered)
+    page_starts = np.cumsum([0] + [len(text) + len(PAGE_SEPARATOR) for text in lowered[:-1]])
+    
+    # 'replace' keeps byte offsets equal to character offsets; the padding
+    # lets a full window be read at every position
+    raw = batch.encode('ascii', 'replace') + b'\0' * KEYWORD_WINDOW
+    data = np.frombuffer(raw, dtype=np.uint8)
+    classes = BYTE_CLASSES[data]
+    is_word = classes == WORD_BYTE
+    word_starts = np.flatnonzero(is_word[1:] & ~is_word[:-1]) + 1
+    if is_word[0]:
+        word_starts = np.concatenate(([0], word_starts))
+    
+    candidates = word_starts[np.isin(_byte_windows(raw, '<u4', len(batch))[word_starts], KEYWORD_PREFIXES)]
+    # A '?' before the word may stand for a non-ASCII letter
+    after_question_mark = np.flatnonzero(data[candidates - 1] == ord('?'))
+    if after_question_mark.size:
+        keep = np.ones(len(candidates), dtype=bool)
+        for i in after_question_mark.tolist():
+            previous = batch[candidates[i] - 1]
+            keep[i] = not (previous.isalnum() or previous == '_')
+        candidates = candidates[keep]
+    windows = _byte_windows(raw, '<u8', len(batch) + 8)
+    low, high = windows[candidates][:, None], windows[candidates + 8][:, None]
+    found = ((low & KEYWORD_MASKS[:, 0]) == KEYWORD_VALUES[:, 0]) & ((high & KEYWORD_MASKS[:, 1]) == KEYWORD_VALUES[:, 1])
+    keyword_hits = found.any(axis=1)
+    keyword_positions = candidates[keyword_hits]
+    keyword_ids = found[keyword_hits].argmax(axis=1)  # the longest keyword that matched
+    
+    operators = np.flatnonzero(classes == OPERATOR_BYTE)
+    # A minus only counts spaced out ("3 - 2"), so word hyphens need no regex
+    spaced = (data[operators - 1] == ord(' ')) & (data[operators + 1] == ord(' '))
+    operators = operators[(data[operators] != ord('-')) | spaced]
+    operators = np.array([position for position in operators.tolist() if OPERATOR_PATTERN.match(batch, position)],
+                         dtype=np.intp)
+    symbols = [] if batch.isascii() else [match.start() for match in MATH_SYMBOL_PATTERN.finditer(batch)]
+    
+    positions = np.concatenate((keyword_positions, operators, np.array(symbols, dtype=np.intp)))
+    ids = np.concatenate((keyword_ids, OPERATOR_IDS[data[operators]],
+                          np.array([MATH_SYMBOL_IDS[batch[position]] for position in symbols], dtype=np.intp)))
+    rows = np.searchsorted(page_starts, positions, side='right') - 1
+    hits = np.unique(rows * len(INDICATOR_COLUMNS) + ids)
+    np.add.at(scores, (hits // len(INDICATOR_COLUMNS), INDICATOR_COLUMNS[hits % len(INDICATOR_COLUMNS)]), 1)
+    return scores
+
+def classify_content_types(texts: List[str]) -> List[str]:
+    """Batch content type classification; same precedence as a single-page decision"""
+    scores = content_type_scores(texts)
+    math, science, literature = scores[:, 0], scores[:, 1], scores[:, 2]
+    labels = np.select(
+        [math > np.maximum(science, literature), science > literature, literature > 0],
+        ['mathematics', 'science', 'literature'],
+        default='default'
+    )
+    return labels.tolist()
+
+# -------------------------------
+# Batch chunk quality scoring
+# -------------------------------
+# A '.'-separated segment longer than 10 characters once stripped
+SENTENCE_PATTERN = re.compile(r"[^.\s][^.]{9,}[^.\s]")
+STRUCTURE_PATTERN = re.compile(r"[:\-•*]")
+
+def chunk_quality_features(texts: List[str]) -> Dict[str, np.ndarray]:
+    """Per-chunk statistics for a whole batch, as arrays aligned with `texts`
+    
+    Returns word_count, sentence_count, paragraph_count, has_structure,
+    chunk_id (md5 prefix) and quality_score.
+    """
+    count = len(texts)
+    stripped_length = np.fromiter((len(text.strip()) for text in texts), dtype=np.int64, count=count)
+    word_count = np.fromiter((len(text.split()) for text in texts), dtype=np.int64, count=count)
+    sentence_count = np.fromiter((len(SENTENCE_PATTERN.findall(text)) for text in texts), dtype=np.int64, count=count)
+    paragraph_count = np.fromiter(
+        (sum(len(paragraph.strip()) > 50 for paragraph in text.split('\n\n')) for text in texts),
+        dtype=np.int64, count=count
+    )
+    has_structure = np.fromiter((STRUCTURE_PATTERN.search(text) is not None for text in texts), dtype=bool, count=count)
+    chunk_id = np.array([hashlib.md5(text.encode()).hexdigest()[:8] for text in texts], dtype='<U8')
+    
+    quality_score = 0.4 * (sentence_count > 0) + 0.3 * (paragraph_count > 0) + 0.3 * has_structure
+    quality_score = np.minimum(quality_score, 1.0)
+    quality_score[stripped_length < 50] = 0.0
+    
+    return {
+        'word_count': word_count,
+        'sentence_count': sentence_count,
+        'paragraph_count': paragraph_count,
+        'has_structure': has_structure,
+        'chunk_id': chunk_id,
+        'quality_score': quality_score
+    }
+
+# -------------------------------
+# Extractive summaries (TF-IDF + TextRank, no LLM)
+# -------------------------------
+SENTENCE_SPLIT_PATTERN = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+SUMMARY_TERM_PATTERN = re.compile(r"[a-z][a-z0-9]{2,}")
+SUMMARY_STOPWORDS = frozenset(
+    "the and for are but not you all any can had has have her his its our out was were "
+    "which with this that these those from into than then them they their there what when "
+    "where who will would also been being each other some such only very more most".split()
+)
+DEFINITION_PATTERN = re.compile(r"\b(?:is|are) (?:defined as|called|known as)\b|\brefers? to\b|\bmeans\b|\bis (?:a|an|the)\b", re.IGNORECASE)
+
+def _summary_terms(sentence: str) -> List[str]:
+    return [term for term in SUMMARY_TERM_PATTERN.findall(sentence.lower()) if term not in SUMMARY_STOPWORDS]
+
+def summarize_chunks(texts: List[str], max_sentences: int = 3) -> List[str]:
+    """Keypoint summary per text: its top TextRank sentences, in original order
+    
+    Sentences are TF-IDF vectors with document frequencies taken over the
+    whole batch, so terms common to every chunk of a PDF carry little weight.
+    Sentences that read like definitions get a small boost.
+    """
+    chunk_sentences = [
+        [sentence.strip() for sentence in SENTENCE_SPLIT_PATTERN.split(text) if len(sentence.strip()) > 10]
+        for text in texts
+    ]
+    document_frequency = Counter(
+        term for sentences in chunk_sentences for term in {t for sentence in sentences for t in _summary_terms(sentence)}
+    )
+    total = max(len(texts), 1)
+    
+    summaries = []
+    for sentences in chunk_sentences:
+        if len(sentences) <= max_sentences:
+            summaries.append("\n".join(f"- {sentence}" for sentence in sentences))
+            continue
+        
+        sentence_terms = [_summary_terms(sentence) for sentence in sentences]
+        vocabulary = {term: i for i, term in enumerate({t for terms in sentence_terms for t in terms})}
+        vectors = np.zeros((len(sentences), max(len(vocabulary), 1)))
+        for row, terms in enumerate(sentence_terms):
+            for term, count in Counter(terms).items():
+                vectors[row, vocabulary[term]] = count * (np.log(total / document_frequency[term]) + 1.0)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1.0, norms)
+        
+        # TextRank: power iteration over the cosine similarity graph
+        similarity = vectors @ vectors.T
+        np.fill_diagonal(similarity, 0.0)
+        out_weight = similarity.sum(axis=1, keepdims=True)
+        transition = similarity / np.where(out_weight == 0, 1.0, out_weight)
+        rank = np.full(len(sentences), 1.0 / len(sentences))
+        for _ in range(30):
+            rank = 0.15 / len(sentences) + 0.85 * (transition.T @ rank)
+        rank *= np.array([1.25 if DEFINITION_PATTERN.search(sentence) else 1.0 for sentence in sentences])
+        
+        keep = sorted(np.argsort(-rank, kind='stable')[:max_sentences])
+        summaries.append("\n".join(f"- {sentences[i]}" for i in keep))
+    return summaries
+
 # -------------------------------  
 # Enhanced Document Processor with Smart Chunking  
 # -------------------------------  
+class TokenBudgetTextSplitter(RecursiveCharacterTextSplitter):
+    """Recursive splitter measured in tokens that records true character offsets
+    
+    RecursiveCharacterTextSplitter's add_start_index searches from an offset
+    computed with chunk_overlap, which is in tokens here, so it can miss the
+    chunk; locate each chunk after the previous one's start instead, and from
+    the page start if that misses. A chunk found nowhere gets no start_index,
+    which context stitching treats as unknown.
+    """
+    
+    def create_documents(self, texts: List[str], metadatas: Optional[List[dict]] = None) -> List[Document]:
+        metadatas = metadatas or [{}] * len(texts)
+        documents = []
+        for text, metadata in zip(texts, metadatas):
+            index = 0
+            for chunk in self.split_text(text):
+                start = text.find(chunk, index)
+                if start < 0:
+                    start = text.find(chunk)
+                if start < 0:
+                    documents.append(Document(page_content=chunk, metadata=dict(metadata)))
+                    continue
+                documents.append(Document(page_content=chunk, metadata={**metadata, 'start_index': start}))
+                index = start + 1
+        return documents
+
+
 class DocumentProcessor:  
-    def __init__(self):  
+    def __init__(self, chunking_mode: str = None, extractive_summaries: bool = None):  
+        from langchain_openai import AzureOpenAIEmbeddings
+        from Utility.cassette import llm_client_kwargs
+        settings = get_settings()
         self.embeddings = AzureOpenAIEmbeddings(  
             azure_deployment='text-embedding-3-large',  
-            api_version=os.getenv('AZURE_OPENAI_API_VERSION', '2024-02-15-preview'),  
-            azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT'),  
-            api_key=os.getenv('AZURE_OPENAI_API_KEY'),  
+            api_version=settings.azure_openai_api_version,  
+            azure_endpoint=settings.azure_openai_endpoint,  
+            api_key=settings.azure_openai_api_key,  
+            # The context-length check tokenizes with tiktoken; without its BPE
+            # file (offline) every call would fail, so send raw text instead
+            check_embedding_ctx_length=get_token_encoder("text-embedding-3-large") is not None,
+            **llm_client_kwargs(),  # record/replay when LLM_CASSETTE is set
         )  
         
-        # Enhanced text splitters for different content types
-        self.text_splitters = {
-            'default': RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len,
-                separators=["\n\n", "\n", " ", ""]
-            ),
-            'mathematics': RecursiveCharacterTextSplitter(
-                chunk_size=800,  # Smaller chunks for math (formulas, equations)
-                chunk_overlap=150,
-                length_function=len,
-                separators=["\n\n", "\n", " ", ""]
-            ),
-            'science': RecursiveCharacterTextSplitter(
-                chunk_size=1200,  # Larger chunks for science concepts
-                chunk_overlap=250,
-                length_function=len,
-                separators=["\n\n", "\n", " ", ""]
-            ),
-            'literature': RecursiveCharacterTextSplitter(
-                chunk_size=1500,  # Larger chunks for literature
-                chunk_overlap=300,
-                length_function=len,
-                separators=["\n\n", "\n", " ", ""]
-            )
+        # Character-measured text splitters for different content types. All
+        # record each chunk's page offset (start_index), which context
+        # assembly uses to stitch overlapping chunks back together.
+        character_splitter_kwargs = dict(
+            length_function=len,
+            separators=["\n\n", "\n", " ", ""],
+            add_start_index=True
+        )
+        self.character_text_splitters = {
+            'default': RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, **character_splitter_kwargs),
+            # Smaller chunks for math (formulas, equations)
+            'mathematics': RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=150, **character_splitter_kwargs),
+            # Larger chunks for science concepts and literature
+            'science': RecursiveCharacterTextSplitter(chunk_size=1200, chunk_overlap=250, **character_splitter_kwargs),
+            'literature': RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=300, **character_splitter_kwargs)
         }
+        
+        # Token-measured text splitters. Sizes are the max_tokens budget of
+        # EnhancedContextRetriever._determine_search_parameters divided by its k
+        # (1000/4, 1500/6 -> 250; math topics fetch k>=5 -> 200), so the
+        # retrieved chunks fill the budget without being truncated mid-chunk.
+        self.token_text_splitters = {
+            'default': self._token_splitter(chunk_tokens=250, overlap_tokens=40),
+            'mathematics': self._token_splitter(chunk_tokens=200, overlap_tokens=30),
+            'science': self._token_splitter(chunk_tokens=250, overlap_tokens=40),
+            'literature': self._token_splitter(chunk_tokens=250, overlap_tokens=40)
+        }
+        
+        self.chunking_mode = chunking_mode or settings.chunking_mode
+        self.text_splitters = self.token_text_splitters if self.chunking_mode == 'token' else self.character_text_splitters
+        
+        # Optional ingest stage: store a keypoint summary with every chunk for
+        # EnhancedContextRetriever's compressed context mode
+        if extractive_summaries is None:
+            extractive_summaries = settings.extractive_summaries
+        self.extractive_summaries = extractive_summaries
+
+    @staticmethod
+    def _token_splitter(chunk_tokens: int, overlap_tokens: int) -> TokenBudgetTextSplitter:
+        return TokenBudgetTextSplitter(
+            chunk_size=chunk_tokens,
+            chunk_overlap=overlap_tokens,
+            length_function=count_tokens,  # shares the process-wide cached encoder
+            separators=["\n\n", "\n", " ", ""]
+        )
 
     def _detect_content_type(self, text: str) -> str:
         """Detect content type based on text characteristics"""
-        text_lower = text.lower()
-        
-        # Mathematics indicators
-        math_indicators = ['equation', 'formula', 'calculate', 'solve', 'mathematics', 'math', 'algebra', 'geometry', 'trigonometry', 'calculus', '+', '-', '*', '/', '=', '√', 'π', '∫', '∑']
-        math_score = sum(1 for indicator in math_indicators if indicator in text_lower)
-        
-        # Science indicators
-        science_indicators = ['experiment', 'hypothesis', 'theory', 'molecule', 'atom', 'cell', 'organism', 'physics', 'chemistry', 'biology', 'laboratory', 'observation', 'conclusion']
-        science_score = sum(1 for indicator in science_indicators if indicator in text_lower)
-        
-        # Literature indicators
-        literature_indicators = ['poem', 'story', 'novel', 'character', 'plot', 'theme', 'metaphor', 'simile', 'literature', 'english', 'grammar', 'vocabulary', 'comprehension']
-        literature_score = sum(1 for indicator in literature_indicators if indicator in text_lower)
-        
-        # Determine content type
-        if math_score > max(science_score, literature_score):
-            return 'mathematics'
-        elif science_score > literature_score:
-            return 'science'
-        elif literature_score > 0:
-            return 'literature'
-        else:
-            return 'default'
+        return classify_content_types([text])[0]
 
-    def _enhance_metadata(self, doc, content_type: str, subject: str = None, grade: str = None) -> Dict[str, Any]:
-        """Add enhanced metadata to documents"""
+    def _enhance_metadata(self, doc, content_type: str, subject: str = None, grade: str = None,
+                          features: Dict[str, np.ndarray] = None, position: int = 0) -> Dict[str, Any]:
+        """Add enhanced metadata to documents
+        
+        `features` is the chunk_quality_features batch `doc` sits at `position` in;
+        it is computed for this chunk alone when not given.
+        """
+        if features is None:
+            features, position = chunk_quality_features([doc.page_content]), 0
         metadata = doc.metadata.copy()
         metadata.update({
             'content_type': content_type,
             'subject': subject or 'unknown',
             'grade': grade or 'unknown',
-            'chunk_id': hashlib.md5(doc.page_content.encode()).hexdigest()[:8],
+            'chunk_id': str(features['chunk_id'][position]),
             'processed_at': datetime.now().isoformat(),
-            'word_count': len(doc.page_content.split()),
-            'quality_score': self._calculate_quality_score(doc.page_content)
+            'word_count': int(features['word_count'][position]),
+            'quality_score': float(features['quality_score'][position])
         })
         return metadata
 
     def _calculate_quality_score(self, text: str) -> float:
         """Calculate quality score for content filtering"""
-        if not text or len(text.strip()) < 50:
-            return 0.0
+        return float(chunk_quality_features([text])['quality_score'][0])
+
+    def _split_document(self, pdf_path, subject: str = None, grade: str = None, note_id: str = None) -> List[Any]:
+        """Load a PDF and split it into quality-filtered chunks with enhanced metadata"""
+        from langchain_community.document_loaders import PyPDFLoader
+        loader = PyPDFLoader(pdf_path)  
+        pages = loader.load()  
         
-        # Quality indicators
-        has_sentences = len([s for s in text.split('.') if len(s.strip()) > 10]) > 0
-        has_paragraphs = len([p for p in text.split('\n\n') if len(p.strip()) > 50]) > 0
-        has_structure = any(char in text for char in [':', '-', '•', '*'])
+        # Enhanced processing with content type detection
+        chunks, chunk_types = [], []
+        content_types = classify_content_types([page.page_content for page in pages])
+        for page, content_type in zip(pages, content_types):
+            splitter = self.text_splitters.get(content_type, self.text_splitters['default'])
+            page_chunks = splitter.split_documents([page])
+            chunks.extend(page_chunks)
+            chunk_types.extend([content_type] * len(page_chunks))
         
-        score = 0.0
-        if has_sentences: score += 0.4
-        if has_paragraphs: score += 0.3
-        if has_structure: score += 0.3
+        # Score every chunk in one batch, then filter out low-quality chunks
+        features = chunk_quality_features([chunk.page_content for chunk in chunks])
+        enhanced_texts = []
+        for position in np.flatnonzero(features['quality_score'] > 0.3):
+            chunk = chunks[position]
+            chunk.metadata = self._enhance_metadata(chunk, chunk_types[position], subject, grade, features, position)
+            if note_id:
+                chunk.metadata['note_id'] = note_id
+            enhanced_texts.append(chunk)
         
-        return min(score, 1.0)
+        if self.extractive_summaries:
+            summaries = summarize_chunks([chunk.page_content for chunk in enhanced_texts])
+            for chunk, summary in zip(enhanced_texts, summaries):
+                chunk.metadata['summary'] = summary
+        
+        logger.info(f"Processed PDF '{pdf_path}' into {len(enhanced_texts)} quality chunks (filtered from {len(chunks)} total chunks)")
+        return enhanced_texts
 
     def process_uploaded_document(self, pdf_path, persist_directory=None, subject: str = None, grade: str = None) -> Tuple[Any, List[Any]]:  
         try:  
-            loader = PyPDFLoader(pdf_path)  
-            pages = loader.load()  
-            
-            # Enhanced processing with content type detection
-            enhanced_texts = []
-            for page in pages:
-                content_type = self._detect_content_type(page.page_content)
-                splitter = self.text_splitters.get(content_type, self.text_splitters['default'])
-                chunks = splitter.split_documents([page])
-                
-                # Add enhanced metadata to each chunk
-                for chunk in chunks:
-                    chunk.metadata = self._enhance_metadata(chunk, content_type, subject, grade)
-                    # Filter out low-quality chunks
-                    if chunk.metadata.get('quality_score', 0) > 0.3:
-                        enhanced_texts.append(chunk)
-            
-            logger.info(f"Processed PDF '{pdf_path}' into {len(enhanced_texts)} quality chunks (filtered from {sum(len(splitter.split_documents([page])) for page in pages)} total chunks)")
-            
-            vectorstore = FAISS.from_documents(  
-                documents=enhanced_texts,  
-                embedding=self.embeddings  
-            )  
-  
-            if persist_directory:  
-                vectorstore.save_local(persist_directory)  
-            else:  
-                vectorstore.save_local("./faiss_index")  
-  
-            return vectorstore, enhanced_texts  
+            enhanced_texts = self._split_document(pdf_path, subject, grade)
+            return self._build_vectorstore(enhanced_texts, self.embeddings, persist_directory), enhanced_texts
         except Exception as e:  
             logger.error(f"Error processing document: {str(e)}")  
             raise  
 
+    async def aprocess_uploaded_document(self, pdf_path, persist_directory=None, subject: str = None,
+                                         grade: str = None) -> Tuple[Any, List[Any]]:
+        """process_uploaded_document with the embedding call awaited
+
+        Loading, splitting, the FAISS build and the save run in worker threads.
+        """
+        try:
+            enhanced_texts = await asyncio.to_thread(self._split_document, pdf_path, subject, grade)
+            embeddings = await self._aembed_chunks(enhanced_texts)
+            vectorstore = await asyncio.to_thread(self._build_vectorstore, enhanced_texts, embeddings, persist_directory)
+            return vectorstore, enhanced_texts
+        except Exception as e:
+            logger.error(f"Error processing document: {str(e)}")
+            raise
+
+    def _build_vectorstore(self, chunks: List[Any], embeddings: Any, persist_directory=None) -> Any:
+        from langchain_community.vectorstores import FAISS
+        vectorstore = FAISS.from_documents(  
+            documents=chunks,  
+            embedding=embeddings  
+        )  
+  
+        if persist_directory:  
+            # Native memory-mapped format; no pickle needed to load it back
+            save_mmap_store(vectorstore, persist_directory)
+        else:  
+            vectorstore.save_local("./faiss_index")  
+        return vectorstore
+
+    def ingest_document(self, pdf_path, index_directory: str, subject: str = None, grade: str = None, note_id: str = None) -> Dict[str, int]:
+        """Append a PDF's chunks to a persistent index, embedding only unseen chunk_ids"""
+        try:
+            enhanced_texts = self._split_document(pdf_path, subject, grade, note_id)
+            return append_documents(index_directory, enhanced_texts, self.embeddings)
+        except Exception as e:
+            logger.error(f"Error ingesting document: {str(e)}")
+            raise
+
+    async def aingest_document(self, pdf_path, index_directory: str, subject: str = None, grade: str = None,
+                               note_id: str = None) -> Dict[str, int]:
+        """ingest_document with the embedding call awaited
+
+        The chunks the index does not hold yet are embedded before the append;
+        the append itself (under the index's writer lock) runs in a worker
+        thread and only embeds chunks another writer removed in between.
+        """
+        try:
+            enhanced_texts = await asyncio.to_thread(self._split_document, pdf_path, subject, grade, note_id)
+            unseen = await asyncio.to_thread(unseen_documents, index_directory, enhanced_texts)
+            embeddings = await self._aembed_chunks(unseen)
+            return await asyncio.to_thread(append_documents, index_directory, enhanced_texts, embeddings)
+        except Exception as e:
+            logger.error(f"Error ingesting document: {str(e)}")
+            raise
+
+    async def _aembed_chunks(self, chunks: List[Any]) -> "PrecomputedEmbeddings":
+        texts = [chunk.page_content for chunk in chunks]
+        vectors = await self.embeddings.aembed_documents(texts) if texts else []
+        return PrecomputedEmbeddings(self.embeddings, texts, vectors)
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """Embeddings that answer from vectors already fetched, by text
+
+    Lets the synchronous index builders take vectors embedded with an awaited
+    call; texts it does not hold, and queries, go to `embeddings`.
+    """
+
+    def __init__(self, embeddings: Any, texts: List[str], vectors: List[List[float]]):
+        self.embeddings = embeddings
+        self.vectors = dict(zip(texts, vectors))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        missing = list(dict.fromkeys(text for text in texts if text not in self.vectors))
+        if missing:
+            self.vectors.update(zip(missing, self.embeddings.embed_documents(missing)))
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
 # -------------------------------  
 # Enhanced Context Retrieval System  
 # -------------------------------  
 class EnhancedContextRetriever:
+    # Chunks of one page at most this many characters apart are treated as adjacent
+    ADJACENT_GAP = 4
+    # Share of a paragraph's word shingles already in the context that makes it a near-duplicate
+    NEAR_DUPLICATE_THRESHOLD = 0.85
+    
     def __init__(self, vectorstore: Any):
         self.vectorstore = vectorstore
+        self.last_assembly_stats = {}
+        self.last_ranked_docs = []
+        self.last_max_tokens = None
+        self.last_context_mode = None
         
     def _build_semantic_query(self, topic_data: Dict[str, Any]) -> str:
         """Build enhanced semantic query based on topic data"""
@@ -279,9 +680,20 @@ class EnhancedContextRetriever:
         
         return k_docs, max_tokens
     
-    def get_enhanced_context(self, topic_data: Dict[str, Any]) -> str:
-        """Get enhanced context using improved retrieval strategies"""
+    def _context_mode(self, topic_data: Dict[str, Any]) -> str:
+        """'compressed' only when the topic asks for it with contextMode"""
+        return 'compressed' if topic_data.get('contextMode') == 'compressed' else 'full'
+    
+    def get_enhanced_context(self, topic_data: Dict[str, Any], mode: str = None) -> str:
+        """Get enhanced context using improved retrieval strategies
+        
+        `mode` is 'full' (stitched chunks) or 'compressed' (chunk keypoint
+        summaries); it defaults to what the topic asks for.
+        """
         try:
+            mode = mode or self._context_mode(topic_data)
+            self.last_context_mode = mode
+            
             # Build semantic query
             semantic_query = self._build_semantic_query(topic_data)
             logger.info(f"Enhanced semantic query: {semantic_query}")
@@ -290,14 +702,30 @@ class EnhancedContextRetriever:
             k_docs, max_tokens = self._determine_search_parameters(topic_data)
             logger.info(f"Search parameters: k={k_docs}, max_tokens={max_tokens}")
             
-            # Perform enhanced similarity search
-            docs = self.vectorstore.similarity_search(
-                semantic_query,
-                k=k_docs
-            )
+            # Perform enhanced similarity search, restricted up front to
+            # eligible chunks when the store supports metadata prefiltering
+            metadata_filter = self._build_metadata_filter(topic_data)
+            if metadata_filter and getattr(self.vectorstore, 'supports_metadata_prefilter', False):
+                docs = self.vectorstore.similarity_search(
+                    semantic_query,
+                    k=k_docs,
+                    filter=metadata_filter
+                )
+                if not docs:
+                    logger.info(f"No chunks matched metadata filter {metadata_filter}; searching unfiltered")
+            else:
+                docs = []
+            if not docs:
+                docs = self.vectorstore.similarity_search(
+                    semantic_query,
+                    k=k_docs
+                )
             
             # Combine and rank documents
             combined_content = self._combine_and_rank_documents(docs, topic_data)
+            self.last_max_tokens = max_tokens
+            if mode == 'compressed' and self.last_ranked_docs:
+                combined_content = self.compress_context()
             
             # Truncate to token limit
             context = self._truncate_to_tokens(combined_content, max_tokens)
@@ -309,6 +737,27 @@ class EnhancedContextRetriever:
             logger.error(f"Error in enhanced context retrieval: {e}")
             return ""
     
+    def _build_metadata_filter(self, topic_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Build a metadata prefilter from topic data
+
+        Chunks ingested without a subject or grade are stored as 'unknown'
+        and stay eligible. Optional `minQualityScore` and `pageRange`
+        ([first, last]) narrow the search further.
+        """
+        metadata_filter = {}
+        subject = topic_data.get('subjectName')
+        grade = topic_data.get('classGrade')
+        if subject:
+            metadata_filter['subject'] = [subject, 'unknown']
+        if grade:
+            metadata_filter['grade'] = [str(grade), 'unknown']
+        if topic_data.get('minQualityScore') is not None:
+            metadata_filter['min_quality_score'] = float(topic_data['minQualityScore'])
+        page_range = topic_data.get('pageRange')
+        if isinstance(page_range, (list, tuple)) and len(page_range) == 2:
+            metadata_filter['page_range'] = (int(page_range[0]), int(page_range[1]))
+        return metadata_filter
+    
     def _combine_and_rank_documents(self, docs: List[Any], topic_data: Dict[str, Any]) -> str:
         """Combine documents with intelligent ranking"""
         if not docs:
@@ -324,12 +773,118 @@ class EnhancedContextRetriever:
         scored_docs.sort(key=lambda x: x[0], reverse=True)
         
         # Combine content with priority to higher-scored documents
-        combined_parts = []
-        for score, doc in scored_docs:
-            if score > 0.3:  # Only include relevant documents
-                combined_parts.append(doc.page_content.strip())
+        relevant_docs = [doc for score, doc in scored_docs if score > 0.3]  # Only include relevant documents
+        self.last_ranked_docs = relevant_docs
+        if not relevant_docs:
+            return ""
+        
+        combined = self._assemble_context(relevant_docs)
+        
+        naive_tokens = count_tokens("\n\n".join(doc.page_content.strip() for doc in relevant_docs))
+        assembled_tokens = count_tokens(combined)
+        self.last_assembly_stats = {
+            'chunks': len(relevant_docs),
+            'tokens_before': naive_tokens,
+            'tokens_after': assembled_tokens,
+            'tokens_saved': naive_tokens - assembled_tokens
+        }
+        logger.info(f"Context assembly saved {naive_tokens - assembled_tokens} tokens "
+                    f"({naive_tokens} -> {assembled_tokens}) across {len(relevant_docs)} chunks")
+        return combined
+    
+    def compress_context(self, docs: List[Any] = None, max_tokens: int = None) -> str:
+        """Keypoint summaries of ranked chunks, by default those of the last retrieval
+        
+        Uses the summary stored at ingest and summarizes chunks without one on
+        the fly. Keypoints repeated by overlapping chunks are kept once.
+        """
+        if docs is None:
+            docs = self.last_ranked_docs
+            full_tokens = self.last_assembly_stats.get('tokens_after', 0)
+        else:
+            full_tokens = count_tokens(self._assemble_context(docs))
+        missing = [doc.page_content for doc in docs if not doc.metadata.get('summary')]
+        computed = iter(summarize_chunks(missing))
+        
+        keypoints = []
+        seen = set()
+        for doc in docs:
+            summary = doc.metadata.get('summary') or next(computed)
+            for keypoint in summary.splitlines():
+                if keypoint and keypoint not in seen:
+                    seen.add(keypoint)
+                    keypoints.append(keypoint)
+        compressed = "\n".join(keypoints)
+        
+        compressed_tokens = count_tokens(compressed)
+        self.last_assembly_stats['tokens_compressed'] = compressed_tokens
+        logger.info(f"Compressed context to {compressed_tokens} tokens from {full_tokens} "
+                    f"({len(missing)} of {len(docs)} chunks summarized on the fly)")
+        return self._truncate_to_tokens(compressed, max_tokens) if max_tokens else compressed
+    
+    def _assemble_context(self, docs: List[Any]) -> str:
+        """Stitch overlapping/adjacent chunks of a page and drop near-duplicate paragraphs
+        
+        `docs` is in rank order; a stitched span takes the rank of its best chunk.
+        """
+        spans = []
+        by_page = {}
+        for rank, doc in enumerate(docs):
+            start = doc.metadata.get('start_index')
+            page_key = (doc.metadata.get('source'), doc.metadata.get('page'))
+            if start is None or page_key[1] is None:
+                # No offsets recorded at ingest; keep the chunk as-is
+                spans.append({'rank': rank, 'text': doc.page_content.strip()})
+                continue
+            by_page.setdefault(page_key, []).append((start, rank, doc.page_content))
+        
+        for chunks in by_page.values():
+            chunks.sort()
+            current = None
+            for start, rank, text in chunks:
+                end = start + len(text)
+                if current and start <= current['end'] + self.ADJACENT_GAP:
+                    if start > current['end']:
+                        # Only whitespace the splitter stripped lies in between
+                        current['text'] += '\n\n' + text
+                    elif end > current['end']:
+                        current['text'] += text[current['end'] - start:]
+                    current['end'] = max(current['end'], end)
+                    current['rank'] = min(current['rank'], rank)
+                else:
+                    current = {'rank': rank, 'end': end, 'text': text}
+                    spans.append(current)
         
-        return "\n\n".join(combined_parts)
+        spans.sort(key=lambda span: span['rank'])
+        
+        paragraphs = []
+        seen_shingles = []
+        for span in spans:
+            for paragraph in re.split(r'\n\s*\n', span['text']):
+                paragraph = paragraph.strip()
+                if not paragraph:
+                    continue
+                shingles = self._shingles(paragraph)
+                if any(self._containment(shingles, other) >= self.NEAR_DUPLICATE_THRESHOLD for other in seen_shingles):
+                    continue
+                seen_shingles.append(shingles)
+                paragraphs.append(paragraph)
+        
+        return "\n\n".join(paragraphs)
+    
+    @staticmethod
+    def _shingles(text: str, size: int = 3) -> set:
+        words = re.findall(r'\w+', text.lower())
+        if len(words) < size:
+            return set(words)
+        return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    
+    @staticmethod
+    def _containment(a: set, b: set) -> float:
+        """Fraction of `a` contained in `b`"""
+        if not a or not b:
+            return 0.0
+        return len(a & b) / len(a)
     
     def _calculate_document_relevance(self, doc: Any, topic_data: Dict[str, Any]) -> float:
         """Calculate relevance score for a document"""
@@ -363,7 +918,9 @@ class EnhancedContextRetriever:
     def _truncate_to_tokens(self, text: str, max_tokens: int, model: str = "gpt-4") -> str:
         """Truncate text to token limit"""
         try:
-            enc = tiktoken.encoding_for_model(model)
+            enc = get_token_encoder(model)
+            if enc is None:
+                return text[:max_tokens * 4]
             tokens = enc.encode(text)
             if len(tokens) <= max_tokens:
                 return text
@@ -381,37 +938,28 @@ class EnhancedContextRetriever:
 
 class QuestionQualityVerifier:  
     def __init__(self):  
+        from langchain_openai import AzureChatOpenAI
+        from Utility.cassette import llm_client_kwargs
+        settings = get_settings()
         self.llm = AzureChatOpenAI(  
-            azure_deployment=os.getenv('AZURE_OPENAI_CHAT_DEPLOYMENT', 'gpt-4.1'),  
-            api_version=os.getenv('AZURE_OPENAI_API_VERSION', '2024-02-15-preview'),  
+            azure_deployment=settings.azure_openai_chat_deployment,  
+            api_version=settings.azure_openai_api_version,  
             temperature=0,  
-            azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT'),  
-            api_key=os.getenv('AZURE_OPENAI_API_KEY'),  
+            azure_endpoint=settings.azure_openai_endpoint,  
+            api_key=settings.azure_openai_api_key,  
+            **llm_client_kwargs(),
         )  
   
         # ✅ Fixed: Properly escaped curly braces for LangChain PromptTemplate
-        self.verification_template = """  
+        self.verification_template = cache_friendly_template(
+            static_instructions="""  
 You are an expert educational assessment evaluator with deep knowledge of Bloom's taxonomy, difficulty calibration, and subject-specific pedagogy.  
   
 You will receive:  
-- A set of generated questions  
-- The intended subject, grade level, topic, difficulty, and Bloom's taxonomy level  
 - The original context (learning material)  
+- The intended subject, grade level, topic, difficulty, and Bloom's taxonomy level  
+- A set of generated questions  
   
-**Question Details:**
-Subject: {subject}
-Grade: {class_grade}
-Topic: {topic}
-Difficulty: {difficulty}
-Bloom's Level: {bloom_level}
-Question Type: {question_type}
-
-**Context:**
-{context}
-
-**Questions to Evaluate:**
-{questions}
-
 Your task:  
 1. Evaluate the questions for:  
    - **Relevance**: Do they match the provided context and topic?  
@@ -441,7 +989,24 @@ Your task:
 }}  
   
 Do not include any text outside the JSON.  
-"""  
+""",
+            corpus_section="""
+**Context:**
+{context}
+""",
+            request_section="""
+**Question Details:**
+Subject: {subject}
+Grade: {class_grade}
+Topic: {topic}
+Difficulty: {difficulty}
+Bloom's Level: {bloom_level}
+Question Type: {question_type}
+
+**Questions to Evaluate:**
+{questions}
+"""
+        )
   
         self.prompt = PromptTemplate(  
             input_variables=[  
@@ -451,98 +1016,139 @@ Do not include any text outside the JSON.
             template=self.verification_template  
         )  
 
-        logger.info(f"Verification prompt: {self.prompt}")
+        log_payload(logger, "Verification prompt", self.prompt.template, level=logging.DEBUG)
   
         self.chain = self.prompt | self.llm  
   
-    def verify_questions(self, questions: Dict[str, Any], topic_data: Dict[str, Any], context: str) -> Dict[str, Any]:  
-        try:  
-            # Ensure topic_data is a dictionary and has required keys
-            if not isinstance(topic_data, dict):
-                logger.error(f"topic_data is not a dictionary: {type(topic_data)}")
-                topic_data = {}
-                
-            questions_text = json.dumps(questions, indent=2)  
-            response = self.chain.invoke({  
-                "context": context,  
-                "questions": questions_text,  
-                "subject": topic_data.get('subjectName', 'Unknown'),  
-                "class_grade": topic_data.get('classGrade', 'Unknown'),  
-                "topic": topic_data.get('sectionName', 'Unknown'),  
-                "difficulty": topic_data.get('difficulty', 'Unknown'),  
-                "bloom_level": topic_data.get('bloomLevel', 'Unknown'),  
-                "question_type": topic_data.get('questionType', 'Unknown')  
-            })  
-  
-            llm_output = response.content if hasattr(response, 'content') else str(response)  
-            logger.debug(f"Raw verifier output:\n{llm_output}")  
-  
-            verification_result = safe_json_loads(llm_output, default={})  
-  
-            # ✅ Always return a dict  
-            if not isinstance(verification_result, dict):  
-                logger.warning("Verifier returned non-dict; using fallback ACCEPTED result.")  
-                verification_result = {  
-                    "overall_verdict": "ACCEPTED",  
-                    "confidence_score": 80,  
-                    "detailed_feedback": {  
-                        "relevance_score": 80,  
-                        "difficulty_alignment": 80,  
-                        "bloom_taxonomy_alignment": 80,  
-                        "subject_grade_alignment": 80,  
-                        "overall_quality": 80  
-                    },  
-                    "specific_issues": [],  
-                    "improvement_suggestions": []  
-                }  
-  
-            logger.info(f"Verification result: {verification_result.get('overall_verdict', 'UNKNOWN')}")  
-            return verification_result  
+    def _verification_inputs(self, questions: Dict[str, Any], topic_data: Dict[str, Any], context: str) -> Dict[str, Any]:
+        # Ensure topic_data is a dictionary and has required keys
+        if not isinstance(topic_data, dict):
+            logger.error(f"topic_data is not a dictionary: {type(topic_data)}")
+            topic_data = {}
+
+        return {
+            "context": context,
+            "questions": json.dumps(questions, indent=2),
+            "subject": topic_data.get('subjectName', 'Unknown'),
+            "class_grade": topic_data.get('classGrade', 'Unknown'),
+            "topic": topic_data.get('sectionName', 'Unknown'),
+            "difficulty": topic_data.get('difficulty', 'Unknown'),
+            "bloom_level": topic_data.get('bloomLevel', 'Unknown'),
+            "question_type": topic_data.get('questionType', 'Unknown')
+        }
+
+    def _verification_outcome(self, response: Any) -> Dict[str, Any]:
+        llm_output = response.content if hasattr(response, 'content') else str(response)  
+        log_payload(logger, "Raw verifier output", llm_output)
   
-        except Exception as e:  
-            logger.error(f"Error in question verification: {e}")  
-            return {  
+        verification_result = safe_json_loads(llm_output, default={})  
+  
+        # ✅ Always return a dict  
+        if not isinstance(verification_result, dict):  
+            logger.warning("Verifier returned non-dict; using fallback ACCEPTED result.")  
+            verification_result = {  
                 "overall_verdict": "ACCEPTED",  
-                "confidence_score": 70,  
+                "confidence_score": 80,  
                 "detailed_feedback": {  
-                    "relevance_score": 70,  
-                    "difficulty_alignment": 70,  
-                    "bloom_taxonomy_alignment": 70,  
-                    "subject_grade_alignment": 70,  
-                    "overall_quality": 70  
+                    "relevance_score": 80,  
+                    "difficulty_alignment": 80,  
+                    "bloom_taxonomy_alignment": 80,  
+                    "subject_grade_alignment": 80,  
+                    "overall_quality": 80  
                 },  
-                "specific_issues": ["Verification process encountered an error"],  
-                "improvement_suggestions": ["Consider manual review of generated questions"]  
+                "specific_issues": [],  
+                "improvement_suggestions": []  
             }  
+  
+        logger.info(f"Verification result: {verification_result.get('overall_verdict', 'UNKNOWN')}")  
+        return verification_result  
+
+    @staticmethod
+    def _verification_error(e: Exception) -> Dict[str, Any]:
+        logger.error(f"Error in question verification: {e}")  
+        return {  
+            "overall_verdict": "ACCEPTED",  
+            "confidence_score": 70,  
+            "detailed_feedback": {  
+                "relevance_score": 70,  
+                "difficulty_alignment": 70,  
+                "bloom_taxonomy_alignment": 70,  
+                "subject_grade_alignment": 70,  
+                "overall_quality": 70  
+            },  
+            "specific_issues": ["Verification process encountered an error"],  
+            "improvement_suggestions": ["Consider manual review of generated questions"]  
+        }  
+
+    def verify_questions(self, questions: Dict[str, Any], topic_data: Dict[str, Any], context: str) -> Dict[str, Any]:  
+        try:  
+            inputs = self._verification_inputs(questions, topic_data, context)
+            with track_stage('verification') as record:
+                response = self.chain.invoke(inputs)
+                record.update(log_prompt_cache_usage(response, "Verification"))
+            return self._verification_outcome(response)
+        except Exception as e:  
+            return self._verification_error(e)
+
+    async def averify_questions(self, questions: Dict[str, Any], topic_data: Dict[str, Any], context: str) -> Dict[str, Any]:
+        """verify_questions with the LLM call awaited (async server mode)"""
+        try:
+            inputs = self._verification_inputs(questions, topic_data, context)
+            with track_stage('verification') as record:
+                response = await self.chain.ainvoke(inputs)
+                record.update(log_prompt_cache_usage(response, "Verification"))
+            return self._verification_outcome(response)
+        except Exception as e:
+            return self._verification_error(e)
 
 # -------------------------------  
 # Question Generator  
 # -------------------------------  
+# Loops shared by the sync and async entry points are written once as
+# coroutines. The sync side passes blocking calls wrapped by _completed, so
+# the coroutine never suspends and _run_completed finishes it without an
+# event loop.
+def _completed(func: Callable) -> Callable:
+    """`func` as a coroutine function that returns without suspending"""
+    async def call(*args, **kwargs):
+        return func(*args, **kwargs)
+    return call
+
+def _run_completed(coroutine: Any) -> Any:
+    """The result of a coroutine that only awaits _completed calls"""
+    try:
+        coroutine.send(None)
+    except StopIteration as done:
+        return done.value
+    coroutine.close()
+    raise RuntimeError("Coroutine suspended; it awaited something other than a _completed call")
+
 class QuestionGenerator:  
+    # Packing mode: topics asking for at most PACK_MAX_QUESTIONS questions are
+    # bundled, up to PACK_MAX_TOPICS per call, into one keyed-JSON prompt
+    PACK_MAX_QUESTIONS = 2
+    PACK_MAX_TOPICS = 6
+    PACK_OUTPUT_TOKENS_PER_QUESTION = 250
+    # Generation plus up to two revisions, each checked by the verifier
+    MAX_ATTEMPTS = 3
+    
     def __init__(self):  
+        from langchain_openai import AzureChatOpenAI
+        from Utility.cassette import llm_client_kwargs
+        settings = get_settings()
         self.llm = AzureChatOpenAI(  
-            azure_deployment=os.getenv('AZURE_OPENAI_CHAT_DEPLOYMENT', 'gpt-4.1'),  
-            api_version=os.getenv('AZURE_OPENAI_API_VERSION', '2024-02-15-preview'),  
+            azure_deployment=settings.azure_openai_chat_deployment,  
+            api_version=settings.azure_openai_api_version,  
             temperature=0.0,  # Lower temp for more predictable JSON  
-            azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT'),  
-            api_key=os.getenv('AZURE_OPENAI_API_KEY'),  
+            azure_endpoint=settings.azure_openai_endpoint,  
+            api_key=settings.azure_openai_api_key,  
+            **llm_client_kwargs(),
         )  
   
-        # ======== Your Original Question Prompt ========  
-        self.question_template = """  
+        # Static instructions and schema, shared by the question and revision
+        # prompts so a topic's first attempt and its revisions share a prefix
+        generator_instructions = """  
 You are a highly skilled educational question generator.   
-Generate exactly {num_questions} {question_type} questions for:  
-Subject: {subject}  
-Grade: {class_grade}  
-Topic: {topic}  
-Difficulty: {difficulty}  
-Bloom's Level: {bloom_level}  
-  
-Context:  
-{context}  
-  
-Additional Instructions:  
-{instructions}  
   
 🎯 Output Format (Strict JSON):
 {{
@@ -559,24 +1165,41 @@ Additional Instructions:
 output must not be in backticks and must be in json format.Please not write just json.
 correct json format is given above.
 
-
-
-
 Rules:  
 - Each question must have exactly 4 options.  
 - The answer must match one of the options exactly.  
 - The explanation must justify why the answer is correct.  
 - No extra text outside JSON.  
-"""  
+"""
+        context_section = """
+Context:  
+{context}  
+"""
+  
+        # ======== Your Original Question Prompt ========  
+        self.question_template = cache_friendly_template(
+            static_instructions=generator_instructions,
+            corpus_section=context_section,
+            request_section="""
+Generate exactly {num_questions} {question_type} questions for:  
+Subject: {subject}  
+Grade: {class_grade}  
+Topic: {topic}  
+Difficulty: {difficulty}  
+Bloom's Level: {bloom_level}  
+  
+Additional Instructions:  
+{instructions}  
+"""
+        )
   
         # ======== Your Original Revision Prompt ========  
-        self.revision_template = """  
-You are a highly skilled educational question generator.  
+        self.revision_template = cache_friendly_template(
+            static_instructions=generator_instructions,
+            corpus_section=context_section,
+            request_section="""
 You previously generated questions that did not meet quality requirements.  
   
-Context:  
-{context}  
-  
 Original Issues:  
 {quality_issues}  
   
@@ -595,23 +1218,8 @@ Bloom's Level: {bloom_level}
   
 Instructions:  
 {instructions}  
-  
-🎯 Output Format (Strict JSON):
-{{
-"questions": [
-    {{
-    "question": "Your question text here.",
-    "options": ["Option A", "Option B", "Option C", "Option D"],
-    "answer": "Correct option here",
-    "explanation": "Detailed explanation with reasoning."
-    }}
-]
-}} 
-  
-output must not be in backticks and must be in json format.Please not write just json.
-correct json format is given above.
-
-"""  
+"""
+        )
   
         self.prompt = PromptTemplate(  
             input_variables=[  
@@ -630,93 +1238,188 @@ correct json format is given above.
             template=self.revision_template  
         )  
   
+        # ======== Packed Multi-Topic Prompt ========
+        self.packed_template = cache_friendly_template(
+            static_instructions="""  
+You are a highly skilled educational question generator.   
+You will generate questions for several topics at once. Each topic has an id, its own context and its own parameters.  
+  
+🎯 Output Format (Strict JSON), one entry per topic id:
+{{
+"topics": {{
+    "<topic id>": {{
+    "questions": [
+        {{
+        "question": "Your question text here.",
+        "options": ["Option A", "Option B", "Option C", "Option D"],
+        "answer": "Correct option here",
+        "explanation": "Detailed explanation with reasoning."
+        }}
+    ]
+    }}
+}}
+}} 
+  
+output must not be in backticks and must be in json format.
+correct json format is given above.
+
+Rules:  
+- Generate exactly the requested number of questions for every topic id, using only that topic's context.  
+- Each question must have exactly 4 options.  
+- The answer must match one of the options exactly.  
+- The explanation must justify why the answer is correct.  
+- No extra text outside JSON.  
+""",
+            corpus_section="""
+Contexts:  
+{contexts}  
+""",
+            request_section="""
+Subject: {subject}  
+Grade: {class_grade}  
+  
+Topics:  
+{topics}  
+"""
+        )
+        self.packed_prompt = PromptTemplate(
+            input_variables=["contexts", "subject", "class_grade", "topics"],
+            template=self.packed_template
+        )
+  
         self.chain = self.prompt | self.llm  
         self.revision_chain = self.revision_prompt | self.llm  
+        self.packed_chain = self.packed_prompt | self.llm
   
-    def generate_questions(self, topic_data: Dict[str, Any], vectorstore: Any, verifier: QuestionQualityVerifier) -> Dict[str, Any]:  
-        max_attempts = 3  
-        
+    def _attempt_inputs(self, topic_data: Dict[str, Any], context: str, verification_result: Optional[Dict[str, Any]],
+                        attempt: int) -> Tuple[Any, Dict[str, Any]]:
+        """The chain and inputs for one attempt: the question prompt first, then revisions"""
+        inputs = {
+            "context": context,  
+            "num_questions": topic_data.get('numQuestions', 1),  
+            "question_type": topic_data.get('questionType', 'MCQ'),  
+            "subject": topic_data.get('subjectName', 'Unknown'),  
+            "class_grade": topic_data.get('classGrade', 'Unknown'),  
+            "topic": topic_data.get('sectionName', 'Unknown'),  
+            "difficulty": topic_data.get('difficulty', 'Medium'),  
+            "bloom_level": topic_data.get('bloomLevel', 'Remember'),  
+            "instructions": topic_data.get('additionalInstructions', '')  
+        }
+        if attempt == 0:
+            return self.chain, inputs
+
+        # For revision attempts (attempt > 0), use feedback from the previous attempt
+        # verification_result contains feedback from the most recent attempt
+        inputs["quality_issues"] = self._format_issues(verification_result.get('specific_issues', [])) if verification_result else "Previous output was not valid JSON or missing required fields."  
+        inputs["improvement_suggestions"] = self._format_suggestions(verification_result.get('improvement_suggestions', [])) if verification_result else "Ensure output strictly follows the JSON schema."  
+        inputs["specific_improvements"] = self._format_improvements(verification_result) if verification_result else "Return only JSON with the required fields."  
+        return self.revision_chain, inputs
+
+    def _attempt_outcome(self, result: Dict[str, Any], verification_result: Dict[str, Any],
+                         attempt: int) -> Optional[Dict[str, Any]]:
+        """The final result if this attempt ends the loop, else None to revise"""
+        log_payload(logger, "Verification result", verification_result)
+        if verification_result['overall_verdict'] == 'ACCEPTED':  
+            logger.info(f"Questions accepted on attempt {attempt + 1}")  
+            return {  
+                'questions': result,  
+                'verification_result': verification_result,  
+                'attempts_used': attempt + 1  
+            }  
+        logger.info(f"Questions rejected on attempt {attempt + 1}, preparing for revision")  
+        if attempt == self.MAX_ATTEMPTS - 1:  
+            logger.warning("Maximum attempts reached, returning questions despite quality issues")  
+            return {  
+                'questions': result,  
+                'verification_result': verification_result,  
+                'attempts_used': attempt + 1,  
+                'warning': 'Maximum revision attempts reached'  
+            }  
+        return None
+
+    def generate_questions(self, topic_data: Dict[str, Any], vectorstore: Any, verifier: QuestionQualityVerifier,
+                           contexts: Tuple[str, str] = None) -> Dict[str, Any]:  
+        """`contexts` is an already retrieved (generation, verification) context pair"""
         # Ensure topic_data is a dictionary
         if not isinstance(topic_data, dict):
             logger.error(f"topic_data is not a dictionary: {type(topic_data)}")
             raise ValueError("topic_data must be a dictionary")
             
-        context = self._get_context(topic_data, vectorstore)  
+        context, verification_context = contexts or self._get_contexts(topic_data, vectorstore)
         verification_result = None  # Prevents unbound variable error  
   
-        for attempt in range(max_attempts):  
+        for attempt in range(self.MAX_ATTEMPTS):  
             try:  
-                logger.info(f"Question generation attempt {attempt + 1}/{max_attempts}")  
-  
-                if attempt == 0:  
-                    response = self.chain.invoke({  
-                        "context": context,  
-                        "num_questions": topic_data.get('numQuestions', 1),  
-                        "question_type": topic_data.get('questionType', 'MCQ'),  
-                        "subject": topic_data.get('subjectName', 'Unknown'),  
-                        "class_grade": topic_data.get('classGrade', 'Unknown'),  
-                        "topic": topic_data.get('sectionName', 'Unknown'),  
-                        "difficulty": topic_data.get('difficulty', 'Medium'),  
-                        "bloom_level": topic_data.get('bloomLevel', 'Remember'),  
-                        "instructions": topic_data.get('additionalInstructions', '')  
-                    })  
-                else:  
-
-                    # For revision attempts (attempt > 0), use feedback from the previous attempt
-                    # verification_result contains feedback from the most recent attempt
-
-                    quality_issues = self._format_issues(verification_result.get('specific_issues', [])) if verification_result else "Previous output was not valid JSON or missing required fields."  
-                    improvement_suggestions = self._format_suggestions(verification_result.get('improvement_suggestions', [])) if verification_result else "Ensure output strictly follows the JSON schema."  
-                    specific_improvements = self._format_improvements(verification_result) if verification_result else "Return only JSON with the required fields."  
-  
-                    response = self.revision_chain.invoke({  
-                        "context": context,  
-                        "num_questions": topic_data.get('numQuestions', 1),  
-                        "question_type": topic_data.get('questionType', 'MCQ'),  
-                        "subject": topic_data.get('subjectName', 'Unknown'),  
-                        "class_grade": topic_data.get('classGrade', 'Unknown'),  
-                        "topic": topic_data.get('sectionName', 'Unknown'),  
-                        "difficulty": topic_data.get('difficulty', 'Medium'),  
-                        "bloom_level": topic_data.get('bloomLevel', 'Remember'),  
-                        "instructions": topic_data.get('additionalInstructions', ''),  
-                        "quality_issues": quality_issues,  
-                        "improvement_suggestions": improvement_suggestions,  
-                        "specific_improvements": specific_improvements  
-                    })  
-  
-                result = self._parse_llm_response(response)  
-                verification_result = verifier.verify_questions(result, topic_data, context)
-                logger.info(f"\nVerification result: {verification_result}\n")  
-  
-                if verification_result['overall_verdict'] == 'ACCEPTED':  
-                    logger.info(f"Questions accepted on attempt {attempt + 1}")  
-                    return {  
-                        'questions': result,  
-                        'verification_result': verification_result,  
-                        'attempts_used': attempt + 1  
-                    }  
-                else:  
-                    logger.info(f"Questions rejected on attempt {attempt + 1}, preparing for revision")  
-                    if attempt == max_attempts - 1:  
-                        logger.warning("Maximum attempts reached, returning questions despite quality issues")  
-                        return {  
-                            'questions': result,  
-                            'verification_result': verification_result,  
-                            'attempts_used': attempt + 1,  
-                            'warning': 'Maximum revision attempts reached'  
-                        }  
-  
+                logger.info(f"Question generation attempt {attempt + 1}/{self.MAX_ATTEMPTS}")  
+                stage = 'generation' if attempt == 0 else 'revision'
+                chain, inputs = self._attempt_inputs(topic_data, context, verification_result, attempt)
+                with track_stage(stage, attempt=attempt + 1) as record:
+                    response = chain.invoke(inputs)
+                    record.update(log_prompt_cache_usage(response, stage.capitalize()))
+                with track_stage('parsing'):
+                    result = self._parse_llm_response(response)  
+                verification_result = verifier.verify_questions(result, topic_data, verification_context)
+                outcome = self._attempt_outcome(result, verification_result, attempt)
+                if outcome is not None:
+                    return outcome
             except Exception as e:  
                 logger.error(f"Error in attempt {attempt + 1}: {e}")  
-                if attempt == max_attempts - 1:  
+                if attempt == self.MAX_ATTEMPTS - 1:  
                     raise  
   
         raise Exception("Failed to generate questions after maximum attempts")  
-  
+
+    async def agenerate_questions(self, topic_data: Dict[str, Any], vectorstore: Any, verifier: QuestionQualityVerifier,
+                                  contexts: Tuple[str, str] = None) -> Dict[str, Any]:
+        """generate_questions with generation and verification calls awaited
+
+        Retrieval (query embedding plus FAISS search) runs in a worker thread.
+        """
+        if not isinstance(topic_data, dict):
+            logger.error(f"topic_data is not a dictionary: {type(topic_data)}")
+            raise ValueError("topic_data must be a dictionary")
+
+        context, verification_context = contexts or await asyncio.to_thread(self._get_contexts, topic_data, vectorstore)
+        verification_result = None
+
+        for attempt in range(self.MAX_ATTEMPTS):
+            try:
+                logger.info(f"Question generation attempt {attempt + 1}/{self.MAX_ATTEMPTS}")
+                stage = 'generation' if attempt == 0 else 'revision'
+                chain, inputs = self._attempt_inputs(topic_data, context, verification_result, attempt)
+                with track_stage(stage, attempt=attempt + 1) as record:
+                    response = await chain.ainvoke(inputs)
+                    record.update(log_prompt_cache_usage(response, stage.capitalize()))
+                with track_stage('parsing'):
+                    result = self._parse_llm_response(response)
+                verification_result = await verifier.averify_questions(result, topic_data, verification_context)
+                outcome = self._attempt_outcome(result, verification_result, attempt)
+                if outcome is not None:
+                    return outcome
+            except Exception as e:
+                logger.error(f"Error in attempt {attempt + 1}: {e}")
+                if attempt == self.MAX_ATTEMPTS - 1:
+                    raise
+
+        raise Exception("Failed to generate questions after maximum attempts")
+
     def _get_context(self, topic_data: Dict[str, Any], vectorstore: Any) -> str:  
         """Get enhanced context using the new EnhancedContextRetriever"""
+        return self._get_contexts(topic_data, vectorstore)[0]
+    
+    def _get_contexts(self, topic_data: Dict[str, Any], vectorstore: Any) -> Tuple[str, str]:
+        """Generation context plus the context the verifier sees
+        
+        The verifier only checks questions against the material, so with
+        VERIFIER_CONTEXT_MODE=compressed it gets the keypoint summaries of the
+        same chunks instead of the full text a second time.
+        """
+        with track_stage('retrieval', topic=topic_data.get('sectionName', '')):
+            return self._retrieve_contexts(topic_data, vectorstore)
+    
+    def _retrieve_contexts(self, topic_data: Dict[str, Any], vectorstore: Any) -> Tuple[str, str]:
         if not vectorstore:
-            return ""
+            return "", ""
             
         try:
             # Use the enhanced context retriever
@@ -728,18 +1431,25 @@ correct json format is given above.
                 logger.debug(f"Context preview: {context[:200]}...")
             else:
                 logger.warning("No context retrieved from enhanced retriever")
+            
+            verification_context = context
+            if (get_settings().verifier_context_mode == 'compressed'
+                    and context_retriever.last_context_mode != 'compressed'
+                    and context_retriever.last_ranked_docs):
+                verification_context = context_retriever.compress_context(max_tokens=context_retriever.last_max_tokens) or context
                 
-            return context
+            return context, verification_context
             
         except Exception as e:
             logger.error(f"Error in enhanced context retrieval: {e}")
             # Fallback to basic context retrieval
-            return self._get_basic_context(topic_data, vectorstore)
+            context = self._get_basic_context(topic_data, vectorstore)
+            return context, context
     
     def _get_basic_context(self, topic_data: Dict[str, Any], vectorstore: Any) -> str:
         """Fallback basic context retrieval method"""
         def truncate_to_tokens(text: str, max_tokens: int = 4000, model: str = "gpt-4") -> str:  
-            enc = tiktoken.encoding_for_model(model)  
+            enc = get_token_encoder(model)  
             tokens = enc.encode(text)  
             truncated_tokens = tokens[:max_tokens]  
             return enc.decode(truncated_tokens)  
@@ -768,13 +1478,16 @@ correct json format is given above.
   
     def _parse_llm_response(self, response: Any) -> Dict[str, Any]:  
         llm_output = response.content if hasattr(response, 'content') else str(response)  
-        logger.info(f"Raw LLM output: {llm_output}")  
+        log_payload(logger, "Raw LLM output", llm_output)
   
         # Ensure llm_output is a string
         if not isinstance(llm_output, str):
             llm_output = str(llm_output)
         
         result = safe_json_loads(llm_output, default=None)  
+        return self._validate_questions(result)
+    
+    def _validate_questions(self, result: Any) -> Dict[str, Any]:
         if not isinstance(result, dict) or 'questions' not in result:  
             raise ValueError("Invalid response format: missing 'questions' key or not a dict")  
   
@@ -795,6 +1508,128 @@ correct json format is given above.
   
         return result  
   
+    def generate_questions_packed(self, topics: Dict[str, Dict[str, Any]], vectorstore: Any,
+                                  verifier: QuestionQualityVerifier, token_budget: int = None) -> Dict[str, Dict[str, Any]]:
+        """Generate questions for several small topics per LLM call
+        
+        `topics` maps a topic id to its topic data. Topics asking for at most
+        PACK_MAX_QUESTIONS questions are packed while their contexts plus the
+        expected output fit `token_budget` (PACK_TOKEN_BUDGET). Returns
+        generate_questions-shaped results keyed by topic id for the small
+        topics; larger topics are left to the caller. Each packed topic is
+        still verified on its own, and one that comes back missing, invalid or
+        rejected goes through generate_questions with revisions.
+        """
+        packs = self._plan_packs(topics, vectorstore, token_budget)
+        return _run_completed(self._generate_packs(
+            packs, vectorstore, verifier, generate=_completed(self.generate_questions),
+            invoke=_completed(self.packed_chain.invoke), verify=_completed(verifier.verify_questions)
+        ))
+
+    async def agenerate_questions_packed(self, topics: Dict[str, Dict[str, Any]], vectorstore: Any,
+                                         verifier: QuestionQualityVerifier, token_budget: int = None) -> Dict[str, Dict[str, Any]]:
+        """generate_questions_packed with generation and verification calls awaited
+
+        Retrieval for the packing plan runs in a worker thread.
+        """
+        packs = await asyncio.to_thread(self._plan_packs, topics, vectorstore, token_budget)
+        return await self._generate_packs(
+            packs, vectorstore, verifier, generate=self.agenerate_questions,
+            invoke=self.packed_chain.ainvoke, verify=verifier.averify_questions
+        )
+
+    async def _generate_packs(self, packs: List[List[tuple]], vectorstore: Any, verifier: QuestionQualityVerifier,
+                              generate: Callable, invoke: Callable, verify: Callable) -> Dict[str, Dict[str, Any]]:
+        """The packing loop of both entry points; `generate`, `invoke` and `verify` are awaited"""
+        results = {}
+        for pack in packs:
+            if len(pack) < 2:
+                topic_id, topic_data, context, verification_context, _ = pack[0]
+                results[topic_id] = await generate(topic_data, vectorstore, verifier, (context, verification_context))
+                continue
+            
+            logger.info(f"Generating {len(pack)} packed topics in one call: {[topic_id for topic_id, *_ in pack]}")
+            try:
+                with track_stage('generation', packed_topics=len(pack)) as record:
+                    response = await invoke(self._packed_inputs(pack))
+                    record.update(log_prompt_cache_usage(response, "Packed generation"))
+                packed = self._parse_packed_response(response, len(pack))
+            except Exception as e:
+                logger.error(f"Packed generation failed: {e}")
+                packed = {}
+            
+            for topic_id, topic_data, context, verification_context, _ in pack:
+                try:
+                    result = self._validate_questions(packed.get(topic_id) if isinstance(packed, dict) else None)
+                    verification_result = await verify(result, topic_data, verification_context)
+                    if verification_result.get('overall_verdict') == 'ACCEPTED':
+                        results[topic_id] = self._packed_result(result, verification_result)
+                        continue
+                    logger.info(f"Packed topic {topic_id} rejected; generating it on its own")
+                except Exception as e:
+                    logger.warning(f"Packed output for topic {topic_id} unusable ({e}); generating it on its own")
+                results[topic_id] = await generate(topic_data, vectorstore, verifier, (context, verification_context))
+        
+        return results
+
+    def _plan_packs(self, topics: Dict[str, Dict[str, Any]], vectorstore: Any, token_budget: int = None) -> List[List[tuple]]:
+        """Small topics with their contexts, greedily packed in request order
+
+        Each entry is (topic id, topic data, context, verification context, token cost).
+        """
+        token_budget = token_budget or get_settings().pack_token_budget
+        
+        candidates = []
+        for topic_id, topic_data in topics.items():
+            try:
+                num_questions = int(topic_data.get('numQuestions', 1))
+            except (TypeError, ValueError):
+                num_questions = 1
+            if num_questions <= self.PACK_MAX_QUESTIONS:
+                context, verification_context = self._get_contexts(topic_data, vectorstore)
+                cost = count_tokens(context) + num_questions * self.PACK_OUTPUT_TOKENS_PER_QUESTION
+                candidates.append((topic_id, {**topic_data, 'numQuestions': num_questions}, context, verification_context, cost))
+        
+        # Greedy packing in request order
+        packs, current, used = [], [], 0
+        for candidate in candidates:
+            if current and (used + candidate[4] > token_budget or len(current) >= self.PACK_MAX_TOPICS):
+                packs.append(current)
+                current, used = [], 0
+            current.append(candidate)
+            used += candidate[4]
+        if current:
+            packs.append(current)
+        return packs
+
+    def _packed_inputs(self, pack: List[tuple]) -> Dict[str, str]:
+        return {
+            "contexts": "\n\n".join(f"[{topic_id}]\n{context}" for topic_id, _, context, _, _ in pack),
+            "subject": pack[0][1].get('subjectName', 'Unknown'),
+            "class_grade": pack[0][1].get('classGrade', 'Unknown'),
+            "topics": "\n".join(
+                f"- [{topic_id}] {data['numQuestions']} {data.get('questionType', 'MCQ')} questions; "
+                f"Topic: {data.get('sectionName', 'Unknown')}; Difficulty: {data.get('difficulty', 'Medium')}; "
+                f"Bloom's Level: {data.get('bloomLevel', 'Remember')}; "
+                f"Instructions: {data.get('additionalInstructions', '') or 'None'}"
+                for topic_id, data, _, _, _ in pack
+            )
+        }
+
+    def _parse_packed_response(self, response: Any, packed_topics: int) -> Any:
+        with track_stage('parsing', packed_topics=packed_topics):
+            llm_output = response.content if hasattr(response, 'content') else str(response)
+            return (safe_json_loads(llm_output, default={}) or {}).get('topics', {})
+
+    @staticmethod
+    def _packed_result(result: Dict[str, Any], verification_result: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'questions': result,
+            'verification_result': verification_result,
+            'attempts_used': 1,
+            'packed': True
+        }
+  
     def _format_issues(self, issues: List[str]) -> str:  
         return "\n".join([f"- {issue}" for issue in issues]) if issues else "No specific issues identified"  
   
@@ -829,9 +1664,54 @@ correct json format is given above.
 # -------------------------------  
 # Initialize components  
 # -------------------------------  
-document_processor = DocumentProcessor()  
-question_generator = QuestionGenerator()  
-question_verifier = QuestionQualityVerifier()  
+# `mylang4.document_processor`, `.question_generator` and `.question_verifier`
+# are built on first access (PEP 562 module __getattr__), so importing the
+# module creates no Azure clients and needs no credentials. Construction is
+# serialized so concurrent first requests share one instance; call warm_up()
+# to build everything ahead of traffic.
+_COMPONENT_FACTORIES = {
+    'document_processor': DocumentProcessor,
+    'question_generator': QuestionGenerator,
+    'question_verifier': QuestionQualityVerifier,
+}
+_component_lock = threading.Lock()
+
+
+def __getattr__(name: str) -> Any:
+    factory = _COMPONENT_FACTORIES.get(name)
+    if factory is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _component_lock:
+        if name not in globals():
+            globals()[name] = factory()
+            logger.info(f"Initialized {name}")
+    return globals()[name]
+
+
+# Settings that the Azure clients are built from; a .env change to any of
+# these rebuilds the components that already exist, off the request path
+AZURE_SETTINGS = {'azure_openai_api_key', 'azure_openai_endpoint', 'azure_openai_api_version', 'azure_openai_chat_deployment'}
+
+
+def _rebuild_components(old, new, changed) -> None:
+    if not changed & AZURE_SETTINGS:
+        return
+    for name, factory in _COMPONENT_FACTORIES.items():
+        if name in globals():
+            component = factory()  # built before the swap; requests keep using the old one meanwhile
+            with _component_lock:
+                globals()[name] = component
+            logger.info(f"Rebuilt {name} after config change")
+
+
+config.on_change(_rebuild_components)
+
+
+def warm_up() -> None:
+    """Build all components and the token encoder now instead of on first use"""
+    for name in _COMPONENT_FACTORIES:
+        __getattr__(name)
+    get_token_encoder()
 
 # Enhanced components for Phase 1 improvements
 # These will be automatically used by the existing components
@@ -7,12 +7,20 @@ Tests all new features while ensuring app.py compatibility
 import os
 import sys
 import json
+import random
 import logging
 from typing import Dict, Any
 
 # Add current directory to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+# Offline by default: an in-process fake Azure OpenAI answers chat and
+# embedding calls (TEST_LIVE_AZURE=true uses the configured endpoint and .env)
+if os.getenv('TEST_LIVE_AZURE', 'false').lower() != 'true':
+    from Utility.fake_azure_openai import FakeAzureOpenAI
+    fake_azure = FakeAzureOpenAI(embedding_dimensions=256).start()
+    os.environ.update(AZURE_OPENAI_ENDPOINT=fake_azure.endpoint, AZURE_OPENAI_API_KEY='fake', ENV_FILE=os.devnull)
+
 # Import the enhanced mylang4 module
 import mylang4
 
@@ -43,6 +51,28 @@ def test_enhanced_document_processor():
             quality_score = processor._calculate_quality_score(text)
             logger.info(f"Quality score for {content_type}: {quality_score:.2f}")
         
+        # Batch classification agrees with the per-page path, and hyphens,
+        # dashes and "and/or" are not mistaken for arithmetic
+        batch_types = mylang4.classify_content_types(list(test_texts.values()))
+        if batch_types != list(test_texts.keys()):
+            raise ValueError(f"Batch classifier returned {batch_types}")
+        if processor._detect_content_type("A well-known, self-paced guide - read and/or skim it.") != 'default':
+            raise ValueError("Punctuation should not count as mathematics indicators")
+        # Each indicator scores once per page, however often it repeats
+        repeated = "The cell divides. Each cell has a nucleus; cell walls and cell membranes. This poem tells a story."
+        if mylang4.content_type_scores([repeated, "x + 1 = 2 + y = 3 √ √"]).tolist() != [[0, 1, 2], [3, 0, 0]]:
+            raise ValueError(f"Repeated indicators counted more than once: {mylang4.content_type_scores([repeated])}")
+        if mylang4.classify_content_types([repeated, "नमस्ते? यह π है"]) != ['literature', 'mathematics']:
+            raise ValueError("Repeated keyword outweighed distinct indicators, or a non-ASCII symbol was missed")
+
+        # Batch quality features line up with the texts they were computed from
+        texts = list(test_texts.values()) + ["Too short."]
+        features = mylang4.chunk_quality_features(texts)
+        if features['word_count'].tolist() != [len(text.split()) for text in texts]:
+            raise ValueError("Batch word counts do not match")
+        if features['quality_score'][-1] != 0.0 or features['quality_score'][0] != processor._calculate_quality_score(texts[0]):
+            raise ValueError(f"Unexpected batch quality scores: {features['quality_score']}")
+        
         logger.info("✅ Enhanced Document Processor tests passed!")
         return True
         
@@ -90,6 +120,617 @@ def test_enhanced_context_retriever():
         logger.error(f"❌ Enhanced Context Retriever test failed: {e}")
         return False
 
+def test_token_chunk_offsets():
+    """Test that token-budget chunks record the character offset they start at"""
+    logger.info("🧪 Testing Token Chunk Offsets...")
+
+    try:
+        from langchain_core.documents import Document
+
+        sentences = [
+            "Photosynthesis converts light energy into chemical energy in green plants.",
+            "Solve x^2 - 5x + 6 = 0 by factorisation.",
+            "Chlorophyll absorbs red and blue light.",
+            "Repeated phrases test that each chunk is found after the one before it.",
+        ]
+        pages = [
+            Document(page_content="\n\n".join(" ".join(sentences[(page + i) % 4] for i in range(5)) for _ in range(12)),
+                     metadata={'source': 'notes.pdf', 'page': page})
+            for page in range(3)
+        ]
+        splitter = mylang4.DocumentProcessor(chunking_mode='token').text_splitters['default']
+        chunks = splitter.split_documents(pages)
+        if len(chunks) <= 2 * len(pages):
+            raise ValueError(f"Expected several chunks per page, got {len(chunks)}")
+
+        overlapping = 0
+        for page in pages:
+            page_chunks = [chunk for chunk in chunks if chunk.metadata['page'] == page.metadata['page']]
+            previous_end = None
+            for chunk in page_chunks:
+                start = chunk.metadata['start_index']
+                if page.page_content[start:start + len(chunk.page_content)] != chunk.page_content:
+                    raise ValueError(f"start_index {start} does not locate a chunk of page {page.metadata['page']}")
+                if previous_end is not None and start < previous_end:
+                    overlapping += 1
+                previous_end = start + len(chunk.page_content)
+        if not overlapping:
+            raise ValueError("Expected overlapping chunks")
+
+        # A chunk that is not after the previous one is searched from the
+        # page start; one that is nowhere in the page gets no offset
+        text = "alpha beta gamma delta"
+        class Reordered(mylang4.TokenBudgetTextSplitter):
+            def split_text(self, text):
+                return ["gamma delta", "alpha beta", "not in the page"]
+        reordered = Reordered(chunk_size=10, chunk_overlap=0).create_documents([text])
+        if [doc.metadata.get('start_index') for doc in reordered] != [11, 0, None]:
+            raise ValueError(f"Unexpected fallback offsets {[doc.metadata for doc in reordered]}")
+
+        logger.info("✅ Token Chunk Offsets tests passed!")
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ Token Chunk Offsets test failed: {e}")
+        return False
+
+def test_context_assembly():
+    """Test that overlapping chunks are stitched and duplicate paragraphs dropped"""
+    logger.info("🧪 Testing Context Assembly...")
+    
+    try:
+        from langchain_core.documents import Document
+        
+        text = " ".join(f"Sentence {i} explains one step of photosynthesis in green plants." for i in range(40))
+        page = Document(page_content=text, metadata={'source': 'notes.pdf', 'page': 0})
+        chunks = mylang4.document_processor.text_splitters['mathematics'].split_documents([page])
+        if len(chunks) < 2:
+            raise ValueError("Expected the page to split into overlapping chunks")
+        
+        retriever = mylang4.EnhancedContextRetriever(None)
+        duplicate = Document(page_content=chunks[0].page_content, metadata={})
+        assembled = retriever._assemble_context(list(reversed(chunks)) + [duplicate])
+        if assembled != text:
+            raise ValueError("Stitched context does not reproduce the page text")
+        
+        retriever._combine_and_rank_documents(chunks, {'subjectName': 'Science', 'sectionName': 'photosynthesis'})
+        stats = retriever.last_assembly_stats
+        logger.info(f"Context assembly stats: {stats}")
+        if stats['tokens_saved'] <= 0:
+            raise ValueError("Expected overlap tokens to be saved")
+        
+        logger.info("✅ Context Assembly tests passed!")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Context Assembly test failed: {e}")
+        return False
+
+def test_compressed_context():
+    """Test that keypoint summaries shrink the context and keep definitions"""
+    logger.info("🧪 Testing Compressed Context...")
+    
+    try:
+        from langchain_core.documents import Document
+        from Utility.config import Settings
+        
+        filler = [
+            "Plants need sunlight, water and carbon dioxide to grow well in the garden.",
+            "The teacher showed the class a diagram of a leaf during the morning lesson.",
+            "Many students found the experiment with the coloured water very interesting.",
+            "Farmers in the region plant crops at the start of the rainy season each year.",
+        ]
+        definition = "Photosynthesis is the process by which green plants make glucose from light energy."
+        docs = [
+            Document(page_content=" ".join(filler[i:] + [definition] + filler[:i]), metadata={'source': f'notes-{i}.pdf', 'page': 0})
+            for i in range(3)
+        ]
+        
+        summaries = mylang4.summarize_chunks([doc.page_content for doc in docs], max_sentences=2)
+        if not all(definition in summary for summary in summaries):
+            raise ValueError(f"Definition sentence missing from summaries: {summaries}")
+        
+        retriever = mylang4.EnhancedContextRetriever(None)
+        retriever._combine_and_rank_documents(docs, {'subjectName': 'Science', 'sectionName': 'photosynthesis'})
+        compressed = retriever.compress_context()
+        stats = retriever.last_assembly_stats
+        logger.info(f"Compressed context stats: {stats}")
+        if compressed.count(definition) != 1:
+            raise ValueError("Keypoints repeated across chunks should appear once")
+        if stats['tokens_compressed'] >= stats['tokens_after']:
+            raise ValueError("Expected the compressed context to use fewer tokens")
+        
+        # Compression runs only when asked for: recall topics still get full context
+        if retriever._context_mode({'bloomLevel': 'Remember'}) != 'full':
+            raise ValueError("Context should default to full")
+        if retriever._context_mode({'bloomLevel': 'Remember', 'contextMode': 'compressed'}) != 'compressed':
+            raise ValueError("contextMode should select compressed context")
+        if Settings.from_mapping({}).verifier_context_mode != 'full':
+            raise ValueError("The verifier should get full context by default")
+        
+        logger.info("✅ Compressed Context tests passed!")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Compressed Context test failed: {e}")
+        return False
+
+def test_packed_generation():
+    """Test that small topics share one call and unpack per topic id"""
+    logger.info("🧪 Testing Packed Generation...")
+    
+    generator = mylang4.question_generator
+    original_chain = generator.packed_chain
+    try:
+        from langchain_core.messages import AIMessage
+        
+        question = {"question": "Q?", "options": ["A", "B", "C", "D"], "answer": "A", "explanation": "Because."}
+        calls = []
+        
+        class PackedChain:
+            def invoke(self, inputs):
+                calls.append(inputs)
+                return AIMessage(content=json.dumps({"topics": {"0": {"questions": [question]}, "1": {"questions": [question, question]}}}))
+        
+        class AcceptingVerifier:
+            def verify_questions(self, questions, topic_data, context):
+                return {'overall_verdict': 'ACCEPTED'}
+        
+        class AsyncOnlyPackedChain(PackedChain):
+            def invoke(self, inputs):
+                raise RuntimeError("Async packed generation made a blocking LLM call")
+            async def ainvoke(self, inputs):
+                return PackedChain.invoke(self, inputs)
+        
+        class AsyncOnlyVerifier:
+            def verify_questions(self, questions, topic_data, context):
+                raise RuntimeError("Async packed generation made a blocking verification call")
+            async def averify_questions(self, questions, topic_data, context):
+                return {'overall_verdict': 'ACCEPTED'}
+        
+        generator.packed_chain = PackedChain()
+        topics = {
+            "0": {'sectionName': 'Cells', 'numQuestions': 1, 'subjectName': 'Science', 'classGrade': '8'},
+            "1": {'sectionName': 'Atoms', 'numQuestions': 2, 'subjectName': 'Science', 'classGrade': '8'},
+            "2": {'sectionName': 'Forces', 'numQuestions': 10, 'subjectName': 'Science', 'classGrade': '8'},
+        }
+        results = generator.generate_questions_packed(topics, None, AcceptingVerifier())
+        
+        if len(calls) != 1 or "[0]" not in calls[0]['topics'] or "[1]" not in calls[0]['topics']:
+            raise ValueError("Expected both small topics in a single packed call")
+        if set(results) != {"0", "1"}:
+            raise ValueError(f"Only small topics should be packed, got {sorted(results)}")
+        if len(results["1"]['questions']['questions']) != 2 or not results["1"].get('packed'):
+            raise ValueError("Packed results were not unpacked per topic")
+        
+        # The async path awaits the packed call and the per-topic verification
+        import asyncio
+        generator.packed_chain = AsyncOnlyPackedChain()
+        async_results = asyncio.run(generator.agenerate_questions_packed(topics, None, AsyncOnlyVerifier()))
+        if len(calls) != 2 or async_results != results:
+            raise ValueError(f"Async packed generation differs from the sync path: {async_results}")
+        
+        logger.info("✅ Packed Generation tests passed!")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Packed Generation test failed: {e}")
+        return False
+    finally:
+        generator.packed_chain = original_chain
+
+def test_async_generation():
+    """Test that agenerate_questions awaits its LLM calls and revises like the sync path"""
+    logger.info("🧪 Testing Async Generation...")
+
+    generator = mylang4.question_generator
+    original_chains = (generator.chain, generator.revision_chain)
+    try:
+        import asyncio
+        import time
+        from langchain_core.messages import AIMessage
+
+        question = {"question": "Q?", "options": ["A", "B", "C", "D"], "answer": "A", "explanation": "Because."}
+
+        class AsyncOnlyChain:
+            def __init__(self, stage):
+                self.stage = stage
+                self.calls = 0
+            def invoke(self, inputs):
+                raise RuntimeError("Async generation made a blocking LLM call")
+            async def ainvoke(self, inputs):
+                self.calls += 1
+                await asyncio.sleep(0.2)
+                return AIMessage(content=json.dumps({"questions": [question]}))
+
+        class RejectOnceVerifier:
+            def __init__(self):
+                self.verdicts = {}
+            async def averify_questions(self, questions, topic_data, context):
+                await asyncio.sleep(0.2)
+                topic = topic_data['sectionName']
+                self.verdicts[topic] = self.verdicts.get(topic, 0) + 1
+                return {'overall_verdict': 'ACCEPTED' if self.verdicts[topic] > 1 else 'REJECTED'}
+
+        generator.chain, generator.revision_chain = AsyncOnlyChain('generation'), AsyncOnlyChain('revision')
+        verifier = RejectOnceVerifier()
+
+        async def run_many(count):
+            return await asyncio.gather(*(
+                generator.agenerate_questions({'sectionName': f'Topic {i}', 'numQuestions': 1}, None, verifier,
+                                              contexts=("ctx", "ctx"))
+                for i in range(count)
+            ))
+
+        started = time.perf_counter()
+        results = asyncio.run(run_many(20))
+        elapsed = time.perf_counter() - started
+
+        if any(result['attempts_used'] != 2 for result in results):
+            raise ValueError("Rejected questions were not revised once")
+        if generator.chain.calls != 20 or generator.revision_chain.calls != 20:
+            raise ValueError("Expected one generation and one revision call per topic")
+        # 20 topics x 4 sequential 0.2s calls each: ~0.8s concurrently, 16s serially
+        if elapsed > 4:
+            raise ValueError(f"Concurrent generations did not overlap ({elapsed:.1f}s)")
+
+        logger.info("✅ Async Generation tests passed!")
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ Async Generation test failed: {e}")
+        return False
+    finally:
+        generator.chain, generator.revision_chain = original_chains
+
+def test_stage_metrics():
+    """Test that stages are recorded per request and aggregated across requests"""
+    logger.info("🧪 Testing Stage Metrics...")
+    
+    try:
+        from Utility import stage_metrics
+        
+        with stage_metrics.track_stage('retrieval') as record:
+            record['prompt_tokens'] = 5  # no active recording: discarded
+        
+        for request_number in range(2):
+            with stage_metrics.recording(f"req-{request_number}") as recorder:
+                with stage_metrics.stage_labels(topic='Cells', batch=0):
+                    with stage_metrics.track_stage('generation') as record:
+                        record.update({'prompt_tokens': 100, 'cached_tokens': 64, 'completion_tokens': 20})
+                    with stage_metrics.track_stage('parsing'):
+                        pass
+                with stage_metrics.track_stage('pdf'):
+                    pass
+        
+        summary = recorder.summary()
+        if summary['stages']['generation']['prompt_tokens'] != 100 or summary['records'][0]['topic'] != 'Cells':
+            raise ValueError(f"Unexpected request summary: {summary}")
+        if 'topic' in summary['records'][-1]:
+            raise ValueError("Stage labels leaked outside their block")
+        
+        snapshot = stage_metrics.aggregate.snapshot()
+        generation = snapshot['stages']['generation']
+        if generation['calls'] < 2 or generation['completion_tokens'] < 40 or 'seconds_p95' not in generation:
+            raise ValueError(f"Unexpected aggregate: {snapshot}")
+        
+        # Prometheus export: LLM stages feed the per-chain histogram and counters
+        from Utility import prometheus_metrics
+        with stage_metrics.track_stage('verification') as record:
+            record['prompt_tokens'] = 42
+        body, _ = prometheus_metrics.render_metrics()
+        exposition = body.decode('utf-8')
+        for sample in ('prashnotri_llm_call_duration_seconds_count{chain="verification"}',
+                       'prashnotri_llm_tokens_total{chain="verification",kind="prompt"}'):
+            if sample not in exposition:
+                raise ValueError(f"Missing Prometheus sample: {sample}")
+        
+        logger.info("✅ Stage Metrics tests passed!")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Stage Metrics test failed: {e}")
+        return False
+
+def test_tracing():
+    """Test that spans nest under the request span and export as OTLP/JSON lines"""
+    logger.info("🧪 Testing Tracing...")
+    
+    try:
+        import tempfile
+        from Utility import stage_metrics, tracing
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_path = os.path.join(temp_dir, 'traces.jsonl')
+            tracing.configure(trace_path)
+            try:
+                with tracing.span('POST /api/generate-questions') as root:
+                    with tracing.span('topic_batch', topic='Cells', batch=0):
+                        with stage_metrics.track_stage('generation', attempt=1) as record:
+                            record['prompt_tokens'] = 120
+                    try:
+                        with tracing.span('webhook', webhook='n8n'):
+                            raise ConnectionError("offline")
+                    except ConnectionError:
+                        pass
+            finally:
+                tracing.configure(None)
+            
+            with open(trace_path) as f:
+                spans = [line_span for line in f for line_span in json.loads(line)['resourceSpans'][0]['scopeSpans'][0]['spans']]
+        
+        by_name = {span['name']: span for span in spans}
+        if set(by_name) != {'POST /api/generate-questions', 'topic_batch', 'generation', 'webhook'}:
+            raise ValueError(f"Unexpected spans: {list(by_name)}")
+        if {span['traceId'] for span in spans} != {root.trace_id}:
+            raise ValueError("Spans were not exported under one trace")
+        if by_name['generation']['parentSpanId'] != by_name['topic_batch']['spanId']:
+            raise ValueError("Stage span is not a child of its topic batch")
+        attributes = {a['key']: a['value'] for a in by_name['generation']['attributes']}
+        if attributes.get('prompt_tokens') != {'intValue': '120'} or attributes.get('attempt') != {'intValue': '1'}:
+            raise ValueError(f"Stage record missing from span attributes: {attributes}")
+        if by_name['webhook']['status']['code'] != tracing.STATUS_ERROR:
+            raise ValueError("Failed webhook span not marked as an error")
+        
+        with tracing.span('disabled') as span:
+            if span.recording:
+                raise ValueError("Spans recorded while tracing is disabled")
+        
+        logger.info("✅ Tracing tests passed!")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Tracing test failed: {e}")
+        return False
+
+def test_structured_logging():
+    """Test queued JSON logging with request ids and sampled, truncated payloads"""
+    logger.info("🧪 Testing Structured Logging...")
+    
+    try:
+        import tempfile
+        from Utility import logging as log_setup
+        
+        root = logging.getLogger()
+        saved_handlers, saved_level = list(root.handlers), root.level
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            log_file = os.path.join(temp_dir, 'app.log')
+            saved_rate, saved_chars = log_setup.PAYLOAD_SAMPLE_RATE, log_setup.PAYLOAD_MAX_CHARS
+            try:
+                log_setup.setup_logging(log_file=log_file)
+                log_setup.PAYLOAD_SAMPLE_RATE, log_setup.PAYLOAD_MAX_CHARS = 1.0, 10
+                log_setup.bind_request_id('req-123')
+                logging.getLogger('mylang4').info("Generating questions")
+                log_setup.log_payload(logging.getLogger('mylang4'), "Raw LLM output", "x" * 50)
+                log_setup.PAYLOAD_SAMPLE_RATE = 0.0
+                log_setup.log_payload(logging.getLogger('mylang4'), "Raw LLM output", "dropped")
+            finally:
+                log_setup.bind_request_id(None)
+                log_setup.stop_logging()
+                log_setup.PAYLOAD_SAMPLE_RATE, log_setup.PAYLOAD_MAX_CHARS = saved_rate, saved_chars
+                for handler in list(root.handlers):
+                    root.removeHandler(handler)
+                for handler in saved_handlers:
+                    root.addHandler(handler)
+                root.setLevel(saved_level)
+            
+            with open(log_file, encoding='utf-8') as f:
+                entries = [json.loads(line) for line in f]
+        
+        if len(entries) != 2 or any(entry.get('request_id') != 'req-123' for entry in entries):
+            raise ValueError(f"Unexpected log entries: {entries}")
+        payload = entries[1]
+        if payload['payload'] != "x" * 10 or payload['payload_chars'] != 50 or not payload['payload_truncated']:
+            raise ValueError(f"Payload not truncated: {payload}")
+        
+        logger.info("✅ Structured Logging tests passed!")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Structured Logging test failed: {e}")
+        return False
+
+def test_config_reload():
+    """Test that .env changes swap in a new immutable snapshot and notify listeners"""
+    logger.info("🧪 Testing Config Reload...")
+    
+    try:
+        import dataclasses
+        import tempfile
+        from Utility.config import ConfigStore
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            env_file = os.path.join(temp_dir, '.env')
+            with open(env_file, 'w') as f:
+                f.write("S3_BUCKET_NAME=papers-a\nPACK_TOKEN_BUDGET=4000\n")
+            store = ConfigStore(env_file)
+            changes = []
+            store.on_change(lambda old, new, changed: changes.append(changed))
+            
+            before = store.get()
+            if before.s3_bucket != 'papers-a' or before.pack_token_budget != 4000:
+                raise ValueError(f"Unexpected initial settings: {before}")
+            if store.reload_if_changed():
+                raise ValueError("Reloaded without a file change")
+            
+            with open(env_file, 'w') as f:
+                f.write("S3_BUCKET_NAME=papers-b\nPACK_TOKEN_BUDGET=4000\n")
+            os.utime(env_file, ns=(0, os.stat(env_file).st_mtime_ns + 1_000_000))
+            if not store.reload_if_changed():
+                raise ValueError("File change not picked up")
+            changed_bucket = store.get()
+            
+            # A key deleted from the file is gone after the reload: nothing
+            # copies the file into os.environ
+            with open(env_file, 'w') as f:
+                f.write("PACK_TOKEN_BUDGET=4000\nMONGODB_URI=mongodb://db:27017\n")
+            os.utime(env_file, ns=(0, os.stat(env_file).st_mtime_ns + 2_000_000))
+            store.reload_if_changed()
+            if 'S3_BUCKET_NAME' in os.environ or store.get().s3_bucket is not None:
+                raise ValueError("A key removed from the env file kept its old value")
+            if store.get().mongodb_uri != 'mongodb://db:27017' or store.read_values().get('MONGODB_URI') != 'mongodb://db:27017':
+                raise ValueError("Start-up values are not read from the env file")
+        
+        if changed_bucket.s3_bucket != 'papers-b' or before.s3_bucket != 'papers-a':
+            raise ValueError("Snapshot was not swapped, or the old one was mutated")
+        if changes != [{'s3_bucket'}, {'s3_bucket', 'mongodb_uri'}]:
+            raise ValueError(f"Unexpected change notifications: {changes}")
+        try:
+            before.s3_bucket = 'mutated'
+            raise ValueError("Settings snapshot is mutable")
+        except dataclasses.FrozenInstanceError:
+            pass
+        
+        logger.info("✅ Config Reload tests passed!")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Config Reload test failed: {e}")
+        return False
+
+def test_memory_governor():
+    """Test admission near the soft limit and drain-then-recycle at the high-water mark"""
+    logger.info("🧪 Testing Memory Governor...")
+    
+    try:
+        import signal
+        import tempfile
+        import time
+        import tracemalloc
+        from Utility.memory_governor import MemoryGovernor, MemoryPressure
+        
+        rss = {'mb': 100.0}
+        recycled = []
+        previous_handler = signal.signal(signal.SIGUSR1, lambda signum, frame: recycled.append(signum))
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                governor = MemoryGovernor(lambda: rss['mb'], high_water_mb=1000, soft_limit_mb=800,
+                                          report_dir=temp_dir, min_worker_seconds=0)
+                governor.start(recycle_signal=signal.SIGUSR1, interval=3600)
+                
+                with governor.job():
+                    rss['mb'] = 850.0
+                    try:
+                        with governor.job():
+                            raise ValueError("Job admitted above the soft limit")
+                    except MemoryPressure:
+                        pass
+                    if not tracemalloc.is_tracing():
+                        raise ValueError("tracemalloc not started above the soft limit")
+                    rss['mb'] = 1200.0
+                    governor.check()
+                    time.sleep(0.2)
+                    if recycled or not governor.draining:
+                        raise ValueError("Worker recycled while a job was still in flight")
+                
+                deadline = time.time() + 5
+                while not recycled and time.time() < deadline:
+                    time.sleep(0.05)
+                if recycled != [signal.SIGUSR1]:
+                    raise ValueError("Worker was not recycled after draining")
+                reports = os.listdir(temp_dir)
+                if len(reports) != 1 or not reports[0].startswith('tracemalloc_'):
+                    raise ValueError(f"Missing allocation report: {reports}")
+        finally:
+            signal.signal(signal.SIGUSR1, previous_handler)
+            tracemalloc.stop()
+        
+        logger.info("✅ Memory Governor tests passed!")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Memory Governor test failed: {e}")
+        return False
+
+def test_memory_governor_soft_limit_recycle():
+    """Test that a worker stuck between the soft limit and the high-water mark is recycled"""
+    logger.info("🧪 Testing Memory Governor Soft-Limit Recycle...")
+    
+    try:
+        import signal
+        import tempfile
+        import time
+        import tracemalloc
+        from Utility.memory_governor import MemoryGovernor, MemoryPressure
+        
+        def wait_for(recycled):
+            deadline = time.time() + 5
+            while not recycled and time.time() < deadline:
+                time.sleep(0.05)
+        
+        rss = {'mb': 850.0}
+        recycled = []
+        previous_handler = signal.signal(signal.SIGUSR1, lambda signum, frame: recycled.append(signum))
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                # Consecutive refusals: RSS never reaches the high-water mark
+                governor = MemoryGovernor(lambda: rss['mb'], high_water_mb=1000, soft_limit_mb=800,
+                                          report_dir=temp_dir, min_worker_seconds=0,
+                                          max_refusals=3, soft_grace_seconds=3600)
+                governor.start(recycle_signal=signal.SIGUSR1, interval=3600)
+                for _ in range(2):
+                    try:
+                        with governor.job():
+                            raise ValueError("Job admitted above the soft limit")
+                    except MemoryPressure:
+                        pass
+                if governor.draining:
+                    raise ValueError("Drained before reaching the refusal limit")
+                rss['mb'] = 500.0
+                with governor.job():
+                    pass
+                rss['mb'] = 850.0
+                for _ in range(3):
+                    try:
+                        with governor.job():
+                            raise ValueError("Job admitted above the soft limit")
+                    except MemoryPressure:
+                        pass
+                wait_for(recycled)
+                if recycled != [signal.SIGUSR1]:
+                    raise ValueError("Worker was not recycled after consecutive refusals")
+                
+                # Idle above the soft limit: no jobs arrive at all
+                recycled.clear()
+                governor = MemoryGovernor(lambda: rss['mb'], high_water_mb=1000, soft_limit_mb=800,
+                                          report_dir=temp_dir, min_worker_seconds=0,
+                                          max_refusals=1000, soft_grace_seconds=0.1)
+                governor.start(recycle_signal=signal.SIGUSR1, interval=3600)
+                governor.check()
+                if governor.draining:
+                    raise ValueError("Drained before the soft-limit grace period")
+                time.sleep(0.15)
+                governor.check()
+                wait_for(recycled)
+                if recycled != [signal.SIGUSR1]:
+                    raise ValueError("Idle worker above the soft limit was not recycled")
+                
+                # ...but not while a job that may free memory is still running
+                recycled.clear()
+                rss['mb'] = 500.0
+                governor = MemoryGovernor(lambda: rss['mb'], high_water_mb=1000, soft_limit_mb=800,
+                                          report_dir=temp_dir, min_worker_seconds=0,
+                                          max_refusals=1000, soft_grace_seconds=0.1)
+                governor.start(recycle_signal=signal.SIGUSR1, interval=3600)
+                with governor.job():
+                    rss['mb'] = 850.0
+                    governor.check()
+                    time.sleep(0.15)
+                    governor.check()
+                    if governor.draining:
+                        raise ValueError("Drained above the soft limit with a job in flight")
+        finally:
+            signal.signal(signal.SIGUSR1, previous_handler)
+            tracemalloc.stop()
+        
+        logger.info("✅ Memory Governor soft-limit recycle tests passed!")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Memory Governor soft-limit recycle test failed: {e}")
+        return False
+
 def test_app_compatibility():
     """Test that the enhanced mylang4 maintains app.py compatibility"""
     logger.info("🧪 Testing App.py Compatibility...")
@@ -123,6 +764,23 @@ def test_app_compatibility():
         if not hasattr(verifier, 'verify_questions'):
             raise AttributeError("Missing verify_questions method")
         
+        # Components are built lazily, once, even under concurrent first access
+        import subprocess
+        probe = (
+            "import os, mylang4\n"
+            "assert 'question_generator' not in vars(mylang4), 'built at import'\n"
+            "os.environ.update(AZURE_OPENAI_API_KEY='x', AZURE_OPENAI_ENDPOINT='https://x.invalid')\n"
+            "from concurrent.futures import ThreadPoolExecutor\n"
+            "with ThreadPoolExecutor(8) as pool:\n"
+            "    built = list(pool.map(lambda _: id(mylang4.question_verifier), range(8)))\n"
+            "assert len(set(built)) == 1, 'built more than once'\n"
+        )
+        env = {k: v for k, v in os.environ.items() if not k.startswith('AZURE_OPENAI')}
+        result = subprocess.run([sys.executable, '-c', probe], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Lazy initialization probe failed: {result.stderr.strip().splitlines()[-1:]}")
+        
         logger.info("✅ App.py compatibility tests passed!")
         return True
         
@@ -198,6 +856,372 @@ def test_question_generation_compatibility():
         logger.error(f"❌ Question Generation Output Format test failed: {e}")
         return False
 
+def test_fake_azure_openai():
+    """Test the offline stand-in's wire format, determinism and 429 injection"""
+    logger.info("🧪 Testing Fake Azure OpenAI...")
+
+    try:
+        import base64
+        import httpx
+        import numpy as np
+        from Utility.fake_azure_openai import FakeAzureOpenAI, LatencyModel
+
+        latency = LatencyModel('lognormal:0.5,0.3', random.Random(7))
+        samples = [latency.sample() for _ in range(2000)]
+        if not 0.45 < float(np.median(samples)) < 0.55:
+            raise ValueError(f"lognormal median {np.median(samples):.3f}, expected about 0.5")
+
+        prompt = "Generate exactly 3 MCQ questions for:\nTopic: Fractions\n"
+        chat = {'messages': [{'role': 'user', 'content': prompt}]}
+        with FakeAzureOpenAI(rate_limit=1.0) as limited:
+            response = httpx.post(f"{limited.endpoint}/openai/deployments/gpt-4.1/chat/completions", json=chat)
+            if response.status_code != 429 or 'Retry-After' not in response.headers:
+                raise ValueError(f"Expected an injected 429, got {response.status_code}")
+
+        with FakeAzureOpenAI(embedding_dimensions=32) as fake:
+            url = f"{fake.endpoint}/openai/deployments/gpt-4.1/chat/completions?api-version=2024-02-15-preview"
+            first, second = (httpx.post(url, json=chat).json() for _ in range(2))
+            content = first['choices'][0]['message']['content']
+            if content != second['choices'][0]['message']['content']:
+                raise ValueError("Replies are not deterministic")
+            if len(json.loads(content)['questions']) != 3 or first['usage']['completion_tokens'] <= 0:
+                raise ValueError("Expected 3 templated questions with token usage")
+
+            embedded = httpx.post(f"{fake.endpoint}/openai/deployments/text-embedding-3-large/embeddings",
+                                  json={'input': ['cell wall', [101, 102]], 'encoding_format': 'base64'}).json()
+            vectors = [np.frombuffer(base64.b64decode(item['embedding']), dtype='<f4') for item in embedded['data']]
+            if [v.shape[0] for v in vectors] != [32, 32] or abs(float(np.linalg.norm(vectors[0])) - 1) > 1e-5:
+                raise ValueError("Embeddings should be unit vectors of the configured size")
+            if fake.stats['chat'] != 2 or fake.stats['embedded_inputs'] != 2:
+                raise ValueError(f"Unexpected stats {fake.stats}")
+
+        logger.info("✅ Fake Azure OpenAI tests passed!")
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ Fake Azure OpenAI test failed: {e}")
+        return False
+
+def test_cassette_record_replay():
+    """Test that recorded chat and embedding responses replay without the network"""
+    logger.info("🧪 Testing LLM Cassette...")
+
+    try:
+        import time
+        import asyncio
+        import tempfile
+        import openai
+        from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
+        from Utility.cassette import Cassette, llm_client_kwargs
+        from Utility.fake_azure_openai import FakeAzureOpenAI
+
+        def clients(cassette, endpoint):
+            common = dict(api_version='2024-02-15-preview', azure_endpoint=endpoint, api_key='fake', **llm_client_kwargs(cassette))
+            return (AzureChatOpenAI(azure_deployment='gpt-4.1', temperature=0, max_retries=0, **common),
+                    AzureOpenAIEmbeddings(azure_deployment='text-embedding-3-large', check_embedding_ctx_length=False, **common))
+
+        prompt = "Generate exactly 2 MCQ questions for:\nTopic: Fractions\n"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'calls.cassette')
+            with FakeAzureOpenAI(chat_latency='fixed:0.2', embedding_dimensions=16) as fake:
+                chat, embeddings = clients(Cassette(path, 'record'), fake.endpoint)
+                recorded = chat.invoke(prompt)
+                vectors = embeddings.embed_documents(['cell wall', 'nucleus'])
+
+            # The fake server is gone: every answer below comes from the file
+            replay = Cassette(path, 'replay', latency_scale=0.0)
+            if len(replay) != 2:
+                raise ValueError(f"Expected 2 recorded responses, found {len(replay)}")
+            chat, embeddings = clients(replay, 'https://replay.invalid')
+            started = time.perf_counter()
+            replayed = chat.invoke(prompt)
+            if replayed.content != recorded.content or replayed.usage_metadata != recorded.usage_metadata:
+                raise ValueError("Replayed chat response differs from the recording")
+            if time.perf_counter() - started > 0.15:
+                raise ValueError("Zero-latency replay should not wait for the recorded latency")
+            if asyncio.run(chat.ainvoke(prompt)).content != recorded.content:
+                raise ValueError("Async replay differs from the recording")
+            if embeddings.embed_documents(['cell wall', 'nucleus']) != vectors:
+                raise ValueError("Replayed embeddings differ from the recording")
+            try:
+                chat.invoke("A prompt that was never recorded")
+                raise ValueError("A cassette miss should fail in replay mode")
+            except openai.NotFoundError:
+                pass
+            if replay.stats != {'hits': 3, 'misses': 1, 'recorded': 0}:
+                raise ValueError(f"Unexpected cassette stats {replay.stats}")
+
+            chat, _ = clients(Cassette(path, 'replay', latency_scale=1.0), 'https://replay.invalid')
+            started = time.perf_counter()
+            chat.invoke(prompt)
+            if time.perf_counter() - started < 0.2:
+                raise ValueError("Original-latency replay should take the recorded time")
+
+        logger.info("✅ LLM Cassette tests passed!")
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ LLM Cassette test failed: {e}")
+        return False
+
+def test_request_profiler():
+    """Test sampled request profiles, their formats and the admin gate"""
+    logger.info("🧪 Testing Request Profiler...")
+
+    try:
+        import time
+        import tempfile
+        from Utility import profiler
+
+        def spin_for_profile(seconds):
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                sum(range(1000))
+
+        saved = profiler.PROFILE_DIR, profiler.PROFILE_ADMIN_TOKEN, profiler.PROFILE_SAMPLE_RATE
+        with tempfile.TemporaryDirectory() as temp_dir:
+            try:
+                profiler.PROFILE_DIR, profiler.PROFILE_ADMIN_TOKEN, profiler.PROFILE_SAMPLE_RATE = temp_dir, 'admin-secret', 0.0
+                if not profiler.wants_profile('1', 'admin-secret') or profiler.wants_profile('1', 'guess') or profiler.wants_profile(None, 'admin-secret'):
+                    raise ValueError("Only admins asking with X-Profile should be profiled")
+
+                with profiler.profiling('../paper 1', 'POST /api/generate-questions') as profile_id:
+                    spin_for_profile(0.3)
+                if profile_id != '.._paper_1':
+                    raise ValueError(f"Request id not sanitized: {profile_id}")
+
+                collapsed = open(os.path.join(temp_dir, profile_id + '.collapsed.txt')).read()
+                counts = {line.rsplit(' ', 1)[0]: int(line.rsplit(' ', 1)[1]) for line in collapsed.splitlines()}
+                spinning = sum(count for stack, count in counts.items() if 'spin_for_profile' in stack)
+                if spinning < 0.8 * sum(counts.values()) or sum(counts.values()) < 20:
+                    raise ValueError(f"Expected most of {sum(counts.values())} samples in spin_for_profile")
+
+                with open(os.path.join(temp_dir, profile_id + '.speedscope.json')) as f:
+                    speedscope = json.load(f)
+                profile = speedscope['profiles'][0]
+                if any(index >= len(speedscope['shared']['frames']) for stack in profile['samples'] for index in stack):
+                    raise ValueError("speedscope samples reference unknown frames")
+                if not 0.25 < sum(profile['weights']) <= profile['endValue'] + 0.01:
+                    raise ValueError(f"Sample weights should add up to the profiled time, got {sum(profile['weights'])}")
+
+                if [p['id'] for p in profiler.list_profiles()] != [profile_id]:
+                    raise ValueError("Saved profile is not listed")
+                if profiler.profile_file(profile_id, 'collapsed') != profile_id + '.collapsed.txt':
+                    raise ValueError("Saved profile cannot be found by id")
+                if profiler.profile_file('../../etc/passwd') or profiler.profile_file(profile_id, 'pstats'):
+                    raise ValueError("Only saved profiles in known formats may be served")
+            finally:
+                profiler.PROFILE_DIR, profiler.PROFILE_ADMIN_TOKEN, profiler.PROFILE_SAMPLE_RATE = saved
+
+        logger.info("✅ Request Profiler tests passed!")
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ Request Profiler test failed: {e}")
+        return False
+
+def test_mmap_vectorstore_roundtrip():
+    """Test that a persisted index can be re-opened memory-mapped"""
+    logger.info("🧪 Testing Memory-Mapped Vectorstore...")
+    
+    try:
+        import tempfile
+        from langchain_core.documents import Document
+        from langchain_community.embeddings import FakeEmbeddings
+        from langchain_community.vectorstores import FAISS
+        from Utility.mmap_store import save_mmap_store, load_mmap_store, is_mmap_store
+        
+        embeddings = FakeEmbeddings(size=32)
+        docs = [
+            Document(page_content=f"Chunk {i} about algebra", metadata={
+                'source': 'notes.pdf', 'page': i, 'content_type': 'mathematics',
+                'word_count': 4, 'quality_score': 0.7
+            })
+            for i in range(10)
+        ]
+        vectorstore = FAISS.from_documents(docs, embeddings)
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            save_mmap_store(vectorstore, tmp_dir)
+            if not is_mmap_store(tmp_dir):
+                raise ValueError("Manifest not written")
+            
+            store = load_mmap_store(tmp_dir, embeddings)
+            if len(store) != len(docs):
+                raise ValueError(f"Expected {len(docs)} vectors, got {len(store)}")
+            
+            # Searching by a stored vector must return that chunk first
+            vector = vectorstore.index.reconstruct(3)
+            top_doc = store.similarity_search_by_vector(vector, k=1)[0]
+            if top_doc.page_content != docs[3].page_content or top_doc.metadata != docs[3].metadata:
+                raise ValueError(f"Unexpected nearest chunk: {top_doc.page_content}")
+            
+            # A second load in the same process reuses the mapping
+            if load_mmap_store(tmp_dir, embeddings) is not store:
+                raise ValueError("Store was re-mapped instead of reused")
+        
+        logger.info("✅ Memory-Mapped Vectorstore tests passed!")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Memory-Mapped Vectorstore test failed: {e}")
+        return False
+
+def test_incremental_index_append():
+    """Test that appends skip known chunk_ids and removals are compacted away"""
+    logger.info("🧪 Testing Incremental Index Append...")
+    
+    try:
+        import tempfile
+        from langchain_core.documents import Document
+        from langchain_community.embeddings import FakeEmbeddings
+        from Utility import mmap_store
+        
+        embeddings = FakeEmbeddings(size=16)
+        
+        def chapter(chunk_range, note_id):
+            return [
+                Document(page_content=f"Chunk {i}", metadata={'chunk_id': f"c{i}", 'note_id': note_id})
+                for i in chunk_range
+            ]
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            first = mmap_store.append_documents(tmp_dir, chapter(range(6), 'ch1'), embeddings)
+            second = mmap_store.append_documents(tmp_dir, chapter(range(4, 10), 'ch2'), embeddings)
+            if first != {'added': 6, 'skipped': 0} or second != {'added': 4, 'skipped': 2}:
+                raise ValueError(f"Unexpected append stats: {first}, {second}")
+            
+            store = mmap_store.load_mmap_store(tmp_dir, embeddings)
+            if len(store) != 10 or len(store.segments) != 2:
+                raise ValueError(f"Expected 10 vectors in 2 segments, got {len(store)} in {len(store.segments)}")
+
+            # Known ids are found through each segment's id index, and
+            # segments written before it existed fall back to their chunk store
+            first_segment = os.path.join(tmp_dir, store.segments[0][0])
+            os.remove(os.path.join(first_segment, mmap_store.IDS_FILE))
+            if [doc.metadata['chunk_id'] for doc in mmap_store.unseen_documents(tmp_dir, chapter(range(8, 12), 'ch3'))] != ['c10', 'c11']:
+                raise ValueError("Id index lookup disagrees with the stored chunk ids")
+            if mmap_store.append_documents(tmp_dir, chapter(range(3), 'ch1'), embeddings) != {'added': 0, 'skipped': 3}:
+                raise ValueError("Chunks in a segment without an id index were appended again")
+
+            # Removing chapter 2 crosses the tombstone ratio and compacts
+            removed = mmap_store.remove_documents(tmp_dir, metadata_filter={'note_id': 'ch2'})
+            store = mmap_store.load_mmap_store(tmp_dir, embeddings)
+            if removed != 4 or len(store) != 6 or len(store.segments) != 1:
+                raise ValueError(f"Unexpected state after removal: removed={removed}, size={len(store)}")
+            
+            results = store.similarity_search_by_vector(embeddings.embed_query("Chunk 1"), k=10)
+            if any(doc.metadata['note_id'] != 'ch1' for doc in results):
+                raise ValueError("Removed chunks were returned by search")
+        
+        logger.info("✅ Incremental Index Append tests passed!")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Incremental Index Append test failed: {e}")
+        return False
+
+def test_async_note_ingestion():
+    """Test that async note analysis awaits its embedding calls and indexes like the sync path"""
+    logger.info("🧪 Testing Async Note Ingestion...")
+    
+    try:
+        import asyncio
+        import hashlib
+        import tempfile
+        from langchain_core.documents import Document
+        from langchain_core.embeddings import Embeddings
+        from Utility import mmap_store
+        
+        def vector(text):
+            return [byte / 255 for byte in hashlib.sha256(text.encode()).digest()[:8]]
+        
+        class AsyncOnlyEmbeddings(Embeddings):
+            def __init__(self):
+                self.batches = []
+            def embed_documents(self, texts):
+                raise RuntimeError("Async ingestion made a blocking embedding call")
+            def embed_query(self, text):
+                return vector(text)
+            async def aembed_documents(self, texts):
+                self.batches.append(len(texts))
+                return [vector(text) for text in texts]
+        
+        def chapter(chunk_range):
+            return [Document(page_content=f"Chunk {i} about cells", metadata={'chunk_id': f"c{i}"}) for i in chunk_range]
+        
+        processor = mylang4.DocumentProcessor()
+        processor.embeddings = AsyncOnlyEmbeddings()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index_path = os.path.join(tmp_dir, 'course')
+            processor._split_document = lambda *args: chapter(range(6))
+            first = asyncio.run(processor.aingest_document('notes.pdf', index_path))
+            processor._split_document = lambda *args: chapter(range(4, 10))
+            second = asyncio.run(processor.aingest_document('notes.pdf', index_path))
+            if first != {'added': 6, 'skipped': 0} or second != {'added': 4, 'skipped': 2}:
+                raise ValueError(f"Unexpected append stats: {first}, {second}")
+            if processor.embeddings.batches != [6, 4]:
+                raise ValueError(f"Expected only unseen chunks to be embedded, got batches {processor.embeddings.batches}")
+            
+            store_path = os.path.join(tmp_dir, 'latest')
+            vectorstore, chunks = asyncio.run(processor.aprocess_uploaded_document('notes.pdf', persist_directory=store_path))
+            if len(chunks) != 6 or vectorstore.index.ntotal != 6 or not mmap_store.is_mmap_store(store_path):
+                raise ValueError("One-shot index was not built from the awaited embeddings")
+            if vectorstore.similarity_search("Chunk 7 about cells", k=1)[0].page_content != "Chunk 7 about cells":
+                raise ValueError("Searching the one-shot index did not find the query's chunk")
+        
+        logger.info("✅ Async Note Ingestion tests passed!")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Async Note Ingestion test failed: {e}")
+        return False
+
+def test_metadata_prefiltered_search():
+    """Test that filtered searches only return eligible chunks"""
+    logger.info("🧪 Testing Metadata Prefiltered Search...")
+    
+    try:
+        import tempfile
+        from langchain_core.documents import Document
+        from langchain_community.embeddings import FakeEmbeddings
+        from Utility import mmap_store
+        
+        embeddings = FakeEmbeddings(size=16)
+        subjects = ['Mathematics', 'Science', 'English']
+        docs = [
+            Document(page_content=f"Chunk {i}", metadata={
+                'chunk_id': f"c{i}", 'subject': subjects[i % 3], 'grade': '10',
+                'page': i, 'quality_score': 1.0 if i % 2 else 0.4
+            })
+            for i in range(30)
+        ]
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mmap_store.append_documents(tmp_dir, docs, embeddings)
+            store = mmap_store.load_mmap_store(tmp_dir, embeddings)
+            query = embeddings.embed_query("Chunk")
+            
+            results = store.similarity_search_by_vector(query, k=30, filter={
+                'subject': 'Science', 'min_quality_score': 0.5, 'page_range': (0, 20)
+            })
+            expected = {f"c{i}" for i in range(21) if i % 3 == 1 and i % 2}
+            if {doc.metadata['chunk_id'] for doc in results} != expected:
+                raise ValueError(f"Unexpected filtered results: {[doc.metadata['chunk_id'] for doc in results]}")
+            
+            # The retriever keeps 'unknown' chunks eligible for the topic's subject
+            retriever = mylang4.EnhancedContextRetriever(store)
+            metadata_filter = retriever._build_metadata_filter({'subjectName': 'Science', 'classGrade': '10'})
+            if metadata_filter != {'subject': ['Science', 'unknown'], 'grade': ['10', 'unknown']}:
+                raise ValueError(f"Unexpected metadata filter: {metadata_filter}")
+        
+        logger.info("✅ Metadata Prefiltered Search tests passed!")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Metadata Prefiltered Search test failed: {e}")
+        return False
+
 def run_comprehensive_test():
     """Run all tests and provide a comprehensive report"""
     logger.info("🚀 Starting Comprehensive Test Suite for Enhanced mylang4.py")
@@ -206,8 +1230,26 @@ def run_comprehensive_test():
     tests = [
         ("Enhanced Document Processor", test_enhanced_document_processor),
         ("Enhanced Context Retriever", test_enhanced_context_retriever),
+        ("Token Chunk Offsets", test_token_chunk_offsets),
+        ("Context Assembly", test_context_assembly),
+        ("Compressed Context", test_compressed_context),
+        ("Packed Generation", test_packed_generation),
+        ("Async Generation", test_async_generation),
+        ("Stage Metrics", test_stage_metrics),
+        ("Tracing", test_tracing),
+        ("Structured Logging", test_structured_logging),
+        ("Config Reload", test_config_reload),
+        ("Memory Governor", test_memory_governor),
+        ("Memory Governor Soft-Limit Recycle", test_memory_governor_soft_limit_recycle),
+        ("Request Profiler", test_request_profiler),
         ("App.py Compatibility", test_app_compatibility),
-        ("Question Generation Output Format", test_question_generation_compatibility)
+        ("Question Generation Output Format", test_question_generation_compatibility),
+        ("Fake Azure OpenAI", test_fake_azure_openai),
+        ("LLM Cassette", test_cassette_record_replay),
+        ("Memory-Mapped Vectorstore", test_mmap_vectorstore_roundtrip),
+        ("Incremental Index Append", test_incremental_index_append),
+        ("Async Note Ingestion", test_async_note_ingestion),
+        ("Metadata Prefiltered Search", test_metadata_prefiltered_search)
     ]
     
     results = {}